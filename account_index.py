@@ -0,0 +1,121 @@
+import bisect
+import threading
+from functools import lru_cache
+
+# ---------------------------
+# Sorted username index for ListAccounts.
+# Names are kept in a list of (lowercase name, name) tuples sorted
+# case-insensitively, so a literal prefix becomes a bisect range instead of a
+# scan over every account, and results come back in a stable order that
+# page tokens can resume from.
+#
+# Patterns are wildcards, never raw regexes:
+#   "al"    - plain text, case-insensitive substring match (the old behaviour)
+#   "al*"   - "*" matches any run of characters, "?" exactly one
+# Wildcard patterns must match the whole name; the literal text before the
+# first wildcard narrows the search to a prefix range. Matching never
+# backtracks further than the last "*" (see glob_match), so no pattern costs
+# more than len(name) * len(pattern) per name.
+# A search copies candidates out a chunk at a time and matches them without
+# the lock, so a slow ListAccounts never holds up CreateAccount.
+# ---------------------------
+MAX_PATTERN_LENGTH = 128
+WILDCARDS = "*?"
+# names copied out of the index per lock acquisition during a search
+SCAN_CHUNK = 1024
+
+
+#whether name[offset:] matches the whole wildcard `pattern`. Two pointers; on a mismatch
+#only the last "*" takes one more character, so earlier stars are never revisited
+def glob_match(pattern, name, offset=0):
+    p = 0
+    n = offset
+    star = -1
+    resume = 0
+    while n < len(name):
+        if p < len(pattern) and (pattern[p] == "?" or pattern[p] == name[n]):
+            p += 1
+            n += 1
+        elif p < len(pattern) and pattern[p] == "*":
+            star = p
+            resume = n
+            p += 1
+        elif star >= 0:
+            p = star + 1
+            resume += 1
+            n = resume
+        else:
+            return False
+    while p < len(pattern) and pattern[p] == "*":
+        p += 1
+    return p == len(pattern)
+
+
+#(literal prefix, matcher or None) for a pattern; cached so repeat queries skip compilation
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    lowered = pattern.lower()
+    if not any(c in lowered for c in WILDCARDS):
+        return "", lambda name: lowered in name
+    first = min(lowered.index(c) for c in WILDCARDS if c in lowered)
+    prefix = lowered[:first]
+    if lowered[first:] == "*":
+        # "prefix*": every name in the prefix range matches
+        return prefix, None
+    rest = lowered[first:]
+    offset = len(prefix)
+    return prefix, lambda name: glob_match(rest, name, offset)
+
+
+class AccountIndex:
+    def __init__(self):
+        self.keys = []
+        self.lock = threading.Lock()
+
+    def add(self, username):
+        key = (username.lower(), username)
+        with self.lock:
+            i = bisect.bisect_left(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                self.keys.insert(i, key)
+
+    def remove(self, username):
+        key = (username.lower(), username)
+        with self.lock:
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+
+    def clear(self):
+        with self.lock:
+            self.keys = []
+
+    #replace the contents with many names at once (one sort instead of an insert per name)
+    def load(self, usernames):
+        keys = sorted({(username.lower(), username) for username in usernames})
+        with self.lock:
+            self.keys = keys
+
+    #matching names in case-insensitive order, after `page_token` (the last name of the
+    #previous page); returns (names, next_page_token) with "" once nothing is left
+    def search(self, pattern="", page_size=0, page_token=""):
+        prefix, matcher = compile_pattern(pattern) if pattern else ("", None)
+        matches = []
+        after = (page_token.lower(), page_token) if page_token else None
+        while True:
+            with self.lock:
+                keys = self.keys
+                start = bisect.bisect_left(keys, (prefix,))
+                if after is not None:
+                    start = max(start, bisect.bisect_right(keys, after))
+                chunk = keys[start:start + SCAN_CHUNK]
+            for lowered, name in chunk:
+                if not lowered.startswith(prefix):
+                    return matches, ""
+                if matcher is None or matcher(lowered):
+                    matches.append(name)
+                    if len(matches) == page_size:
+                        return matches, name
+            if len(chunk) < SCAN_CHUNK:
+                return matches, ""
+            after = chunk[-1]
@@ -0,0 +1,241 @@
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+
+import grpc
+
+from metrics import method_name, rewrap
+
+# ---------------------------
+# Authentication.
+# Passwords are stored as salted scrypt hashes ("scrypt$n$r$p$salt$hash"). The
+# deliberately slow hash runs only in CreateAccount and Login. A successful
+# Login gets an opaque random session token, kept in an expiring in-memory
+# SessionCache. Every other RPC carries the token as "authorization: Bearer
+# <token>" metadata, and an interceptor checks it with one dictionary lookup.
+# The interceptor also makes sure the caller only acts as themselves: the
+# request's identity field ("username", or "sender" for sends) must name the
+# token's user.
+# Tokens are not persisted; after a restart clients log in again.
+# ---------------------------
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+DEFAULT_SCRYPT_N = 2 ** 14
+AUTH_HEADER = "authorization"
+TOKEN_PREFIX = "Bearer "
+# RPCs that work without a session; GetStats is per process, like the metrics
+# endpoint, and must answer whichever worker or node a caller reaches
+PUBLIC_METHODS = frozenset({"CreateAccount", "Login", "GetStats"})
+# sessions guard ChatService only; internal services check their own callers
+GUARDED_SERVICE = "/chat.ChatService/"
+IDENTITY_FIELDS = ("username", "sender")
+
+
+def make_password_hash(password, n=DEFAULT_SCRYPT_N, r=8, p=1):
+    salt = os.urandom(SALT_BYTES)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES)
+    return f"{SCHEME}${n}${r}${p}${salt.hex()}${key.hex()}"
+
+
+#constant-time check of a password against a stored hash; stores written
+#before hashing moved to the server hold the client's digest as-is
+def check_password(stored, password):
+    if not stored.startswith(SCHEME + "$"):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    _, n, r, p, salt, key = stored.split("$")
+    candidate = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p), dklen=len(key) // 2)
+    return hmac.compare_digest(candidate, bytes.fromhex(key))
+
+
+class SessionCache:
+    def __init__(self, ttl_s=3600, max_sessions=100000):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        # token -> (username, expires_at monotonic seconds), oldest first; every session
+        # gets the same lifetime when it is added, so this is also the order of expiry
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    #a new token for the user, or None while the cache is full of live sessions
+    def issue(self, username):
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                self.evict()
+                if len(self.sessions) >= self.max_sessions:
+                    return None
+            self.sessions[token] = (username, time.monotonic() + self.ttl_s)
+        return token
+
+    #the token's user, or None if the token is unknown or expired
+    def lookup(self, token):
+        entry = self.sessions.get(token)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self.revoke(token)
+            return None
+        return entry[0]
+
+    def revoke(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    #drop every session of a user (account deleted)
+    def revoke_user(self, username):
+        with self.lock:
+            for token in [t for t, (name, _) in self.sessions.items() if name == username]:
+                del self.sessions[token]
+
+    #remove and return the session tokens of some users, {username: [token, ...]} (handed to another node)
+    def take_users(self, usernames):
+        taken = {}
+        with self.lock:
+            for token, (name, _) in list(self.sessions.items()):
+                if name in usernames:
+                    taken.setdefault(name, []).append(token)
+                    del self.sessions[token]
+        return taken
+
+    #accept a token issued elsewhere, with a fresh lifetime; a moved user keeps their
+    #session even if that takes the cache past max_sessions
+    def adopt(self, token, username):
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                self.evict()
+            self.sessions[token] = (username, time.monotonic() + self.ttl_s)
+
+    #make room (caller holds the lock): drop expired sessions from the front, live ones are kept
+    def evict(self):
+        now = time.monotonic()
+        sessions = self.sessions
+        while sessions:
+            token, (_, expires) = next(iter(sessions.items()))
+            if expires >= now:
+                break
+            del sessions[token]
+
+
+def is_guarded(full_method):
+    return full_method.startswith(GUARDED_SERVICE) and method_name(full_method) not in PUBLIC_METHODS
+
+
+#session token from call metadata, or None
+def token_from_metadata(metadata):
+    for key, value in metadata or ():
+        if key == AUTH_HEADER and value.startswith(TOKEN_PREFIX):
+            return value[len(TOKEN_PREFIX):]
+    return None
+
+
+#None if the request may act as `username`, else the reason it may not
+def identity_error(request, username):
+    for field in IDENTITY_FIELDS:
+        if field in request.DESCRIPTOR.fields_by_name:
+            claimed = getattr(request, field)
+            if claimed and claimed != username:
+                return f"Session belongs to '{username}', not '{claimed}'"
+            return None
+    return None
+
+
+class AuthInterceptor(grpc.ServerInterceptor):
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not is_guarded(handler_call_details.method):
+            return handler
+        username = self.sessions.lookup(token_from_metadata(handler_call_details.invocation_metadata))
+
+        def unary_request(behavior):
+            def wrapper(request, context):
+                if username is None:
+                    context.abort(grpc.StatusCode.UNAUTHENTICATED, "Missing or expired session token")
+                error = identity_error(request, username)
+                if error:
+                    context.abort(grpc.StatusCode.PERMISSION_DENIED, error)
+                return behavior(request, context)
+            return wrapper
+
+        def streaming_request(behavior):
+            def wrapper(request_iterator, context):
+                if username is None:
+                    context.abort(grpc.StatusCode.UNAUTHENTICATED, "Missing or expired session token")
+
+                def checked():
+                    for request in request_iterator:
+                        error = identity_error(request, username)
+                        if error:
+                            context.abort(grpc.StatusCode.PERMISSION_DENIED, error)
+                        yield request
+                return behavior(checked(), context)
+            return wrapper
+
+        return rewrap(handler, unary_request, unary_request, streaming_request, streaming_request)
+
+
+class AsyncAuthInterceptor(grpc.aio.ServerInterceptor):
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or not is_guarded(handler_call_details.method):
+            return handler
+        username = self.sessions.lookup(token_from_metadata(handler_call_details.invocation_metadata))
+
+        async def check(request, context):
+            if username is None:
+                await context.abort(grpc.StatusCode.UNAUTHENTICATED, "Missing or expired session token")
+            error = identity_error(request, username)
+            if error:
+                await context.abort(grpc.StatusCode.PERMISSION_DENIED, error)
+
+        def unary_unary(behavior):
+            async def wrapper(request, context):
+                await check(request, context)
+                return await behavior(request, context)
+            return wrapper
+
+        def unary_stream(behavior):
+            async def wrapper(request, context):
+                await check(request, context)
+                async for response in behavior(request, context):
+                    yield response
+            return wrapper
+
+        def stream_unary(behavior):
+            async def wrapper(request_iterator, context):
+                if username is None:
+                    await context.abort(grpc.StatusCode.UNAUTHENTICATED, "Missing or expired session token")
+
+                async def checked():
+                    async for request in request_iterator:
+                        await check(request, context)
+                        yield request
+                return await behavior(checked(), context)
+            return wrapper
+
+        def stream_stream(behavior):
+            async def wrapper(request_iterator, context):
+                if username is None:
+                    await context.abort(grpc.StatusCode.UNAUTHENTICATED, "Missing or expired session token")
+
+                async def checked():
+                    async for request in request_iterator:
+                        await check(request, context)
+                        yield request
+                async for response in behavior(checked(), context):
+                    yield response
+            return wrapper
+
+        return rewrap(handler, unary_unary, unary_stream, stream_unary, stream_stream)
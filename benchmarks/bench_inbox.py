@@ -0,0 +1,70 @@
+# ---------------------------
+# Inbox scaling benchmark.
+# Compares the old flat message list (scan on every Login / ReadNewMessages)
+# against the Inbox queue + read history as the retained history grows.
+# Run from the repository root:  python -m benchmarks.bench_inbox
+# ---------------------------
+import time
+
+from inbox import Inbox, Message
+
+SIZES = [1_000, 10_000, 100_000]
+READ_BATCH = 10
+REPEAT = 50
+
+
+def make_message(i):
+    return Message(i, "bob", f"message {i}", 1735732800000)
+
+
+#old storage: one flat list with a "read" flag on every message
+def flat_mailbox(history):
+    messages = [dict(make_message(i).to_dict(), read=True) for i in range(history)]
+    messages.extend(dict(make_message(i).to_dict(), read=False) for i in range(history, history + READ_BATCH * REPEAT))
+    return messages
+
+
+def flat_login(messages):
+    return sum(1 for m in messages if not m.get("read", False))
+
+
+def flat_read(messages, count):
+    unread = [m for m in messages if not m.get("read", False)]
+    selected = unread[:count]
+    for m in selected:
+        m["read"] = True
+    return selected
+
+
+def inbox_mailbox(history):
+    inbox = Inbox()
+    for i in range(history):
+        inbox.append(make_message(i))
+    inbox.take_unread(0)
+    for i in range(history, history + READ_BATCH * REPEAT):
+        inbox.append(make_message(i))
+    return inbox
+
+
+#average microseconds per call of fn over REPEAT calls
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def main():
+    print(f"{'history':>10} | {'login (flat)':>14} {'login (inbox)':>14} | {'read (flat)':>14} {'read (inbox)':>14}   [us/call, read N={READ_BATCH}]")
+    for history in SIZES:
+        flat = flat_mailbox(history)
+        inbox = inbox_mailbox(history)
+        login_flat = timed(lambda: flat_login(flat))
+        login_inbox = timed(lambda: inbox.unread_count)
+        read_flat = timed(lambda: flat_read(flat, READ_BATCH))
+        read_inbox = timed(lambda: inbox.take_unread(READ_BATCH))
+        print(f"{history:>10} | {login_flat:>14.1f} {login_inbox:>14.2f} | {read_flat:>14.1f} {read_inbox:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# ---------------------------
+# Logging overhead benchmark.
+# Drives ChatService.SendMessage directly (no network) from several threads
+# and compares RPC throughput with the old synchronous setup (a FileHandler at
+# DEBUG on the request thread) against the queue-based pipeline from
+# log_pipeline.py. Each SendMessage logs one line either way.
+# Run from the repository root:  python -m benchmarks.bench_logging
+# ---------------------------
+import logging
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock
+
+import chat_pb2
+from log_pipeline import LOG_FORMAT, start_logging
+from persistence import new_user
+from server import ChatService, users_db
+
+THREADS = 8
+SENDS_PER_THREAD = 5000
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+#the pre-pipeline setup: every record formatted and written on the calling thread
+def synchronous_logging(log_dir):
+    reset_root()
+    handler = logging.FileHandler(os.path.join(log_dir, "sync.log"))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(logging.DEBUG)
+
+
+#sends per second over THREADS threads
+def run_sends():
+    users_db.clear()
+    service = ChatService()
+    context = MagicMock()
+    for i in range(THREADS):
+        users_db[f"user{i}"] = new_user("pw")
+
+    def worker(i):
+        request = chat_pb2.SendMessageRequest(sender=f"user{i}", to=f"user{i}", content="benchmark message")
+        for _ in range(SENDS_PER_THREAD):
+            service.SendMessage(request, context)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return THREADS * SENDS_PER_THREAD / (time.perf_counter() - start)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as log_dir:
+        synchronous_logging(log_dir)
+        sync_rate = run_sends()
+        reset_root()
+
+        listener = start_logging({"level": "INFO", "queue_size": 100000}, log_dir=log_dir)
+        pipeline_rate = run_sends()
+        listener.stop()
+
+        listener = start_logging({"level": "INFO", "rpc_sample_rate": 0.01, "queue_size": 100000}, log_dir=log_dir)
+        sampled_rate = run_sends()
+        listener.stop()
+        reset_root()
+
+    print(f"SendMessage throughput, {THREADS} threads x {SENDS_PER_THREAD} calls")
+    print(f"  synchronous FileHandler (old): {sync_rate:10.0f} RPC/s")
+    print(f"  queue pipeline:                {pipeline_rate:10.0f} RPC/s  ({pipeline_rate / sync_rate:.2f}x)")
+    print(f"  queue pipeline, 1% sampling:   {sampled_rate:10.0f} RPC/s  ({sampled_rate / sync_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
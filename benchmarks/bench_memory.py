@@ -0,0 +1,79 @@
+# ---------------------------
+# Stored-message memory benchmark.
+# Builds one retained history per layout and reports the traced allocation
+# per message (tracemalloc; content strings included):
+#   dict    - the previous layout: a dict per message, with its own copy of the
+#             sender name (as decoded from each request), indexed by id twice
+#             (read history + by_id)
+#   compact - the current Inbox: Message slots records, interned sender names,
+#             read history dict + unread id set
+# Run from the repository root:  python -m benchmarks.bench_memory
+# ---------------------------
+import gc
+import tracemalloc
+
+from inbox import Inbox, Message
+
+SIZES = [10_000, 100_000, 1_000_000]
+SENDERS = ["alice", "bob", "carol", "dave"]
+T0 = 1735732800000
+UNREAD_SHARE = 0.1
+
+
+#a fresh copy of the sender name, like the one each decoded SendMessageRequest carries
+def sender_copy(i):
+    return "".join(SENDERS[i % len(SENDERS)])
+
+
+def content(i):
+    return f"message number {i}"
+
+
+def dict_mailbox(count):
+    read, by_id, unread = {}, {}, []
+    unread_from = int(count * (1 - UNREAD_SHARE))
+    for i in range(count):
+        m = {"id": i + 1000, "from": sender_copy(i), "content": content(i), "timestamp": T0 + i}
+        by_id[m["id"]] = m
+        if i < unread_from:
+            read[m["id"]] = m
+        else:
+            unread.append(m)
+    return read, by_id, unread
+
+
+def compact_mailbox(count):
+    inbox = Inbox()
+    unread_from = int(count * (1 - UNREAD_SHARE))
+    for i in range(count):
+        inbox.append(Message(i + 1000, sender_copy(i), content(i), T0 + i))
+        if i == unread_from - 1:
+            inbox.take_unread(0)
+    return inbox
+
+
+#bytes still allocated after build(count) returns, per message
+def bytes_per_message(build, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(count)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def main():
+    baseline = bytes_per_message(lambda n: [content(i) for i in range(n)], SIZES[0])
+    print(f"content strings alone: ~{baseline:.0f} bytes/message (included below)")
+    print(f"{'messages':>10} | {'dict':>10} {'compact':>10} | {'saved':>7}   [bytes/message]")
+    for count in SIZES:
+        old = bytes_per_message(dict_mailbox, count)
+        new = bytes_per_message(compact_mailbox, count)
+        print(f"{count:>10} | {old:>10.0f} {new:>10.0f} | {1 - new / old:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# ---------------------------
+# Load generator and latency benchmark for ChatService.
+# Starts server.py (serve() / serve_async() / the multi-process supervisor, per
+# --server-mode) in a scratch directory on a free local port, prepares
+# accounts, then drives it with concurrent clients running one of the workload
+# mixes below for a fixed duration. Client threads are spread over several processes so the load
+# generator itself is not held back by one GIL.
+# Reports requests, errors, RPC/s and p50/p95/p99 latency per method, and
+# writes the same numbers as JSON so runs on different commits can be compared
+# (--compare old.json fails the run on a regression beyond --max-regression).
+#
+# Run from the repository root, e.g.:
+#   python -m benchmarks.load_test --workload send_heavy --clients 32 --duration 10 --output send.json
+#   python -m benchmarks.load_test --workload send_heavy --compare send.json
+# ---------------------------
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# method -> relative weight
+WORKLOADS = {
+    "login_storm": {"Login": 1},
+    "send_heavy": {"SendMessage": 8, "ReadNewMessages": 1, "Login": 1},
+    "read_heavy": {"ReadNewMessages": 5, "ListAccounts": 3, "SendMessage": 2},
+    "large_inbox": {"ListMessages": 1},
+    "mixed": {"SendMessage": 4, "ReadNewMessages": 3, "ListMessages": 1, "ListAccounts": 1, "Login": 1},
+}
+PASSWORD = "load-test-password"
+
+
+def user_name(i):
+    return f"loaduser{i:06d}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+#run server.py from a scratch directory holding a config.json for this run
+def start_server(args, port, workdir):
+    with open(os.path.join(REPO_ROOT, "config.json")) as f:
+        config = json.load(f)
+    config.update({"server_host": "127.0.0.1", "server_port": port, "server_mode": args.server_mode,
+                   "workers": args.workers, "worker_base_port": free_port()})
+    config.setdefault("logging", {})["level"] = args.log_level
+    config.setdefault("persistence", {})["enabled"] = args.persistence
+    if not args.rate_limits:
+        # one load generator stands in for many users, and its setup creates accounts from one address
+        config["rate_limits"] = {}
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "server.py")],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    try:
+        grpc.channel_ready_future(channel).result(timeout=15)
+    except grpc.FutureTimeoutError:
+        process.kill()
+        raise SystemExit("server did not come up within 15s")
+    finally:
+        channel.close()
+    return process
+
+
+def bearer(token):
+    return (("authorization", f"Bearer {token}"),)
+
+
+#accounts and a session token for every simulated user, plus a pre-read history for large_inbox;
+#returns the tokens, indexed like user_name()
+def prepare(target, args):
+    with grpc.insecure_channel(target) as channel:
+        stub = chat_pb2_grpc.ChatServiceStub(channel)
+        tokens = []
+        for i in range(args.users):
+            stub.CreateAccount(chat_pb2.CreateAccountRequest(username=user_name(i), password=PASSWORD))
+            tokens.append(stub.Login(chat_pb2.LoginRequest(username=user_name(i), password=PASSWORD)).session_token)
+        if args.workload in ("large_inbox", "mixed") and args.inbox_size:
+            for i in range(args.users):
+                sender = (i + 1) % args.users
+                items = [chat_pb2.BatchItem(to=user_name(i), content=f"history message {n}") for n in range(args.inbox_size)]
+                stub.SendMessageBatch(chat_pb2.SendMessageBatchRequest(sender=user_name(sender), items=items), metadata=bearer(tokens[sender]))
+                stub.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username=user_name(i), count=0), metadata=bearer(tokens[i]))
+        return tokens
+
+
+#(request, call metadata) for one call by a random user
+def make_request(method, rng, tokens):
+    users = len(tokens)
+    i = rng.randrange(users)
+    return build_request(method, rng, user_name(i), users), bearer(tokens[i])
+
+
+def build_request(method, rng, me, users):
+    if method == "Login":
+        return chat_pb2.LoginRequest(username=me, password=PASSWORD)
+    if method == "SendMessage":
+        return chat_pb2.SendMessageRequest(sender=me, to=user_name(rng.randrange(users)), content="load test message")
+    if method == "ReadNewMessages":
+        return chat_pb2.ReadNewMessagesRequest(username=me, count=10)
+    if method == "ListMessages":
+        return chat_pb2.ListMessagesRequest(username=me)
+    if method == "ListAccounts":
+        return chat_pb2.ListAccountsRequest(username=me, pattern=f"loaduser{rng.randrange(10)}*", page_size=50)
+    raise ValueError(method)
+
+
+#one worker process: `clients` threads, each with its own channel, until `deadline`
+def client_process(target, workload, tokens, clients, deadline, seed):
+    import threading
+
+    methods = list(WORKLOADS[workload])
+    weights = [WORKLOADS[workload][m] for m in methods]
+    results = {m: {"latencies": [], "errors": 0} for m in methods}
+    lock = threading.Lock()
+
+    def client(n):
+        rng = random.Random(seed * 1000 + n)
+        local = {m: {"latencies": [], "errors": 0} for m in methods}
+        with grpc.insecure_channel(target) as channel:
+            stub = chat_pb2_grpc.ChatServiceStub(channel)
+            calls = {m: getattr(stub, m) for m in methods}
+            while time.time() < deadline:
+                method = rng.choices(methods, weights)[0]
+                request, metadata = make_request(method, rng, tokens)
+                start = time.perf_counter()
+                try:
+                    calls[method](request, timeout=10, metadata=metadata)
+                except grpc.RpcError:
+                    local[method]["errors"] += 1
+                    continue
+                local[method]["latencies"].append(time.perf_counter() - start)
+        with lock:
+            for m in methods:
+                results[m]["latencies"].extend(local[m]["latencies"])
+                results[m]["errors"] += local[m]["errors"]
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+#nearest-rank percentile of an already sorted list
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(per_process, duration):
+    merged = {}
+    for results in per_process:
+        for method, data in results.items():
+            entry = merged.setdefault(method, {"latencies": [], "errors": 0})
+            entry["latencies"].extend(data["latencies"])
+            entry["errors"] += data["errors"]
+    summary = {}
+    for method, data in sorted(merged.items()):
+        latencies = sorted(data["latencies"])
+        summary[method] = {
+            "requests": len(latencies),
+            "errors": data["errors"],
+            "rps": len(latencies) / duration,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": (latencies[-1] * 1000) if latencies else 0.0,
+        }
+    total = sum(m["requests"] for m in summary.values())
+    summary["_total"] = {"requests": total, "rps": total / duration}
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary):
+    print(f"{'method':<18}{'requests':>10}{'errors':>8}{'RPC/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for method, m in summary.items():
+        if method == "_total":
+            continue
+        print(f"{method:<18}{m['requests']:>10}{m['errors']:>8}{m['rps']:>10.0f}{m['p50_ms']:>9.2f}{m['p95_ms']:>9.2f}{m['p99_ms']:>9.2f}")
+    print(f"{'total':<18}{summary['_total']['requests']:>10}{'':>8}{summary['_total']['rps']:>10.0f}")
+
+
+#compare against an earlier results file; returns the list of regressions found
+def compare(summary, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["summary"]
+    regressions = []
+    print(f"\nvs {baseline_path}:")
+    for method, m in summary.items():
+        old = baseline.get(method)
+        if method == "_total" or not old or not old["requests"]:
+            continue
+        rps_change = m["rps"] / old["rps"] - 1
+        p99_change = m["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        print(f"  {method:<18} RPC/s {rps_change:+7.1%}   p99 {p99_change:+7.1%}")
+        if rps_change < -max_regression:
+            regressions.append(f"{method} throughput {rps_change:+.1%}")
+        if p99_change > max_regression:
+            regressions.append(f"{method} p99 latency {p99_change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat server")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client threads in total")
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1), help="load generator processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of measured load")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--inbox-size", type=int, default=1000, help="read messages per user for large_inbox/mixed")
+    parser.add_argument("--server-mode", choices=("threads", "asyncio", "multiprocess"), default="threads")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="server processes for --server-mode multiprocess")
+    parser.add_argument("--persistence", action="store_true", help="keep the write-ahead log on (scratch data dir)")
+    parser.add_argument("--rate-limits", action="store_true", help="keep config.json's rate limits and concurrency cap on")
+    parser.add_argument("--log-level", default="WARNING", help="server log level during the run")
+    parser.add_argument("--target", help="host:port of an already running server instead of starting one")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative regression for --compare")
+    args = parser.parse_args()
+
+    workdir = None
+    process = None
+    target = args.target
+    if target is None:
+        workdir = tempfile.mkdtemp(prefix="chat_load_")
+        port = free_port()
+        process = start_server(args, port, workdir)
+        target = f"127.0.0.1:{port}"
+    try:
+        print(f"Preparing {args.users} users on {target} ...")
+        tokens = prepare(target, args)
+        processes = max(1, min(args.processes, args.clients))
+        per_process = [args.clients // processes + (1 if i < args.clients % processes else 0) for i in range(processes)]
+        print(f"Running '{args.workload}' with {args.clients} clients in {processes} processes for {args.duration:.0f}s ...")
+        deadline = time.time() + args.duration
+        with multiprocessing.Pool(processes) as pool:
+            jobs = [pool.apply_async(client_process, (target, args.workload, tokens, n, deadline, i))
+                    for i, n in enumerate(per_process)]
+            results = [job.get() for job in jobs]
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(results, args.duration)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "config": vars(args),
+                "summary": summary
+            }, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        regressions = compare(summary, args.compare, args.max_regression)
+        if regressions:
+            print("\nREGRESSION: " + "; ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
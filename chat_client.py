@@ -0,0 +1,302 @@
+import json
+import uuid
+import queue
+import hashlib
+import threading
+from concurrent.futures import Future
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+
+# ---------------------------
+# Reusable, non-blocking chat client.
+# A ChatClient holds one long-lived channel with keepalive pings, and gRPC
+# retries read-only calls while the server is briefly unavailable. Sends
+# carry a fresh request_id, which the server deduplicates, so they are
+# retried too. It also
+# holds the logged-in user's session and attaches the token to every call.
+# Every call returns at once with a concurrent.futures.Future and carries a
+# deadline.
+# Callbacks registered with on_done() are handed to `dispatch`, so a GUI can run
+# them on its own thread (see CallbackQueue); bots and load tools can simply
+# call .result() on the futures.
+# ---------------------------
+DEFAULT_DEADLINE_S = 10.0
+KEEPALIVE_TIME_MS = 30000
+KEEPALIVE_TIMEOUT_MS = 10000
+# safe to repeat, so retried on UNAVAILABLE: read-only calls, and SendMessage and SendGroupMessage because
+# the server recognises a repeated request_id; batches and deletes are never retried
+RETRY_METHODS = ("Login", "ListAccounts", "ListMessages", "SearchMessages", "ConversationHistory", "GetStats", "SendMessage",
+                 "SendGroupMessage")
+SERVICE_CONFIG = {
+    "methodConfig": [{
+        "name": [{"service": "chat.ChatService", "method": method} for method in RETRY_METHODS],
+        "retryPolicy": {
+            "maxAttempts": 4,
+            "initialBackoff": "0.1s",
+            "maxBackoff": "2s",
+            "backoffMultiplier": 2,
+            "retryableStatusCodes": ["UNAVAILABLE"]
+        }
+    }]
+}
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", KEEPALIVE_TIME_MS),
+    ("grpc.keepalive_timeout_ms", KEEPALIVE_TIMEOUT_MS),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.enable_retries", 1),
+    ("grpc.service_config", json.dumps(SERVICE_CONFIG)),
+]
+# a dropped Subscribe stream is reopened, backing off up to this long
+RESUBSCRIBE_MAX_BACKOFF_S = 10.0
+
+
+#how long the server asked us to wait before retrying a RESOURCE_EXHAUSTED call (rate limited or busy),
+#in seconds; None for other errors
+def retry_after_s(error):
+    if error.code() != grpc.StatusCode.RESOURCE_EXHAUSTED:
+        return None
+    for key, value in error.trailing_metadata() or ():
+        if key == "retry-after-ms":
+            return int(value) / 1000
+    return None
+
+
+#where a Subscribe turned away by a worker that does not own the user should go instead ("host:port"),
+#else None; the server may leave out the host, meaning the one `target` already names
+def redirect_target(error, target):
+    for key, value in error.trailing_metadata() or ():
+        if key == "x-owner-address":
+            host, _, port = value.rpartition(":")
+            return f"{host or target.rpartition(':')[0]}:{port}"
+    return None
+
+
+#hash function implementation, using SHA-256 (the server hashes again with a salted KDF)
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+#callbacks posted from gRPC threads, run later by whoever owns the queue (e.g. a Tk after() loop)
+class CallbackQueue:
+    def __init__(self):
+        self.pending = queue.SimpleQueue()
+
+    def post(self, callback, *args):
+        self.pending.put((callback, args))
+
+    def run_pending(self):
+        while True:
+            try:
+                callback, args = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
+
+
+class ChatClient:
+    #`dispatch(callback, *args)` delivers on_done()/subscribe() callbacks; by default they run on the gRPC thread
+    def __init__(self, target, deadline_s=DEFAULT_DEADLINE_S, dispatch=None):
+        self.target = target
+        self.channel = grpc.insecure_channel(target, options=CHANNEL_OPTIONS)
+        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+        self.deadline_s = deadline_s
+        self.dispatch = dispatch or (lambda callback, *args: callback(*args))
+        self.username = None
+        self.session_token = None
+
+    def metadata(self):
+        return (("authorization", f"Bearer {self.session_token}"),) if self.session_token else ()
+
+    #start one unary call; `update(response)` runs before the returned future completes
+    def call(self, method, request, update=None):
+        result = Future()
+        call = getattr(self.stub, method).future(request, timeout=self.deadline_s, metadata=self.metadata())
+
+        def done(call):
+            try:
+                response = call.result()
+                if update is not None:
+                    update(response)
+            except Exception as e:
+                result.set_exception(e)
+                return
+            result.set_result(response)
+        call.add_done_callback(done)
+        return result
+
+    #hand the outcome of `future` to on_result(response) or on_error(exception) through dispatch
+    def on_done(self, future, on_result, on_error=None):
+        def done(future):
+            error = future.exception()
+            if error is None:
+                self.dispatch(on_result, future.result())
+            elif on_error is not None:
+                self.dispatch(on_error, error)
+        future.add_done_callback(done)
+        return future
+
+    def forget_session(self):
+        self.username = None
+        self.session_token = None
+
+    def create_account(self, username, password):
+        return self.call("CreateAccount", chat_pb2.CreateAccountRequest(username=username, password=hash_password(password)))
+
+    def login(self, username, password):
+        def remember(response):
+            if response.success:
+                self.username = username
+                self.session_token = response.session_token
+        return self.call("Login", chat_pb2.LoginRequest(username=username, password=hash_password(password)), remember)
+
+    #the local session is dropped at once, whatever the server answers
+    def logout(self):
+        future = self.call("Logout", chat_pb2.LogoutRequest(username=self.username))
+        self.forget_session()
+        return future
+
+    def list_accounts(self, pattern="", page_size=0, page_token=""):
+        return self.call("ListAccounts", chat_pb2.ListAccountsRequest(
+            username=self.username, pattern=pattern, page_size=page_size, page_token=page_token))
+
+    #pass the `request_id` of an earlier attempt to retry it without sending twice
+    def send_message(self, to, content, request_id=None):
+        return self.call("SendMessage", chat_pb2.SendMessageRequest(
+            sender=self.username, to=to, content=content, request_id=request_id or uuid.uuid4().hex))
+
+    #`items` are (recipient, content) pairs
+    def send_batch(self, items):
+        return self.call("SendMessageBatch", chat_pb2.SendMessageBatchRequest(
+            sender=self.username, items=[chat_pb2.BatchItem(to=to, content=content) for to, content in items]))
+
+    def read_new_messages(self, count=0):
+        return self.call("ReadNewMessages", chat_pb2.ReadNewMessagesRequest(username=self.username, count=count))
+
+    #read messages in memory, or with archived=True a page of archived ones older than before_id
+    def list_messages(self, archived=False, before_id=0, page_size=0):
+        return self.call("ListMessages", chat_pb2.ListMessagesRequest(
+            username=self.username, archived=archived, before_id=before_id, page_size=page_size))
+
+    #stored messages holding every word of `query`, newest first; pass next_before_id as before_id for older ones
+    def search_messages(self, query="", sender="", since_ms=0, until_ms=0, before_id=0, page_size=0):
+        return self.call("SearchMessages", chat_pb2.SearchMessagesRequest(
+            username=self.username, query=query, sender=sender, since_ms=since_ms, until_ms=until_ms,
+            before_id=before_id, page_size=page_size))
+
+    #messages exchanged with `peer` both ways, oldest first: the newest page, or the page before before_id
+    #or after after_id (see has_older / has_newer in the response)
+    def conversation_history(self, peer, before_id=0, after_id=0, limit=0):
+        return self.call("ConversationHistory", chat_pb2.ConversationHistoryRequest(
+            username=self.username, peer=peer, before_id=before_id, after_id=after_id, limit=limit))
+
+    def create_group(self, group):
+        return self.call("CreateGroup", chat_pb2.CreateGroupRequest(username=self.username, group=group))
+
+    def join_group(self, group):
+        return self.call("JoinGroup", chat_pb2.JoinGroupRequest(username=self.username, group=group))
+
+    #every member, the sender too, gets it through subscribe() or read_new_messages(); retried like send_message
+    def send_group_message(self, group, content, request_id=None):
+        return self.call("SendGroupMessage", chat_pb2.SendGroupMessageRequest(
+            sender=self.username, group=group, content=content, request_id=request_id or uuid.uuid4().hex))
+
+    def delete_messages(self, message_ids=(), delete_all=False):
+        return self.call("DeleteMessages", chat_pb2.DeleteMessagesRequest(
+            username=self.username, message_ids=message_ids, delete_all=delete_all))
+
+    def delete_account(self):
+        def forget(response):
+            if response.success:
+                self.forget_session()
+        return self.call("DeleteAccount", chat_pb2.DeleteAccountRequest(username=self.username), forget)
+
+    def get_stats(self):
+        return self.call("GetStats", chat_pb2.GetStatsRequest())
+
+    #push delivery for the logged-in user: on_message(chat_pb2.Message) for every new message,
+    #on_end(error or None) once the stream stops for good (not after cancel())
+    def subscribe(self, on_message, on_end=None):
+        return Subscription(self, on_message, on_end)
+
+    def close(self):
+        self.channel.close()
+
+
+#a Subscribe stream consumed on a background thread, reopened after a dropped connection or a
+#RESOURCE_EXHAUSTED refusal (after the server's retry-after-ms); pushed messages are marked read on the server, so reopening never repeats one. A stream the server
+#redirects (multi-process and cluster modes) is opened on its own channel to the user's worker
+class Subscription:
+    def __init__(self, client, on_message, on_end):
+        self.client = client
+        self.on_message = on_message
+        self.on_end = on_end
+        self.request = chat_pb2.SubscribeRequest(username=client.username)
+        self.metadata = client.metadata()
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.call = None
+        # channel to the worker a redirect named, while it answers
+        self.channel = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled.set()
+            if self.call is not None:
+                self.call.cancel()
+
+    def redirect(self, target):
+        self.close_channel()
+        self.channel = grpc.insecure_channel(target, options=CHANNEL_OPTIONS)
+
+    def close_channel(self):
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+
+    def run(self):
+        client = self.client
+        backoff = 0.5
+        error = None
+        while not self.cancelled.is_set():
+            delay = backoff
+            with self.lock:
+                if self.cancelled.is_set():
+                    break
+                stub = client.stub if self.channel is None else chat_pb2_grpc.ChatServiceStub(self.channel)
+                self.call = stub.Subscribe(self.request, metadata=self.metadata)
+            try:
+                for response in self.call:
+                    backoff = 0.5
+                    client.dispatch(self.on_message, response.message)
+                # the server ended the stream (account deleted)
+                break
+            except grpc.RpcError as e:
+                if self.cancelled.is_set():
+                    break
+                target = redirect_target(e, client.target)
+                if target is not None:
+                    # at once the first time; a redirect from a redirected stream backs off like a dropped one
+                    redirected = self.channel is not None
+                    self.redirect(target)
+                    if not redirected:
+                        continue
+                elif e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+                    # too many open streams (or rate limited): wait as long as the server asks, at least the backoff
+                    delay = max(retry_after_s(e) or 0, backoff)
+                elif e.code() != grpc.StatusCode.UNAVAILABLE:
+                    error = e
+                    break
+                else:
+                    # the user's worker may have moved; ask the original target again
+                    self.close_channel()
+            self.cancelled.wait(delay)
+            backoff = min(backoff * 2, RESUBSCRIBE_MAX_BACKOFF_S)
+        self.close_channel()
+        if not self.cancelled.is_set() and self.on_end is not None:
+            client.dispatch(self.on_end, error)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: chat.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'chat.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\x04\x63hat\"[\n\x07Message\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x14\n\x0ctimestamp_ms\x18\x03 \x01(\x03\x12\x0f\n\x07\x63ontent\x18\x04 \x01(\t\x12\r\n\x05group\x18\x05 \x01(\t\":\n\x14\x43reateAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"9\n\x15\x43reateAccountResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"^\n\rLoginResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x14\n\x0cunread_count\x18\x02 \x01(\x05\x12\x0f\n\x07success\x18\x03 \x01(\x08\x12\x15\n\rsession_token\x18\x04 \x01(\t\"!\n\rLogoutRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"2\n\x0eLogoutResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\"_\n\x13ListAccountsRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x0f\n\x07pattern\x18\x02 \x01(\t\x12\x11\n\tpage_size\x18\x03 \x01(\x05\x12\x12\n\npage_token\x18\x04 \x01(\t\"R\n\x14ListAccountsResponse\x12\x10\n\x08\x61\x63\x63ounts\x18\x01 \x03(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x17\n\x0fnext_page_token\x18\x03 \x01(\t\"U\n\x12SendMessageRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\n\n\x02to\x18\x02 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x03 \x01(\t\x12\x12\n\nrequest_id\x18\x04 \x01(\t\"K\n\x13SendMessageResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x12\n\nmessage_id\x18\x03 \x01(\x04\"I\n\x17SendMessageBatchRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x1e\n\x05items\x18\x02 \x03(\x0b\x32\x0f.chat.BatchItem\"(\n\tBatchItem\x12\n\n\x02to\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\"k\n\x18SendMessageBatchResponse\x12*\n\x07results\x18\x01 \x03(\x0b\x32\x19.chat.SendMessageResponse\x12\x12\n\nsent_count\x18\x02 \x01(\x05\x12\x0f\n\x07success\x18\x03 \x01(\x08\"V\n\x19SendMessageStreamResponse\x12\x12\n\nsent_count\x18\x01 \x01(\x05\x12\x14\n\x0c\x66\x61iled_count\x18\x02 \x01(\x05\x12\x0f\n\x07success\x18\x03 \x01(\x08\"9\n\x16ReadNewMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05\x63ount\x18\x02 \x01(\x05\"K\n\x17ReadNewMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12\x0f\n\x07success\x18\x02 \x01(\x08\"R\n\x15\x44\x65leteMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x13\n\x0bmessage_ids\x18\x02 \x03(\x04\x12\x12\n\ndelete_all\x18\x03 \x01(\x08\":\n\x16\x44\x65leteMessagesResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\"(\n\x14\x44\x65leteAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"9\n\x15\x44\x65leteAccountResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\"_\n\x13ListMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08\x61rchived\x18\x02 \x01(\x08\x12\x11\n\tbefore_id\x18\x03 \x01(\x04\x12\x11\n\tpage_size\x18\x04 \x01(\x05\"v\n\x14ListMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x14\n\x0chas_archived\x18\x03 \x01(\x08\x12\x16\n\x0enext_before_id\x18\x04 \x01(\x04\"\x92\x01\n\x15SearchMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05query\x18\x02 \x01(\t\x12\x0e\n\x06sender\x18\x03 \x01(\t\x12\x10\n\x08since_ms\x18\x04 \x01(\x03\x12\x10\n\x08until_ms\x18\x05 \x01(\x03\x12\x11\n\tbefore_id\x18\x06 \x01(\x04\x12\x11\n\tpage_size\x18\x07 \x01(\x05\"b\n\x16SearchMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x16\n\x0enext_before_id\x18\x03 \x01(\x04\"p\n\x1a\x43onversationHistoryRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x0c\n\x04peer\x18\x02 \x01(\t\x12\x11\n\tbefore_id\x18\x03 \x01(\x04\x12\x10\n\x08\x61\x66ter_id\x18\x04 \x01(\x04\x12\r\n\x05limit\x18\x05 \x01(\x05\"u\n\x1b\x43onversationHistoryResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x11\n\thas_older\x18\x03 \x01(\x08\x12\x11\n\thas_newer\x18\x04 \x01(\x08\"5\n\x12\x43reateGroupRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05group\x18\x02 \x01(\t\"3\n\x10JoinGroupRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05group\x18\x02 \x01(\t\"1\n\rGroupResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\"]\n\x17SendGroupMessageRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\r\n\x05group\x18\x02 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x03 \x01(\t\x12\x12\n\nrequest_id\x18\x04 \x01(\t\"$\n\x10SubscribeRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"3\n\x11SubscribeResponse\x12\x1e\n\x07message\x18\x01 \x01(\x0b\x32\r.chat.Message\"\x11\n\x0fGetStatsRequest\"}\n\x0bMethodStats\x12\x0e\n\x06method\x18\x01 \x01(\t\x12\r\n\x05\x63ount\x18\x02 \x01(\x04\x12\x0e\n\x06\x65rrors\x18\x03 \x01(\x04\x12\x0f\n\x07mean_ms\x18\x04 \x01(\x01\x12\x0e\n\x06p50_ms\x18\x05 \x01(\x01\x12\x0e\n\x06p95_ms\x18\x06 \x01(\x01\x12\x0e\n\x06p99_ms\x18\x07 \x01(\x01\"\xb4\x02\n\x10GetStatsResponse\x12\"\n\x07methods\x18\x01 \x03(\x0b\x32\x11.chat.MethodStats\x12\x11\n\tin_flight\x18\x02 \x01(\x03\x12\x16\n\x0e\x61\x63tive_streams\x18\x03 \x01(\x03\x12\x18\n\x10\x65xecutor_backlog\x18\x04 \x01(\x03\x12\r\n\x05users\x18\x05 \x01(\x03\x12\x17\n\x0fstored_messages\x18\x06 \x01(\x03\x12\x16\n\x0emax_inbox_size\x18\x07 \x01(\x03\x12\x15\n\rmax_rss_bytes\x18\x08 \x01(\x03\x12\x1d\n\x15replication_followers\x18\t \x01(\x05\x12\x1f\n\x17replication_lag_records\x18\n \x01(\x03\x12 \n\x18replication_staleness_ms\x18\x0b \x01(\x03\"V\n\x0e\x44\x65liverRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x14\n\x0ctimestamp_ms\x18\x02 \x01(\x03\x12\x1e\n\x05items\x18\x03 \x03(\x0b\x32\x0f.chat.BatchItem\",\n\x0bJoinRequest\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0f\n\x07\x61\x64\x64ress\x18\x02 \x01(\t\"\"\n\x0cJoinResponse\x12\x12\n\nhanded_off\x18\x01 \x01(\x05\"\xaa\x01\n\nUserRecord\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x15\n\rpassword_hash\x18\x02 \x01(\t\x12\x1b\n\x04read\x18\x03 \x03(\x0b\x32\r.chat.Message\x12\x1d\n\x06unread\x18\x04 \x03(\x0b\x32\r.chat.Message\x12\x16\n\x0esession_tokens\x18\x05 \x03(\t\x12\x1f\n\x04sent\x18\x06 \x03(\x0b\x32\x11.chat.SentMessage\"9\n\x0bSentMessage\x12\n\n\x02to\x18\x01 \x01(\t\x12\x1e\n\x07message\x18\x02 \x01(\x0b\x32\r.chat.Message\"1\n\x0eHandoffRequest\x12\x1f\n\x05users\x18\x01 \x03(\x0b\x32\x10.chat.UserRecord\"#\n\x0fHandoffResponse\x12\x10\n\x08\x61\x63\x63\x65pted\x18\x01 \x01(\x05\"A\n\rFollowRequest\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05\x65poch\x18\x02 \x01(\t\x12\x13\n\x0b\x61pplied_seq\x18\x03 \x01(\x04\"s\n\x10ReplicationBatch\x12\x0f\n\x07records\x18\x01 \x03(\t\x12\r\n\x05reset\x18\x02 \x01(\x08\x12\x0e\n\x06synced\x18\x03 \x01(\x08\x12\x0b\n\x03seq\x18\x04 \x01(\x04\x12\x13\n\x0bprimary_seq\x18\x05 \x01(\x04\x12\r\n\x05\x65poch\x18\x06 \x01(\t2\x86\n\n\x0b\x43hatService\x12H\n\rCreateAccount\x12\x1a.chat.CreateAccountRequest\x1a\x1b.chat.CreateAccountResponse\x12\x30\n\x05Login\x12\x12.chat.LoginRequest\x1a\x13.chat.LoginResponse\x12\x33\n\x06Logout\x12\x13.chat.LogoutRequest\x1a\x14.chat.LogoutResponse\x12\x45\n\x0cListAccounts\x12\x19.chat.ListAccountsRequest\x1a\x1a.chat.ListAccountsResponse\x12\x42\n\x0bSendMessage\x12\x18.chat.SendMessageRequest\x1a\x19.chat.SendMessageResponse\x12N\n\x0fReadNewMessages\x12\x1c.chat.ReadNewMessagesRequest\x1a\x1d.chat.ReadNewMessagesResponse\x12K\n\x0e\x44\x65leteMessages\x12\x1b.chat.DeleteMessagesRequest\x1a\x1c.chat.DeleteMessagesResponse\x12H\n\rDeleteAccount\x12\x1a.chat.DeleteAccountRequest\x1a\x1b.chat.DeleteAccountResponse\x12\x45\n\x0cListMessages\x12\x19.chat.ListMessagesRequest\x1a\x1a.chat.ListMessagesResponse\x12>\n\tSubscribe\x12\x16.chat.SubscribeRequest\x1a\x17.chat.SubscribeResponse0\x01\x12Q\n\x10SendMessageBatch\x12\x1d.chat.SendMessageBatchRequest\x1a\x1e.chat.SendMessageBatchResponse\x12P\n\x11SendMessageStream\x12\x18.chat.SendMessageRequest\x1a\x1f.chat.SendMessageStreamResponse(\x01\x12\x39\n\x08GetStats\x12\x15.chat.GetStatsRequest\x1a\x16.chat.GetStatsResponse\x12K\n\x0eSearchMessages\x12\x1b.chat.SearchMessagesRequest\x1a\x1c.chat.SearchMessagesResponse\x12<\n\x0b\x43reateGroup\x12\x18.chat.CreateGroupRequest\x1a\x13.chat.GroupResponse\x12\x38\n\tJoinGroup\x12\x16.chat.JoinGroupRequest\x1a\x13.chat.GroupResponse\x12L\n\x10SendGroupMessage\x12\x1d.chat.SendGroupMessageRequest\x1a\x19.chat.SendMessageResponse\x12Z\n\x13\x43onversationHistory\x12 .chat.ConversationHistoryRequest\x1a!.chat.ConversationHistoryResponse2\x83\x02\n\x10PartitionService\x12?\n\x07\x44\x65liver\x12\x14.chat.DeliverRequest\x1a\x1e.chat.SendMessageBatchResponse\x12G\n\x0eSearchAccounts\x12\x19.chat.ListAccountsRequest\x1a\x1a.chat.ListAccountsResponse\x12-\n\x04Join\x12\x11.chat.JoinRequest\x1a\x12.chat.JoinResponse\x12\x36\n\x07Handoff\x12\x14.chat.HandoffRequest\x1a\x15.chat.HandoffResponse2M\n\x12ReplicationService\x12\x37\n\x06\x46ollow\x12\x13.chat.FollowRequest\x1a\x16.chat.ReplicationBatch0\x01\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'chat_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_MESSAGE']._serialized_start=20
+  _globals['_MESSAGE']._serialized_end=111
+  _globals['_CREATEACCOUNTREQUEST']._serialized_start=113
+  _globals['_CREATEACCOUNTREQUEST']._serialized_end=171
+  _globals['_CREATEACCOUNTRESPONSE']._serialized_start=173
+  _globals['_CREATEACCOUNTRESPONSE']._serialized_end=230
+  _globals['_LOGINREQUEST']._serialized_start=232
+  _globals['_LOGINREQUEST']._serialized_end=282
+  _globals['_LOGINRESPONSE']._serialized_start=284
+  _globals['_LOGINRESPONSE']._serialized_end=378
+  _globals['_LOGOUTREQUEST']._serialized_start=380
+  _globals['_LOGOUTREQUEST']._serialized_end=413
+  _globals['_LOGOUTRESPONSE']._serialized_start=415
+  _globals['_LOGOUTRESPONSE']._serialized_end=465
+  _globals['_LISTACCOUNTSREQUEST']._serialized_start=467
+  _globals['_LISTACCOUNTSREQUEST']._serialized_end=562
+  _globals['_LISTACCOUNTSRESPONSE']._serialized_start=564
+  _globals['_LISTACCOUNTSRESPONSE']._serialized_end=646
+  _globals['_SENDMESSAGEREQUEST']._serialized_start=648
+  _globals['_SENDMESSAGEREQUEST']._serialized_end=733
+  _globals['_SENDMESSAGERESPONSE']._serialized_start=735
+  _globals['_SENDMESSAGERESPONSE']._serialized_end=810
+  _globals['_SENDMESSAGEBATCHREQUEST']._serialized_start=812
+  _globals['_SENDMESSAGEBATCHREQUEST']._serialized_end=885
+  _globals['_BATCHITEM']._serialized_start=887
+  _globals['_BATCHITEM']._serialized_end=927
+  _globals['_SENDMESSAGEBATCHRESPONSE']._serialized_start=929
+  _globals['_SENDMESSAGEBATCHRESPONSE']._serialized_end=1036
+  _globals['_SENDMESSAGESTREAMRESPONSE']._serialized_start=1038
+  _globals['_SENDMESSAGESTREAMRESPONSE']._serialized_end=1124
+  _globals['_READNEWMESSAGESREQUEST']._serialized_start=1126
+  _globals['_READNEWMESSAGESREQUEST']._serialized_end=1183
+  _globals['_READNEWMESSAGESRESPONSE']._serialized_start=1185
+  _globals['_READNEWMESSAGESRESPONSE']._serialized_end=1260
+  _globals['_DELETEMESSAGESREQUEST']._serialized_start=1262
+  _globals['_DELETEMESSAGESREQUEST']._serialized_end=1344
+  _globals['_DELETEMESSAGESRESPONSE']._serialized_start=1346
+  _globals['_DELETEMESSAGESRESPONSE']._serialized_end=1404
+  _globals['_DELETEACCOUNTREQUEST']._serialized_start=1406
+  _globals['_DELETEACCOUNTREQUEST']._serialized_end=1446
+  _globals['_DELETEACCOUNTRESPONSE']._serialized_start=1448
+  _globals['_DELETEACCOUNTRESPONSE']._serialized_end=1505
+  _globals['_LISTMESSAGESREQUEST']._serialized_start=1507
+  _globals['_LISTMESSAGESREQUEST']._serialized_end=1602
+  _globals['_LISTMESSAGESRESPONSE']._serialized_start=1604
+  _globals['_LISTMESSAGESRESPONSE']._serialized_end=1722
+  _globals['_SEARCHMESSAGESREQUEST']._serialized_start=1725
+  _globals['_SEARCHMESSAGESREQUEST']._serialized_end=1871
+  _globals['_SEARCHMESSAGESRESPONSE']._serialized_start=1873
+  _globals['_SEARCHMESSAGESRESPONSE']._serialized_end=1971
+  _globals['_CONVERSATIONHISTORYREQUEST']._serialized_start=1973
+  _globals['_CONVERSATIONHISTORYREQUEST']._serialized_end=2085
+  _globals['_CONVERSATIONHISTORYRESPONSE']._serialized_start=2087
+  _globals['_CONVERSATIONHISTORYRESPONSE']._serialized_end=2204
+  _globals['_CREATEGROUPREQUEST']._serialized_start=2206
+  _globals['_CREATEGROUPREQUEST']._serialized_end=2259
+  _globals['_JOINGROUPREQUEST']._serialized_start=2261
+  _globals['_JOINGROUPREQUEST']._serialized_end=2312
+  _globals['_GROUPRESPONSE']._serialized_start=2314
+  _globals['_GROUPRESPONSE']._serialized_end=2363
+  _globals['_SENDGROUPMESSAGEREQUEST']._serialized_start=2365
+  _globals['_SENDGROUPMESSAGEREQUEST']._serialized_end=2458
+  _globals['_SUBSCRIBEREQUEST']._serialized_start=2460
+  _globals['_SUBSCRIBEREQUEST']._serialized_end=2496
+  _globals['_SUBSCRIBERESPONSE']._serialized_start=2498
+  _globals['_SUBSCRIBERESPONSE']._serialized_end=2549
+  _globals['_GETSTATSREQUEST']._serialized_start=2551
+  _globals['_GETSTATSREQUEST']._serialized_end=2568
+  _globals['_METHODSTATS']._serialized_start=2570
+  _globals['_METHODSTATS']._serialized_end=2695
+  _globals['_GETSTATSRESPONSE']._serialized_start=2698
+  _globals['_GETSTATSRESPONSE']._serialized_end=3006
+  _globals['_DELIVERREQUEST']._serialized_start=3008
+  _globals['_DELIVERREQUEST']._serialized_end=3094
+  _globals['_JOINREQUEST']._serialized_start=3096
+  _globals['_JOINREQUEST']._serialized_end=3140
+  _globals['_JOINRESPONSE']._serialized_start=3142
+  _globals['_JOINRESPONSE']._serialized_end=3176
+  _globals['_USERRECORD']._serialized_start=3179
+  _globals['_USERRECORD']._serialized_end=3349
+  _globals['_SENTMESSAGE']._serialized_start=3351
+  _globals['_SENTMESSAGE']._serialized_end=3408
+  _globals['_HANDOFFREQUEST']._serialized_start=3410
+  _globals['_HANDOFFREQUEST']._serialized_end=3459
+  _globals['_HANDOFFRESPONSE']._serialized_start=3461
+  _globals['_HANDOFFRESPONSE']._serialized_end=3496
+  _globals['_FOLLOWREQUEST']._serialized_start=3498
+  _globals['_FOLLOWREQUEST']._serialized_end=3563
+  _globals['_REPLICATIONBATCH']._serialized_start=3565
+  _globals['_REPLICATIONBATCH']._serialized_end=3680
+  _globals['_CHATSERVICE']._serialized_start=3683
+  _globals['_CHATSERVICE']._serialized_end=4969
+  _globals['_PARTITIONSERVICE']._serialized_start=4972
+  _globals['_PARTITIONSERVICE']._serialized_end=5231
+  _globals['_REPLICATIONSERVICE']._serialized_start=5233
+  _globals['_REPLICATIONSERVICE']._serialized_end=5310
+# @@protoc_insertion_point(module_scope)
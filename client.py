@@ -1,12 +1,9 @@
-import os
 import json
+import time
 import tkinter as tk
 from tkinter import messagebox, simpledialog
-import grpc
-import hashlib
 
-import chat_pb2
-import chat_pb2_grpc
+from chat_client import ChatClient, CallbackQueue
 
 # ---------------------------
 # Load configuration
@@ -16,25 +13,40 @@ with open("config.json", "r") as config_file:
 
 SERVER_HOST = config.get("client_connect_host", "localhost")
 SERVER_PORT = config.get("server_port", 50051)
-
-#hash function implementation, using SHA-256
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+# accounts shown per List Accounts dialog
+ACCOUNTS_PAGE_SIZE = 50
+# messages shown per Search Messages dialog
+SEARCH_PAGE_SIZE = 20
+# messages shown per Conversation dialog
+CONVERSATION_PAGE_SIZE = 20
+# how often the Tk loop runs callbacks of finished calls
+CALLBACK_POLL_MS = 50
+# how often new messages are fetched once the Subscribe stream has given up
+NEW_MESSAGES_POLL_MS = 5000
+
+#display form of a chat_pb2.Message, formatted here rather than on the server
+def format_message(message):
+    sent = time.strftime("%m/%d %H:%M", time.localtime(message.timestamp_ms / 1000))
+    if message.group:
+        return f"{sent} - [{message.group}] From: {message.sender} - {message.content}"
+    return f"{sent} - From: {message.sender} - {message.content}"
 
 #chat client GUI
 class ChatClientApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Chat Client")
-        self.geometry("400x350")
-        self.current_user = None
-
-        # Create a gRPC channel and stub to communicate with the server.
-        channel_address = f"{SERVER_HOST}:{SERVER_PORT}"
-        self.channel = grpc.insecure_channel(channel_address)
-        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
-
-
+        self.geometry("400x500")
+
+        # One shared connection for the whole session. Calls never block the Tk loop:
+        # their results come back on gRPC threads and are queued, then run here by
+        # run_callbacks() (Tk widgets are main-thread only).
+        self.callbacks = CallbackQueue()
+        self.client = ChatClient(f"{SERVER_HOST}:{SERVER_PORT}", dispatch=self.callbacks.post)
+        self.subscription = None
+        # identifies the running ReadNewMessages polling loop, None when there is none
+        self.polling = None
+        self.after(CALLBACK_POLL_MS, self.run_callbacks)
 
         #frame creations and storage for navigation
         container = tk.Frame(self)
@@ -51,18 +63,64 @@ class ChatClientApp(tk.Tk):
         frame = self.frames[frame_class]
         frame.tkraise()
 
-    #storing who is logged in currently
-    def set_current_user(self, username):
-        self.current_user = username
+    #retrieving who is the current user (set by a successful login)
+    def get_current_user(self):
+        return self.client.username
+
+    #runs on the Tk loop
+    def run_callbacks(self):
+        self.callbacks.run_pending()
+        self.after(CALLBACK_POLL_MS, self.run_callbacks)
+
+    #call on_result(response) on the Tk loop once `future` finishes; failed calls show an error
+    def when_done(self, future, on_result):
+        self.client.on_done(future, on_result, lambda e: messagebox.showerror("Error", str(e)))
+
+    #open the Subscribe stream for the logged in user; pushed messages land in the main frame
+    def start_subscription(self):
+        self.stop_subscription()
+        main = self.frames[MainFrame]
+        self.subscription = self.client.subscribe(lambda message: main.show_incoming(format_message(message)),
+                                                  self.subscription_ended)
+
+    #the stream gave up for good; unless the server simply closed it (account deleted), tell the
+    #user and poll ReadNewMessages instead
+    def subscription_ended(self, error):
+        self.subscription = None
+        if error is None:
+            return
+        messagebox.showwarning("Live Updates Stopped", f"{error.details()}\nChecking for new messages every "
+                                                       f"{NEW_MESSAGES_POLL_MS // 1000} seconds instead.")
+        polling = self.polling = object()
+        self.poll_new_messages(polling)
 
+    def poll_new_messages(self, polling):
+        if self.polling is not polling:
+            return
+        future = self.client.read_new_messages()
+        self.client.on_done(future, lambda response: self.new_messages_polled(polling, response),
+                            lambda error: self.after(NEW_MESSAGES_POLL_MS, self.poll_new_messages, polling))
 
-    #retrieving who is the current user
-    def get_current_user(self):
-        return self.current_user
+    def new_messages_polled(self, polling, response):
+        if self.polling is not polling:
+            return
+        if response.success:
+            main = self.frames[MainFrame]
+            for message in response.messages:
+                main.show_incoming(format_message(message))
+        self.after(NEW_MESSAGES_POLL_MS, self.poll_new_messages, polling)
+
+    #cancel the stream (or the polling that replaced it) on logout/account deletion, this also ends its background thread
+    def stop_subscription(self):
+        self.polling = None
+        if self.subscription is not None:
+            self.subscription.cancel()
+            self.subscription = None
 
     #exitting the application
     def cleanup(self):
-        # For gRPC, simply closing the Tkinter window is enough.
+        self.stop_subscription()
+        self.client.close()
         self.destroy()
 
 # Start frame and MainFrames and storing the frames
@@ -86,14 +144,9 @@ class StartFrame(tk.Frame):
         if not password:
             return
 
-        hashed_pass = hash_password(password)
-        request = chat_pb2.CreateAccountRequest(username=username, password=hashed_pass)
-        try:
-            response = self.controller.stub.CreateAccount(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.create_account(username, password), self.account_created)
 
+    def account_created(self, response):
         if response.success:
             messagebox.showinfo("Success", response.message)
         else:
@@ -108,16 +161,12 @@ class StartFrame(tk.Frame):
         if not password:
             return
 
-        hashed_pass = hash_password(password)
-        request = chat_pb2.LoginRequest(username=username, password=hashed_pass)
-        try:
-            response = self.controller.stub.Login(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.login(username, password), self.logged_in)
 
+    #the client has already stored the user and session token
+    def logged_in(self, response):
         if response.success:
-            self.controller.set_current_user(username)
+            self.controller.start_subscription()
             messagebox.showinfo("Logged In", f"{response.message}\nUnread messages: {response.unread_count}")
             self.controller.show_frame(MainFrame)
         else:
@@ -143,9 +192,24 @@ class MainFrame(tk.Frame):
         tk.Button(self, text="Send Message", width=20, command=self.send_message).pack(pady=5)
         tk.Button(self, text="Read New Messages", width=20, command=self.read_new_messages).pack(pady=5)
         tk.Button(self, text="Show All Messages", width=20, command=self.show_all_messages).pack(pady=5)
+        tk.Button(self, text="Search Messages", width=20, command=self.search_messages).pack(pady=5)
+        tk.Button(self, text="Conversation", width=20, command=self.show_conversation).pack(pady=5)
+        tk.Button(self, text="Create Group", width=20, command=self.create_group).pack(pady=5)
+        tk.Button(self, text="Join Group", width=20, command=self.join_group).pack(pady=5)
+        tk.Button(self, text="Send to Group", width=20, command=self.send_group_message).pack(pady=5)
         tk.Button(self, text="Delete My Account", width=20, command=self.delete_account).pack(pady=5)
         tk.Button(self, text="Logout", width=20, command=self.logout).pack(pady=5)
 
+        #messages pushed by the server while logged in
+        tk.Label(self, text="Incoming messages").pack()
+        self.incoming_list = tk.Listbox(self, height=6)
+        self.incoming_list.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+    #append a pushed message to the incoming list
+    def show_incoming(self, message):
+        self.incoming_list.insert(tk.END, message)
+        self.incoming_list.see(tk.END)
+
     #logged in user info appended to the user interface
     def tkraise(self, aboveThis=None):
         user = self.controller.get_current_user()
@@ -160,16 +224,15 @@ class MainFrame(tk.Frame):
         pattern = simpledialog.askstring("List Accounts", "Enter wildcard pattern (or leave blank):", parent=self)
         if pattern is None:
             pattern = ""
-        request = chat_pb2.ListAccountsRequest(username=self.controller.get_current_user(), pattern=pattern)
-        try:
-            response = self.controller.stub.ListAccounts(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        future = self.controller.client.list_accounts(pattern=pattern, page_size=ACCOUNTS_PAGE_SIZE)
+        self.controller.when_done(future, self.accounts_listed)
 
+    def accounts_listed(self, response):
         if response.success:
             accounts = response.accounts
             msg = "\n".join(accounts) if accounts else "No matching accounts found."
+            if response.next_page_token:
+                msg += "\n... more accounts match, refine the pattern."
             messagebox.showinfo("Accounts", msg)
         else:
             messagebox.showerror("Error", "Error listing accounts.")
@@ -182,22 +245,34 @@ class MainFrame(tk.Frame):
         content = simpledialog.askstring("Send Message", "Message content:", parent=self)
         if content is None:
             return
-        request = chat_pb2.SendMessageRequest(
-            sender=self.controller.get_current_user(),
-            to=recipient,
-            content=content
-        )
-        try:
-            response = self.controller.stub.SendMessage(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.send_message(recipient, content), self.message_sent)
 
+    def message_sent(self, response):
         if response.success:
             messagebox.showinfo("Success", response.message)
         else:
             messagebox.showerror("Error", response.message)
 
+    #group channels: their messages arrive with the direct ones, marked with the group name
+    def create_group(self):
+        group = simpledialog.askstring("Create Group", "Group name:", parent=self)
+        if group:
+            self.controller.when_done(self.controller.client.create_group(group), self.message_sent)
+
+    def join_group(self):
+        group = simpledialog.askstring("Join Group", "Group name:", parent=self)
+        if group:
+            self.controller.when_done(self.controller.client.join_group(group), self.message_sent)
+
+    def send_group_message(self):
+        group = simpledialog.askstring("Send to Group", "Group name:", parent=self)
+        if not group:
+            return
+        content = simpledialog.askstring("Send to Group", "Message content:", parent=self)
+        if content is None:
+            return
+        self.controller.when_done(self.controller.client.send_group_message(group, content), self.message_sent)
+
     #reading new messages from the server
     def read_new_messages(self):
         #Asking how many unread messages we want to retrieve
@@ -212,19 +287,14 @@ class MainFrame(tk.Frame):
             except ValueError:
                 count = 0
         #Send requests to fetch unread messages
-        request = chat_pb2.ReadNewMessagesRequest(username=self.controller.get_current_user(), count=count)
-        try:
-            response = self.controller.stub.ReadNewMessages(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.read_new_messages(count), self.new_messages_read)
 
-        
-        #displaying messages or showing modification if no messages are available for displaying 
+    #displaying messages or showing modification if no messages are available for displaying 
+    def new_messages_read(self, response):
         if response.success:
             messages = response.messages
             if messages:
-                display_str = "\n".join(f"{idx+1}. {msg}" for idx, msg in enumerate(messages))
+                display_str = "\n".join(f"{idx+1}. {format_message(msg)}" for idx, msg in enumerate(messages))
                 messagebox.showinfo("New Messages", display_str)
             else:
                 messagebox.showinfo("New Messages", "No new messages.")
@@ -235,20 +305,53 @@ class MainFrame(tk.Frame):
 
     def show_all_messages(self):
         #send request to retrieve all messages including previously read messages
-        request = chat_pb2.ListMessagesRequest(username=self.controller.get_current_user())
-        try:
-            response = self.controller.stub.ListMessages(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.list_messages(), self.messages_listed)
 
-        #new window to display the messages
+    #new window to display the messages
+    def messages_listed(self, response):
         if response.success:
             messages = response.messages
-            ShowMessagesWindow(self.controller, messages)
+            ShowMessagesWindow(self.controller, messages, response.has_archived, response.next_before_id)
         else:
             messagebox.showerror("Error", "Error listing messages.")
 
+    #keyword search over the stored messages, newest first
+    def search_messages(self):
+        query = simpledialog.askstring("Search Messages", "Words to look for:", parent=self)
+        if query is None:
+            return
+        sender = simpledialog.askstring("Search Messages", "Only from this user (or leave blank):", parent=self)
+        future = self.controller.client.search_messages(query, sender=sender or "", page_size=SEARCH_PAGE_SIZE)
+        self.controller.when_done(future, self.messages_found)
+
+    def messages_found(self, response):
+        if response.success:
+            messages = response.messages
+            msg = "\n".join(format_message(m) for m in messages) if messages else "No matching messages found."
+            if response.next_before_id:
+                msg += "\n... older messages match too, refine the search."
+            messagebox.showinfo("Search Results", msg)
+        else:
+            messagebox.showerror("Error", "Error searching messages.")
+
+    #the latest messages exchanged with one user, both ways
+    def show_conversation(self):
+        peer = simpledialog.askstring("Conversation", "Conversation with:", parent=self)
+        if not peer:
+            return
+        future = self.controller.client.conversation_history(peer, limit=CONVERSATION_PAGE_SIZE)
+        self.controller.when_done(future, lambda response: self.conversation_shown(peer, response))
+
+    def conversation_shown(self, peer, response):
+        if response.success:
+            messages = response.messages
+            msg = "\n".join(format_message(m) for m in messages) if messages else f"No messages with {peer} yet."
+            if response.has_older:
+                msg = "... earlier messages not shown\n" + msg
+            messagebox.showinfo(f"Conversation with {peer}", msg)
+        else:
+            messagebox.showerror("Error", "Error loading the conversation.")
+
     #delete the account's function
     def delete_account(self):
         #ask for confirmation before deletting
@@ -256,28 +359,28 @@ class MainFrame(tk.Frame):
         if not confirm:
             return
         #sending a request to delete the account
-        request = chat_pb2.DeleteAccountRequest(username=self.controller.get_current_user())
-        try:
-            response = self.controller.stub.DeleteAccount(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.delete_account(), self.account_deleted)
 
-        #notify user about the deletion of the account and change the screen to start screen
+    #notify user about the deletion of the account and change the screen to start screen
+    def account_deleted(self, response):
         if response.success:
             messagebox.showinfo("Account Deleted", response.message)
-            self.controller.set_current_user("")
+            self.controller.stop_subscription()
+            self.incoming_list.delete(0, tk.END)
             self.controller.show_frame(StartFrame)
         else:
             messagebox.showerror("Error", response.message)
 
     #definition of logout
     def logout(self):
-        self.controller.set_current_user("")
+        self.controller.stop_subscription()
+        # fire and forget: the session is dropped locally whatever the server answers
+        self.controller.client.logout()
+        self.incoming_list.delete(0, tk.END)
         self.controller.show_frame(StartFrame)
 
 class ShowMessagesWindow(tk.Toplevel):
-    def __init__(self, controller: ChatClientApp, messages):
+    def __init__(self, controller: ChatClientApp, messages, has_archived=False, read_before_id=0):
         super().__init__()
         self.controller = controller
         self.title("All Messages")
@@ -292,41 +395,86 @@ class ShowMessagesWindow(tk.Toplevel):
         self.frame = tk.Frame(self)
         self.frame.pack(fill="both", expand=True)
 
-        #display the selected messages 
+        #display the messages, each checkbox remembers the server id of its message
         for idx, msg in enumerate(self.messages, start=1):
-            var = tk.BooleanVar()
-            chk = tk.Checkbutton(
-                self.frame,
-                text=f"{idx}. {msg}",
-                variable=var,
-                anchor="w",
-                justify="left",
-                wraplength=350
-            )
-            chk.pack(fill="x", padx=5, pady=2)
-            self.check_vars.append((var, idx))
+            self.add_message(f"{idx}. {format_message(msg)}", msg.id)
+
+        #older read messages, then the ones moved to the server's archive, are fetched one page at a time
+        self.read_before_id = read_before_id
+        self.has_archived = has_archived
+        self.before_id = 0
+        self.older_button = tk.Button(self, text="Load Older Messages", command=self.load_older)
+        if read_before_id or has_archived:
+            self.older_button.pack(pady=5, before=self.frame)
 
         #Buttons for deleting the selected messages
         tk.Button(self, text="Delete Selected", command=self.delete_selected).pack(pady=5)
         tk.Button(self, text="Close", command=self.destroy).pack(pady=5)
 
+    #one checkbox per message, above `before` if given
+    def add_message(self, text, message_id, before=None):
+        var = tk.BooleanVar()
+        chk = tk.Checkbutton(
+            self.frame,
+            text=text,
+            variable=var,
+            anchor="w",
+            justify="left",
+            wraplength=350
+        )
+        if before is None:
+            chk.pack(fill="x", padx=5, pady=2)
+        else:
+            chk.pack(fill="x", padx=5, pady=2, before=before)
+        self.check_vars.append((var, message_id))
+
+    def load_older(self):
+        if self.read_before_id:
+            future = self.controller.client.list_messages(before_id=self.read_before_id)
+            self.controller.when_done(future, self.older_read_loaded)
+            return
+        future = self.controller.client.list_messages(archived=True, before_id=self.before_id)
+        self.controller.when_done(future, self.older_loaded)
+
+    #the next page of read messages goes above the ones already shown
+    def older_read_loaded(self, response):
+        if not response.success:
+            messagebox.showerror("Error", "Error listing messages.")
+            return
+        self.add_above(response.messages, "")
+        self.read_before_id = response.next_before_id
+        if not self.read_before_id and not self.has_archived:
+            self.older_button.pack_forget()
+
+    def add_above(self, messages, prefix):
+        shown = self.frame.pack_slaves()
+        top = shown[0] if shown else None
+        for msg in messages:
+            self.add_message(f"{prefix}{format_message(msg)}", msg.id, before=top)
+
+    #archived messages go above the ones already shown, oldest first
+    def older_loaded(self, response):
+        if not response.success:
+            messagebox.showerror("Error", "Error listing archived messages.")
+            return
+        self.add_above(response.messages, "(archived) ")
+        self.before_id = response.next_before_id
+        if not response.has_archived:
+            self.older_button.pack_forget()
+
     #Delete Selected Messages
     def delete_selected(self):
         #Get selected messages to delete
-        selected = [idx for var, idx in self.check_vars if var.get()]
+        selected = [message_id for var, message_id in self.check_vars if var.get()]
         if not selected:
             messagebox.showinfo("Info", "No messages selected.")
             return
 
         #Send delete request to the server
-        request = chat_pb2.DeleteMessagesRequest(username=self.controller.get_current_user(), message_ids=selected)
-        try:
-            response = self.controller.stub.DeleteMessages(request)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return
+        self.controller.when_done(self.controller.client.delete_messages(selected), self.messages_deleted)
 
-        #Notification if deletion is successful
+    #Notification if deletion is successful
+    def messages_deleted(self, response):
         if response.success:
             messagebox.showinfo("Success", response.message)
             self.destroy()
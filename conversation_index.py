@@ -0,0 +1,63 @@
+import bisect
+
+from message_index import insert_id, remove_id
+
+# ---------------------------
+# Per-user conversation index for ConversationHistory.
+# Each peer the user has exchanged direct messages with maps to the sorted ids
+# of both sides of that conversation: the messages received from the peer
+# (read or not) and the user's own copies of the messages sent to them (see
+# Inbox.sent). Message ids grow over time, so a conversation is already in
+# order, and a page is two bisects and a slice whatever the size of the inbox.
+# Like the search index, an inbox builds it on first use and keeps it in step
+# with every append and delete from then on (see Inbox).
+# ---------------------------
+
+
+class ConversationIndex:
+    #`received` yields Messages, `sent` (peer, Message) pairs
+    def __init__(self, received=(), sent=()):
+        # id -> Message and id -> peer for every indexed message
+        self.messages = {}
+        self.peers = {}
+        # peer -> sorted ids
+        self.conversations = {}
+        for message in received:
+            self.add(message.sender, message)
+        for peer, message in sent:
+            self.add(peer, message)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, peer, message):
+        message_id = message.id
+        self.messages[message_id] = message
+        self.peers[message_id] = peer
+        insert_id(self.conversations.setdefault(peer, []), message_id)
+
+    def remove(self, message_id):
+        if self.messages.pop(message_id, None) is None:
+            return
+        peer = self.peers.pop(message_id)
+        ids = self.conversations[peer]
+        remove_id(ids, message_id)
+        if not ids:
+            del self.conversations[peer]
+
+    #up to `limit` messages (all if limit <= 0) of the conversation with `peer`, oldest first, between
+    #the cursors (0 leaves an end open): the oldest ones above `after_id`, otherwise the newest below
+    #`before_id`. Returns (messages, has_older, has_newer), whether any are left on either side
+    def page(self, peer, before_id=0, after_id=0, limit=0):
+        ids = self.conversations.get(peer)
+        if not ids:
+            return [], False, False
+        start = bisect.bisect_right(ids, after_id) if after_id else 0
+        end = bisect.bisect_left(ids, before_id) if before_id else len(ids)
+        if 0 < limit < end - start:
+            if after_id:
+                end = start + limit
+            else:
+                start = end - limit
+        messages = self.messages
+        return [messages[i] for i in ids[start:end]], start > 0, end < len(ids)
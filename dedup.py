@@ -0,0 +1,87 @@
+import time
+import threading
+
+# ---------------------------
+# Idempotent sends.
+# A SendMessage may carry a client-chosen request_id. The first call with a
+# given (sender, request_id) runs; its response is remembered for `ttl_s`
+# seconds and handed back for any repeat, so clients can retry (by hand, or
+# through a gRPC retry policy) without delivering twice. A repeat that
+# arrives while the first call is still running waits for it instead of
+# sending again. A call that raises is forgotten, so its retry runs.
+# At most `max_entries` responses are kept, the oldest dropped first; calls
+# still running are never dropped, so their repeats always wait for them. Like
+# sessions, the cache is not persisted: a retry that spans a server restart
+# is not recognised.
+# ---------------------------
+MAX_REQUEST_ID_LENGTH = 128
+
+
+class DedupEntry:
+    __slots__ = ("done", "response", "expires")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.expires = 0
+
+
+class DedupCache:
+    def __init__(self, ttl_s=300, max_entries=100000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> DedupEntry for calls still running; they are never evicted
+        self.running = {}
+        # key -> DedupEntry for finished calls, in order of expiry (the ttl is fixed,
+        # so appending as calls finish keeps it)
+        self.entries = {}
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.running) + len(self.entries)
+
+    #the response of the first call made under `key`, running `call()` if this is that call
+    def run(self, key, call):
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                entry = self.running.get(key)
+                if entry is None:
+                    entry = self.entries.get(key)
+                    if entry is None or entry.expires < now:
+                        self.entries.pop(key, None)
+                        if len(self) >= self.max_entries:
+                            self.evict(now)
+                        entry = self.running[key] = DedupEntry()
+                        break
+            entry.done.wait()
+            if entry.response is not None:
+                with self.lock:
+                    self.hits += 1
+                return entry.response
+            # the first call failed; the next loop runs this one instead
+
+        try:
+            response = call()
+        except BaseException:
+            with self.lock:
+                del self.running[key]
+            entry.done.set()
+            raise
+        entry.response = response
+        with self.lock:
+            entry.expires = time.monotonic() + self.ttl_s
+            del self.running[key]
+            self.entries[key] = entry
+        entry.done.set()
+        return response
+
+    #make room (caller holds the lock): expired entries from the front, then the oldest finished ones
+    def evict(self, now):
+        entries = self.entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.expires >= now and len(self) < self.max_entries:
+                break
+            del entries[key]
@@ -0,0 +1,268 @@
+import bisect
+import heapq
+import threading
+from contextlib import ExitStack
+
+from inbox import Message
+
+# ---------------------------
+# Group channels.
+# A group message is stored once, in its group, however many members there
+# are; a member has only a read cursor, the id of the last group message they
+# were given. A member's unread group mail is what lies after their cursor,
+# found with a bisect, so a send costs the same for ten members or ten
+# thousand. A new member's cursor starts at the end of the history. A group
+# keeps at most `max_history` messages and drops the oldest first, so a cursor
+# may point below what is left.
+# Locking: `GroupStore.lock` guards the group table and the memberships, each
+# Group's `lock` guards its history and cursors. A caller holding the store
+# lock may take one group lock; several group locks are only ever taken
+# without the store lock, in name order.
+# GroupFanout wakes the Subscribe streams of a group's members. It tracks only
+# users with a stream open, so a send touches the online members and nothing
+# else.
+# ---------------------------
+MAX_GROUP_NAME_LENGTH = 64
+DEFAULT_MAX_HISTORY = 10000
+
+
+class UnknownGroup(LookupError):
+    pass
+
+
+class NotAMember(LookupError):
+    pass
+
+
+#for replaying log records, which are already logged
+def not_logged(record):
+    return 0
+
+
+class Group:
+    def __init__(self, owner):
+        self.owner = owner
+        self.lock = threading.Lock()
+        self.messages = []
+        # ids of `messages`, ascending, for bisecting cursors
+        self.ids = []
+        self.last_id = 0
+        # member -> id of the last message they were given
+        self.cursors = {}
+
+    def append(self, message, max_history):
+        self.messages.append(message)
+        self.ids.append(message.id)
+        self.last_id = message.id
+        if max_history and len(self.messages) > max_history:
+            # a tenth at a time, so trimming costs O(1) per message on average
+            cut = len(self.messages) - max_history + max_history // 10
+            del self.messages[:cut]
+            del self.ids[:cut]
+
+    #messages after the member's cursor, oldest first
+    def unread(self, member):
+        return self.messages[bisect.bisect_right(self.ids, self.cursors[member]):]
+
+    def unread_count(self, member):
+        return len(self.ids) - bisect.bisect_right(self.ids, self.cursors[member])
+
+
+class GroupStore:
+    def __init__(self, max_history=DEFAULT_MAX_HISTORY):
+        self.max_history = max_history
+        self.lock = threading.Lock()
+        self.groups = {}
+        # username -> names of their groups
+        self.memberships = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def clear(self):
+        with self.lock:
+            self.groups = {}
+            self.memberships = {}
+
+    #(created, seq); False when the name is taken
+    def create(self, name, owner, log):
+        with self.lock:
+            if name in self.groups:
+                return False, 0
+            group = self.groups[name] = Group(owner)
+            group.cursors[owner] = 0
+            self.memberships.setdefault(owner, set()).add(name)
+            return True, log({"op": "group_create", "group": name, "user": owner})
+
+    #(joined, seq); False when already a member
+    def join(self, name, username, log):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is None:
+                raise UnknownGroup(name)
+            with group.lock:
+                if username in group.cursors:
+                    return False, 0
+                group.cursors[username] = group.last_id
+            self.memberships.setdefault(username, set()).add(name)
+            return True, log({"op": "group_join", "group": name, "user": username})
+
+    #store one message in the group, returns (Message, seq); the sender must be a member
+    def append(self, name, sender, content, timestamp_ms, next_id, log):
+        group = self.groups.get(name)
+        if group is None:
+            raise UnknownGroup(name)
+        with group.lock:
+            if sender not in group.cursors:
+                raise NotAMember(sender)
+            message = Message(next_id(), sender, content, timestamp_ms)
+            group.append(message, self.max_history)
+            seq = log({"op": "group_send", "group": name, "id": message.id, "from": sender,
+                       "content": content, "timestamp": timestamp_ms})
+        return message, seq
+
+    def groups_of(self, username):
+        with self.lock:
+            return sorted(self.memberships.get(username, ()))
+
+    def unread_count(self, username):
+        count = 0
+        for name in self.groups_of(username):
+            group = self.groups.get(name)
+            if group is not None:
+                with group.lock:
+                    count += group.unread_count(username) if username in group.cursors else 0
+        return count
+
+    #up to `count` (all if count <= 0) of the user's unread group messages, oldest first across
+    #their groups, as (group name, Message) pairs; their cursors move past them. Returns (pairs, seq)
+    def take_unread(self, username, count, log):
+        names = self.groups_of(username)
+        if not names:
+            return [], 0
+        with ExitStack() as stack:
+            groups = {}
+            for name in names:
+                group = self.groups.get(name)
+                if group is not None:
+                    stack.enter_context(group.lock)
+                    if username in group.cursors:
+                        groups[name] = group
+            pending = [[(m.id, name, m) for m in group.unread(username)] for name, group in groups.items()]
+            taken = list(heapq.merge(*pending))
+            if count > 0:
+                del taken[count:]
+            if not taken:
+                return [], 0
+            cursors = {}
+            for message_id, name, _ in taken:
+                cursors[name] = message_id
+            for name, cursor in cursors.items():
+                groups[name].cursors[username] = cursor
+            seq = log({"op": "group_read", "user": username, "cursors": cursors})
+        return [(name, m) for _, name, m in taken], seq
+
+    #move cursors as a logged "group_read" did
+    def set_cursors(self, username, cursors):
+        for name, cursor in cursors.items():
+            group = self.groups.get(name)
+            if group is not None:
+                with group.lock:
+                    if username in group.cursors:
+                        group.cursors[username] = max(group.cursors[username], cursor)
+
+    #drop a deleted account's memberships; the messages it sent stay
+    def forget_user(self, username):
+        with self.lock:
+            for name in self.memberships.pop(username, ()):
+                group = self.groups.get(name)
+                if group is not None:
+                    with group.lock:
+                        group.cursors.pop(username, None)
+
+    #plain JSON-able form, as kept in snapshots
+    def dump(self):
+        with self.lock:
+            groups = list(self.groups.items())
+        dumped = {}
+        for name, group in groups:
+            with group.lock:
+                dumped[name] = {"owner": group.owner, "last_id": group.last_id, "cursors": dict(group.cursors),
+                                "messages": [m.to_dict() for m in group.messages]}
+        return dumped
+
+    def load(self, data):
+        for name, dumped in data.items():
+            group = Group(dumped["owner"])
+            for m in dumped["messages"]:
+                group.append(Message.from_dict(m), self.max_history)
+            group.last_id = dumped["last_id"]
+            group.cursors = dict(dumped["cursors"])
+            with self.lock:
+                self.groups[name] = group
+                for member in group.cursors:
+                    self.memberships.setdefault(member, set()).add(name)
+
+    #highest message id held, 0 if none
+    def last_message_id(self):
+        return max((group.last_id for group in self.groups.values()), default=0)
+
+
+#a user with Subscribe streams open: what the streams wait on, how many there are, and the user's groups
+class OnlineUser:
+    __slots__ = ("watch", "streams", "groups")
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.streams = 0
+        self.groups = set()
+
+
+class GroupFanout:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # username -> OnlineUser
+        self.users = {}
+        # group -> {username: watch} of the members that are online
+        self.online = {}
+
+    #a Subscribe stream opened; register it before reading the user's groups (see joined)
+    def subscribe(self, username, watch):
+        with self.lock:
+            user = self.users.get(username)
+            if user is None or user.watch is not watch:
+                user = self.users[username] = OnlineUser(watch)
+            user.streams += 1
+
+    def unsubscribe(self, username, watch):
+        with self.lock:
+            user = self.users.get(username)
+            if user is None or user.watch is not watch:
+                return
+            user.streams -= 1
+            if user.streams:
+                return
+            del self.users[username]
+            for group in user.groups:
+                members = self.online.get(group)
+                if members is not None:
+                    members.pop(username, None)
+                    if not members:
+                        del self.online[group]
+
+    #the user is a member of `group`; only matters while they are online
+    def joined(self, group, username):
+        with self.lock:
+            user = self.users.get(username)
+            if user is not None:
+                user.groups.add(group)
+                self.online.setdefault(group, {})[username] = user.watch
+
+    #wake the streams of the group's online members
+    def notify(self, group):
+        with self.lock:
+            watches = list(self.online.get(group, {}).values())
+        for watch in watches:
+            with watch.changed:
+                watch.group_mail = True
+                watch.notify()
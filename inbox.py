@@ -0,0 +1,212 @@
+import sys
+import threading
+from collections import deque
+from itertools import chain
+
+from message_index import MessageIndex
+from conversation_index import ConversationIndex
+
+# ---------------------------
+# Per-user mailbox.
+# Unread messages wait in a FIFO queue in arrival order and move to the read
+# history once they are delivered. Reads always take the oldest unread
+# messages first, so "read history + unread queue" is the whole mailbox in
+# arrival order, and the unread count is kept as a running counter.
+# The read history is an insertion-ordered dict keyed by the server-assigned
+# id, and the ids of live unread messages are kept in a set (`unread_ids`), so
+# deleting k messages costs O(k). Unread messages deleted by id are dropped
+# from `unread_ids` only and skipped when the queue reaches them. Whether a
+# message is read is given by where it is kept, so messages carry no flag.
+# `changed` guards the inbox and wakes Subscribe streams waiting for new mail;
+# callers hold it around any access that can race with a stream. `listeners`
+# are extra wake-up callbacks for waiters that cannot block on the condition
+# (asyncio streams); they must be cheap and thread-safe.
+# `index` is the inbox's search index (see message_index.py): None until the
+# user's first search, then kept in step with every append and delete.
+# `sent` keeps the user's own copies of the direct messages they sent, id ->
+# (recipient, Message), sharing the Message with the recipient's inbox. They
+# are not mail: they are never unread, counted or searched, and only the
+# conversation index (see conversation_index.py, built the same lazy way as
+# the search index) reads them.
+# ---------------------------
+
+
+#one stored message. Slots instead of a dict per message, and one interned copy
+#of each sender name shared by all of that user's messages; `timestamp` is
+#epoch milliseconds, formatted only by clients
+class Message:
+    __slots__ = ("id", "sender", "content", "timestamp")
+
+    def __init__(self, id, sender, content, timestamp):
+        self.id = id
+        self.sender = sys.intern(sender)
+        self.content = content
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"Message({self.id!r}, {self.sender!r}, {self.content!r}, {self.timestamp!r})"
+
+    #plain JSON-able form, as kept in snapshots and the write-ahead log
+    def to_dict(self):
+        return {"id": self.id, "from": self.sender, "content": self.content, "timestamp": self.timestamp}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data["from"], data["content"], data["timestamp"])
+
+
+#the part of an inbox that Subscribe streams wait on. Users kept in SQLite
+#(see storage.py) have one of these on its own, without the in-memory queues
+class InboxSignals:
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.listeners = set()
+        self.closed = False
+        # set by GroupFanout when one of the user's groups got a message (see groups.py)
+        self.group_mail = False
+
+    #wake every waiting stream (caller holds `changed`)
+    def notify(self):
+        self.changed.notify_all()
+        for listener in list(self.listeners):
+            listener()
+
+    #mark the inbox as gone (account deleted) and wake every waiting stream
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.notify()
+
+
+class Inbox(InboxSignals):
+    def __init__(self):
+        super().__init__()
+        self.unread = deque()
+        self.read = {}
+        self.unread_ids = set()
+        self.unread_count = 0
+        self.index = None
+        self.sent = {}
+        self.conversations = None
+
+    def __len__(self):
+        return len(self.read) + self.unread_count
+
+    #all messages in arrival order (read first, then unread)
+    def __iter__(self):
+        return chain(self.read.values(), self.unread_messages())
+
+    def read_messages(self):
+        return list(self.read.values())
+
+    #the newest `limit` read messages (all if limit <= 0) below `before_id` (0: from the newest), in
+    #arrival order, and whether older ones are left. Walks back from the newest, so the first pages are cheap
+    def read_page(self, before_id=0, limit=0):
+        read = self.read
+        page = []
+        more = False
+        for message_id in reversed(read):
+            if before_id and message_id >= before_id:
+                continue
+            if 0 < limit <= len(page):
+                more = True
+                break
+            page.append(read[message_id])
+        page.reverse()
+        return page, more
+
+    #unread messages in arrival order, skipping ones deleted while still queued
+    def unread_messages(self):
+        unread_ids = self.unread_ids
+        return [m for m in self.unread if m.id in unread_ids]
+
+    #queue a newly delivered Message
+    def append(self, message):
+        self.unread.append(message)
+        self.unread_ids.add(message.id)
+        self.unread_count += 1
+        if self.index is not None:
+            self.index.add(message)
+        if self.conversations is not None:
+            self.conversations.add(message.sender, message)
+
+    #keep the user's copy of a Message they sent to `to_user`
+    def add_sent(self, to_user, message):
+        self.sent[message.id] = (to_user, message)
+        if self.conversations is not None:
+            self.conversations.add(to_user, message)
+
+    #pop up to `count` oldest unread messages (all of them if count <= 0) and move them to the read history
+    def take_unread(self, count=0):
+        if count <= 0 or count > self.unread_count:
+            count = self.unread_count
+        popleft = self.unread.popleft
+        unread_ids = self.unread_ids
+        read = self.read
+        selected = []
+        while len(selected) < count:
+            m = popleft()
+            if m.id in unread_ids:
+                unread_ids.remove(m.id)
+                selected.append(m)
+                read[m.id] = m
+        self.unread_count -= count
+        return selected
+
+    #drop the user's copies of sent messages by id (retention), leaving received mail alone
+    def delete_sent(self, ids):
+        deleted = 0
+        conversations = self.conversations
+        for message_id in ids:
+            if self.sent.pop(message_id, None) is None:
+                continue
+            deleted += 1
+            if conversations is not None:
+                conversations.remove(message_id)
+        return deleted
+
+    #delete messages by id, received or sent, returns how many were removed
+    def delete_ids(self, ids):
+        deleted = 0
+        index = self.index
+        conversations = self.conversations
+        for message_id in ids:
+            if self.read.pop(message_id, None) is not None:
+                deleted += 1
+            elif message_id in self.unread_ids:
+                self.unread_ids.remove(message_id)
+                self.unread_count -= 1
+                deleted += 1
+            elif self.sent.pop(message_id, None) is not None:
+                deleted += 1
+            else:
+                continue
+            if index is not None:
+                index.remove(message_id)
+            if conversations is not None:
+                conversations.remove(message_id)
+        if not self.unread_count:
+            # nothing live is queued, drop any skipped entries
+            self.unread.clear()
+        return deleted
+
+    def clear(self):
+        self.unread.clear()
+        self.read = {}
+        self.unread_ids = set()
+        self.unread_count = 0
+        self.index = None
+        self.sent = {}
+        self.conversations = None
+
+    #the search index, built from the stored messages on first use
+    def search_index(self):
+        if self.index is None:
+            self.index = MessageIndex(self)
+        return self.index
+
+    #the conversation index, built from the stored and sent messages on first use
+    def conversation_index(self):
+        if self.conversations is None:
+            self.conversations = ConversationIndex(self, self.sent.values())
+        return self.conversations
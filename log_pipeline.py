@@ -0,0 +1,81 @@
+import os
+import queue
+import random
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# ---------------------------
+# Non-blocking server logging.
+# Request threads only put LogRecords on a bounded in-memory queue; a single
+# QueueListener thread formats them and writes them to a size-rotated file.
+# Records are not formatted on the request thread (the message is built from
+# its %-style args on the listener), and when the queue is full records are
+# dropped and counted rather than making the RPC wait.
+# Per-RPC lines go to the "chat.rpc" logger and can be sampled.
+# ---------------------------
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+RPC_LOGGER = "chat.rpc"
+
+rpc_log = logging.getLogger(RPC_LOGGER)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    #the listener formats the record, so keep msg/args untouched here
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+#lets through WARNING and above, and a `rate` fraction of lower-level records
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+#install the pipeline on the root logger; returns the running listener (stop() it on shutdown).
+#`name` prefixes the file name, so processes sharing log_dir write separate files
+def start_logging(settings, log_dir="logs", name="chat_server"):
+    os.makedirs(log_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filename = os.path.join(log_dir, f"{name}_{timestamp}.log")
+
+    file_handler = RotatingFileHandler(
+        log_filename,
+        maxBytes=settings.get("max_bytes", 10 * 1024 * 1024),
+        backupCount=settings.get("backup_count", 5)
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.get("queue_size", 10000)))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(settings.get("level", "INFO"))
+
+    rate = settings.get("rpc_sample_rate", 1.0)
+    for old in rpc_log.filters[:]:
+        rpc_log.removeFilter(old)
+    if rate < 1.0:
+        rpc_log.addFilter(SamplingFilter(rate))
+
+    listener = QueueListener(handler.queue, file_handler)
+    listener.start()
+    logging.info("-------------------------------------------------")
+    logging.info("Chat Server started.")
+    logging.info("Logging to file: %s", log_filename)
+    return listener
@@ -0,0 +1,110 @@
+import re
+import bisect
+
+# ---------------------------
+# Per-user inverted index for SearchMessages.
+# Every word of a message (lowercased; anything that is not a letter or digit
+# separates words) maps to the sorted ids of the user's messages containing
+# it, and every sender to the ids of their messages. A search walks the
+# shortest list it needs from the newest id down and checks the others with a
+# bisect, so its cost follows the rarest word and the page size rather than
+# the size of the inbox. Message ids grow over time, so new mail lands at the
+# end of each list, and a deleted message is taken out of the lists of its
+# own words only. Timestamps do not follow ids exactly (a batch shares one, a
+# remote sender's clock is kept), so a date range is checked per message.
+# An inbox builds its index on the first search and keeps it up to date from
+# then on (see Inbox), so users who never search pay nothing for it.
+# ---------------------------
+MAX_QUERY_LENGTH = 256
+MAX_QUERY_WORDS = 8
+# the same split as SQLite's unicode61 tokenizer, so both backends find the same messages
+WORD = re.compile(r"[^\W_]+")
+
+
+#the distinct words of a text, as the index and queries see them
+def words(text):
+    return set(WORD.findall(text.lower()))
+
+
+def insert_id(ids, message_id):
+    if not ids or ids[-1] < message_id:
+        ids.append(message_id)
+    else:
+        bisect.insort(ids, message_id)
+
+
+def remove_id(ids, message_id):
+    i = bisect.bisect_left(ids, message_id)
+    if i < len(ids) and ids[i] == message_id:
+        del ids[i]
+
+
+def contains_id(ids, message_id):
+    i = bisect.bisect_left(ids, message_id)
+    return i < len(ids) and ids[i] == message_id
+
+
+class MessageIndex:
+    def __init__(self, messages=()):
+        # id -> Message for every indexed message
+        self.messages = {}
+        # word -> sorted ids; sender -> sorted ids; all ids, sorted
+        self.postings = {}
+        self.senders = {}
+        self.ids = []
+        for message in messages:
+            self.add(message)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, message):
+        message_id = message.id
+        self.messages[message_id] = message
+        insert_id(self.ids, message_id)
+        insert_id(self.senders.setdefault(message.sender, []), message_id)
+        for word in words(message.content):
+            insert_id(self.postings.setdefault(word, []), message_id)
+
+    def remove(self, message_id):
+        message = self.messages.pop(message_id, None)
+        if message is None:
+            return
+        remove_id(self.ids, message_id)
+        self.discard(self.senders, message.sender, message_id)
+        for word in words(message.content):
+            self.discard(self.postings, word, message_id)
+
+    @staticmethod
+    def discard(lists, key, message_id):
+        ids = lists.get(key)
+        if ids is not None:
+            remove_id(ids, message_id)
+            if not ids:
+                del lists[key]
+
+    #messages holding every one of `query_words` (from `sender` if given, with since_ms <= timestamp <
+    #until_ms, 0 leaving an end open), newest first, below `before_id` if given; returns (messages,
+    #next_before_id) with 0 once nothing older matches
+    def search(self, query_words, sender="", since_ms=0, until_ms=0, before_id=0, page_size=0):
+        lists = [self.postings.get(word) for word in query_words]
+        if sender:
+            lists.append(self.senders.get(sender))
+        if None in lists:
+            return [], 0
+        lists.sort(key=len)
+        walked = lists[0] if lists else self.ids
+        checked = lists[1:]
+        end = bisect.bisect_left(walked, before_id) if before_id else len(walked)
+        found = []
+        for i in range(end - 1, -1, -1):
+            message_id = walked[i]
+            if not all(contains_id(ids, message_id) for ids in checked):
+                continue
+            message = self.messages[message_id]
+            if message.timestamp < since_ms or (until_ms and message.timestamp >= until_ms):
+                continue
+            if page_size and len(found) == page_size:
+                return found, found[-1].id
+            found.append(message)
+        return found, 0
@@ -0,0 +1,243 @@
+import bisect
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+
+# ---------------------------
+# Per-RPC metrics.
+# A server interceptor times every call and records it in a fixed-bucket
+# latency histogram per method (one bisect plus a few integer updates under an
+# uncontended lock, a couple of microseconds). Gauges (stored messages,
+# executor backlog, ...) are callables evaluated only when stats are read, so
+# they cost nothing on the request path.
+# Stats are served by the GetStats RPC and, optionally, as Prometheus text on
+# a local HTTP port.
+# ---------------------------
+
+# histogram upper bounds in seconds: 50us .. ~13s, doubling
+BUCKETS = [0.00005 * 2 ** i for i in range(19)]
+
+
+class MethodStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        # one slot per bucket plus overflow
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds, failed):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.buckets[i] += 1
+            if failed:
+                self.errors += 1
+
+    #upper bound of the bucket holding the p-th percentile, in seconds
+    def percentile(self, p):
+        with self.lock:
+            buckets = list(self.buckets)
+            count = self.count
+        if not count:
+            return 0.0
+        rank = p / 100.0 * count
+        seen = 0
+        for i, n in enumerate(buckets):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+        return BUCKETS[-1]
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.in_flight = 0
+        self.active_streams = 0
+        self.gauges = {}
+
+    def method(self, name):
+        stats = self.methods.get(name)
+        if stats is None:
+            with self.lock:
+                stats = self.methods.setdefault(name, MethodStats())
+        return stats
+
+    #register a gauge; `read` is called only when stats are collected
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def begin(self, streaming):
+        with self.lock:
+            self.in_flight += 1
+            if streaming:
+                self.active_streams += 1
+
+    def end(self, streaming):
+        with self.lock:
+            self.in_flight -= 1
+            if streaming:
+                self.active_streams -= 1
+
+    def read_gauges(self):
+        values = {"in_flight": self.in_flight, "active_streams": self.active_streams,
+                  "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+        for name, read in list(self.gauges.items()):
+            values[name] = read()
+        return values
+
+    #Prometheus text exposition format
+    def prometheus_text(self):
+        lines = [
+            "# TYPE chat_rpc_requests_total counter",
+            "# TYPE chat_rpc_errors_total counter",
+            "# TYPE chat_rpc_latency_seconds histogram",
+        ]
+        for name, stats in sorted(self.methods.items()):
+            with stats.lock:
+                count, errors, total, buckets = stats.count, stats.errors, stats.total, list(stats.buckets)
+            label = f'method="{name}"'
+            lines.append(f"chat_rpc_requests_total{{{label}}} {count}")
+            lines.append(f"chat_rpc_errors_total{{{label}}} {errors}")
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'chat_rpc_latency_seconds_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            lines.append(f'chat_rpc_latency_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"chat_rpc_latency_seconds_sum{{{label}}} {total}")
+            lines.append(f"chat_rpc_latency_seconds_count{{{label}}} {count}")
+        for name, value in self.read_gauges().items():
+            lines.append(f"# TYPE chat_{name} gauge")
+            lines.append(f"chat_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    #serve /metrics on 127.0.0.1:port from a daemon thread; returns the HTTP server (shutdown() to stop)
+    def start_http(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+
+#short method name from "/chat.ChatService/SendMessage"
+def method_name(full_method):
+    return full_method.rsplit("/", 1)[-1]
+
+
+#rebuild `handler` around wrapped behaviours, keeping its (de)serializers
+def rewrap(handler, unary_unary, unary_stream, stream_unary, stream_stream):
+    kwargs = {"request_deserializer": handler.request_deserializer, "response_serializer": handler.response_serializer}
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler(unary_unary(handler.unary_unary), **kwargs)
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(unary_stream(handler.unary_stream), **kwargs)
+    if handler.stream_unary:
+        return grpc.stream_unary_rpc_method_handler(stream_unary(handler.stream_unary), **kwargs)
+    return grpc.stream_stream_rpc_method_handler(stream_stream(handler.stream_stream), **kwargs)
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        metrics = self.metrics
+        stats = metrics.method(method_name(handler_call_details.method))
+
+        def unary(behavior):
+            def wrapper(request, context):
+                metrics.begin(False)
+                start = time.perf_counter()
+                failed = True
+                try:
+                    response = behavior(request, context)
+                    failed = False
+                    return response
+                finally:
+                    stats.observe(time.perf_counter() - start, failed)
+                    metrics.end(False)
+            return wrapper
+
+        # streaming responses are timed from the call until the stream ends
+        def streaming(behavior):
+            def wrapper(request, context):
+                metrics.begin(True)
+                start = time.perf_counter()
+                failed = True
+                try:
+                    yield from behavior(request, context)
+                    failed = False
+                finally:
+                    stats.observe(time.perf_counter() - start, failed)
+                    metrics.end(True)
+            return wrapper
+
+        return rewrap(handler, unary, streaming, unary, streaming)
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        metrics = self.metrics
+        stats = metrics.method(method_name(handler_call_details.method))
+
+        def unary(behavior):
+            async def wrapper(request, context):
+                metrics.begin(False)
+                start = time.perf_counter()
+                failed = True
+                try:
+                    response = await behavior(request, context)
+                    failed = False
+                    return response
+                finally:
+                    stats.observe(time.perf_counter() - start, failed)
+                    metrics.end(False)
+            return wrapper
+
+        def streaming(behavior):
+            async def wrapper(request, context):
+                metrics.begin(True)
+                start = time.perf_counter()
+                failed = True
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                    failed = False
+                finally:
+                    stats.observe(time.perf_counter() - start, failed)
+                    metrics.end(True)
+            return wrapper
+
+        return rewrap(handler, unary, streaming, unary, streaming)
@@ -0,0 +1,355 @@
+import bisect
+import hashlib
+import threading
+from itertools import chain
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from metrics import method_name
+
+# ---------------------------
+# Multi-process server mode.
+# A supervisor (server.py, server_mode "multiprocess") starts N worker
+# processes. Each worker owns the users whose name hashes to its partition and
+# keeps their accounts, inboxes, sessions and write-ahead log. All workers listen on
+# the public port together (SO_REUSEPORT, so the kernel spreads connections over them).
+# Each worker also listens on a private localhost port for traffic between workers.
+#
+# A call that reaches a worker not owning its user is forwarded unchanged to
+# the owner by RoutingInterceptor; the owner checks the session as usual.
+# A SendMessage to a user of another worker is checked against the sender on
+# the sender's worker and then stored through PartitionService.Deliver on the
+# recipient's worker. ListAccounts merges every worker's share of the page.
+# Calls to other workers reuse one channel per worker, never run while a lock is held
+# and always carry a deadline. Subscribe is not forwarded, since an open stream
+# would hold a thread on both workers: the client is sent to the owner's own
+# address instead (OWNER_HEADER, see chat_client.redirect_target).
+#
+# Cluster mode (server_mode "cluster") runs the same routing between separate
+# server.py nodes listed in config.json. Users are placed on a consistent-hash
+# ring with virtual nodes (HashRing). A joining node registers with every peer,
+# and each peer hands off only the users the new node now owns.
+# ---------------------------
+SECRET_HEADER = "x-partition-secret"
+# address of the client behind a forwarded call, believed only alongside the secret
+PEER_HEADER = "x-partition-peer"
+# where a redirected Subscribe should go: "host:port", or ":port" on the host the client already uses
+OWNER_HEADER = "x-owner-address"
+# request field naming the user that owns each ChatService call; other calls stay local
+ROUTE_FIELDS = {
+    "CreateAccount": "username",
+    "Login": "username",
+    "Logout": "username",
+    "ListAccounts": "username",
+    "SendMessage": "sender",
+    "SendMessageBatch": "sender",
+    "SendMessageStream": "sender",
+    "ReadNewMessages": "username",
+    "DeleteMessages": "username",
+    "DeleteAccount": "username",
+    "ListMessages": "username",
+    "SearchMessages": "username",
+    "ConversationHistory": "username",
+    "Subscribe": "username",
+}
+# metadata of a client call that is passed on when it is forwarded
+DROPPED_HEADERS = ("user-agent", SECRET_HEADER, PEER_HEADER)
+# calls without a deadline report an effectively infinite time_remaining()
+NO_DEADLINE_S = 10 ** 9
+# deadline of calls between workers, and of forwarded calls whose client set none
+INTERNAL_TIMEOUT_S = 30
+# the same for a forwarded client stream (SendMessageStream), which may run for a while
+STREAM_TIMEOUT_S = 300
+
+
+#independent of the CRC32 shard hash inside a worker, so a worker's users still spread over all of its shards
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def partition_of(username, count):
+    return key_hash(username) % count
+
+
+#consistent-hash ring; node indices are positions in `names`. Never mutated, with_node() returns a new ring
+class HashRing:
+    def __init__(self, names, virtual_nodes=128):
+        self.names = list(names)
+        self.virtual_nodes = virtual_nodes
+        points = sorted((key_hash(f"{name}#{v}"), index) for index, name in enumerate(self.names) for v in range(virtual_nodes))
+        self.points = [point for point, _ in points]
+        self.owners = [index for _, index in points]
+
+    #index of the node owning `key`: the first virtual node clockwise from its hash
+    def owner(self, key):
+        i = bisect.bisect_right(self.points, key_hash(key))
+        return self.owners[i % len(self.points)]
+
+    def with_node(self, name):
+        return HashRing(self.names + [name], self.virtual_nodes)
+
+
+#merge per-worker ListAccounts pages (each sorted like AccountIndex) into one page
+def merge_pages(pages, page_size):
+    names = sorted(chain.from_iterable(pages), key=lambda name: (name.lower(), name))
+    if page_size and len(names) >= page_size:
+        names = names[:page_size]
+        return names, names[-1]
+    return names, ""
+
+
+class Partitioning:
+    #`ring` selects cluster mode (consistent hashing); without it users are split by partition_of().
+    #message ids are spread over `id_step` residue classes (default: one per address).
+    #`client_addresses` are where clients reach each worker (OWNER_HEADER), by default `addresses`
+    def __init__(self, index, addresses, secret, ring=None, id_step=None, client_addresses=None):
+        self.index = index
+        self.addresses = list(addresses)
+        self.client_addresses = client_addresses
+        self.secret = secret
+        self.ring = ring
+        self.id_step = id_step or len(addresses)
+        self.lock = threading.Lock()
+        self.channels = {}
+        # users already handed off to a joining node, until the ring switches over
+        self.moved = {}
+        # a join in progress as (ring it switches to, joining node's index): creating an account it
+        # moves waits for the join to finish, and the join waits for creates already running here
+        self.joins = threading.Condition()
+        self.joining = None
+        self.creating = 0
+
+    @property
+    def count(self):
+        return len(self.addresses)
+
+    def owner(self, username):
+        if self.moved:
+            moved = self.moved.get(username)
+            if moved is not None:
+                return moved
+        if self.ring is not None:
+            return self.ring.owner(username)
+        return partition_of(username, self.count)
+
+    def is_local(self, username):
+        return self.owner(username) == self.index
+
+    def client_address(self, index):
+        return (self.client_addresses or self.addresses)[index]
+
+    #one long-lived channel per peer worker
+    def channel(self, index):
+        channel = self.channels.get(index)
+        if channel is None:
+            with self.lock:
+                channel = self.channels.get(index)
+                if channel is None:
+                    channel = grpc.insecure_channel(self.addresses[index])
+                    self.channels[index] = channel
+        return channel
+
+    def stub(self, index):
+        return chat_pb2_grpc.ChatServiceStub(self.channel(index))
+
+    def internal_stub(self, index):
+        return chat_pb2_grpc.PartitionServiceStub(self.channel(index))
+
+    def internal_metadata(self):
+        return ((SECRET_HEADER, self.secret),)
+
+    def is_internal_call(self, context):
+        return any(key == SECRET_HEADER and value == self.secret for key, value in context.invocation_metadata())
+
+    #the client's address ("ipv4:host:port"), looking through a call forwarded by another worker
+    def client_peer(self, context):
+        if self.is_internal_call(context):
+            for key, value in context.invocation_metadata():
+                if key == PEER_HEADER:
+                    return value
+        return context.peer()
+
+    #store messages from an already checked sender on worker `index`; one SendMessageResponse per item
+    def deliver_remote(self, index, from_user, items, timestamp_ms):
+        request = chat_pb2.DeliverRequest(sender=from_user, timestamp_ms=timestamp_ms, items=items)
+        try:
+            response = self.internal_stub(index).Deliver(request, metadata=self.internal_metadata(), wait_for_ready=True, timeout=INTERNAL_TIMEOUT_S)
+        except grpc.RpcError as e:
+            failed = chat_pb2.SendMessageResponse(message=f"Recipient's partition unavailable: {e.code().name}", success=False)
+            return [failed] * len(items)
+        return list(response.results)
+
+    #ListAccounts over every worker; `local_search` is this worker's AccountIndex.search
+    def search_all(self, pattern, page_size, page_token, local_search):
+        pages = [local_search(pattern, page_size, page_token)[0]]
+        request = chat_pb2.ListAccountsRequest(pattern=pattern, page_size=page_size, page_token=page_token)
+        calls = [self.internal_stub(i).SearchAccounts.future(request, metadata=self.internal_metadata(), wait_for_ready=True, timeout=INTERNAL_TIMEOUT_S)
+                 for i in range(self.count) if i != self.index]
+        for call in calls:
+            pages.append(call.result().accounts)
+        return merge_pages(pages, page_size)
+
+    #start a join: the new node gets an address index; returns (ring including it, its index)
+    #once no account is being created here, so the users listed for handoff next are all there are
+    def begin_join(self, name, address):
+        with self.joins:
+            with self.lock:
+                self.addresses.append(address)
+                self.joining = (self.ring.with_node(name), len(self.addresses) - 1)
+            self.joins.wait_for(lambda: self.creating == 0)
+            return self.joining
+
+    def finish_join(self, ring):
+        with self.joins:
+            self.ring = ring
+            self.moved = {}
+            self.joining = None
+            self.joins.notify_all()
+
+    #a failed handoff: users already sent stay routed to the new node through `moved`
+    def abort_join(self):
+        with self.joins:
+            self.joining = None
+            self.joins.notify_all()
+
+    #a joining node waits for its own join like this, so it creates no account a peer still holds
+    def begin_own_join(self):
+        with self.joins:
+            self.joining = (self.ring, self.index)
+
+    def is_moving(self, username):
+        return self.joining is not None and self.joining[0].owner(username) == self.joining[1]
+
+    #owner of a new account, once no join is moving it (None if that takes over `timeout` seconds).
+    #a local create must be followed by end_create()
+    def begin_create(self, username, timeout):
+        with self.joins:
+            if not self.joins.wait_for(lambda: not self.is_moving(username), timeout):
+                return None
+            owner = self.owner(username)
+            if owner == self.index:
+                self.creating += 1
+            return owner
+
+    def end_create(self):
+        with self.joins:
+            self.creating -= 1
+            self.joins.notify_all()
+
+    def close(self):
+        with self.lock:
+            for channel in self.channels.values():
+                channel.close()
+            self.channels.clear()
+
+
+#metadata of the incoming call to pass along with a forwarded one (carries the session token, and the
+#client's address for the owner's rate limits)
+def forwarded_metadata(context, partitions):
+    return tuple((key, value) for key, value in context.invocation_metadata()
+                 if key not in DROPPED_HEADERS and not key.startswith("grpc-")) + \
+        partitions.internal_metadata() + ((PEER_HEADER, partitions.client_peer(context)),)
+
+
+#deadline left on the incoming call, passed on to the forwarded one; `default` if the client set none
+def forward_timeout(context, default=INTERNAL_TIMEOUT_S):
+    remaining = context.time_remaining()
+    return default if remaining is None or remaining > NO_DEADLINE_S else remaining
+
+
+class RoutingInterceptor(grpc.ServerInterceptor):
+    def __init__(self, partitions):
+        self.partitions = partitions
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        full_method = handler_call_details.method
+        if handler is None or not full_method.startswith("/chat.ChatService/"):
+            return handler
+        name = method_name(full_method)
+        field = ROUTE_FIELDS.get(name)
+        if field is None:
+            return handler
+        partitions = self.partitions
+
+        #owning worker of a request, or None when this worker handles it
+        def remote_owner(request):
+            key = getattr(request, field)
+            if not key:
+                return None
+            owner = partitions.owner(key)
+            return None if owner == partitions.index else owner
+
+        # the owner's status, details and trailers (e.g. a rate limit's retry-after-ms) go back as they were
+        def forward_error(context, error):
+            context.set_trailing_metadata(error.trailing_metadata() or ())
+            context.abort(error.code(), error.details() or "")
+
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            def forward(owner, request, context):
+                try:
+                    return getattr(partitions.stub(owner), name)(
+                        request, metadata=forwarded_metadata(context, partitions), timeout=forward_timeout(context), wait_for_ready=True)
+                except grpc.RpcError as e:
+                    forward_error(context, e)
+
+            def unary_unary(request, context):
+                owner = remote_owner(request)
+                if owner is None:
+                    return behavior(request, context)
+                return forward(owner, request, context)
+
+            # in a cluster, a new account goes to the owner its name has once any running join is over
+            def create_account(request, context):
+                owner = partitions.begin_create(request.username, forward_timeout(context))
+                if owner is None:
+                    context.abort(grpc.StatusCode.UNAVAILABLE, "A node is joining the cluster, try again")
+                if owner != partitions.index:
+                    return forward(owner, request, context)
+                try:
+                    return behavior(request, context)
+                finally:
+                    partitions.end_create()
+            if name == "CreateAccount" and partitions.ring is not None:
+                unary_unary = create_account
+            return grpc.unary_unary_rpc_method_handler(
+                unary_unary, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            # a stream is redirected rather than forwarded
+            def unary_stream(request, context):
+                owner = remote_owner(request)
+                if owner is not None:
+                    address = partitions.client_address(owner)
+                    context.set_trailing_metadata(((OWNER_HEADER, address),))
+                    context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"User is served at {address}")
+                return behavior(request, context)
+            return grpc.unary_stream_rpc_method_handler(
+                unary_stream, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+
+        if handler.stream_unary:
+            behavior = handler.stream_unary
+
+            # a client stream goes wherever its first message's user lives
+            def stream_unary(request_iterator, context):
+                first = next(request_iterator, None)
+                requests = chain(() if first is None else (first,), request_iterator)
+                owner = None if first is None else remote_owner(first)
+                if owner is None:
+                    return behavior(requests, context)
+                try:
+                    return getattr(partitions.stub(owner), name)(
+                        requests, metadata=forwarded_metadata(context, partitions), timeout=forward_timeout(context, STREAM_TIMEOUT_S),
+                        wait_for_ready=True)
+                except grpc.RpcError as e:
+                    forward_error(context, e)
+            return grpc.stream_unary_rpc_method_handler(
+                stream_unary, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+
+        return handler
@@ -0,0 +1,411 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from itertools import chain
+from contextlib import contextmanager
+
+from inbox import Inbox, Message
+from groups import GroupStore, DEFAULT_MAX_HISTORY, not_logged
+
+# ---------------------------
+# Durability for users_db.
+# Every mutating RPC appends one compact JSON record to a write-ahead log
+# (data_dir/wal.<segment>.log). A background flusher writes pending records in
+# groups (group commit) and fsyncs them according to the policy:
+#   "always" - commit() waits until the record is on disk
+#   "batch"  - records are fsynced every fsync_interval_ms, commit() returns at once
+#   "off"    - records are handed to the OS every fsync_interval_ms, never fsynced
+# A background compactor periodically rotates the log, folds the closed
+# segments into data_dir/snapshot.json and deletes them. Compaction replays the
+# previous snapshot plus the closed segments into a private copy, so it never
+# needs to lock the live users_db.
+# Group channels (see groups.py) are logged and snapshotted the same way,
+# next to the users.
+# With replication (see replication.py) every batch written is also handed to
+# `feed`, in log order, and catch_up() gives a new follower the whole state as
+# log records read from the snapshot and segments on disk. It hard-links those
+# files into a private directory under the compaction lock and streams them
+# after releasing it, so a slow follower never holds up compaction.
+# ---------------------------
+FSYNC_POLICIES = ("always", "batch", "off")
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_PATTERN = re.compile(r"^wal\.(\d+)\.log$")
+# private directories of catch_up(), inside data_dir
+CATCH_UP_PREFIX = "catch-up-"
+
+
+def new_user(password):
+    return {"password": password, "inbox": Inbox()}
+
+
+#plain JSON-able form of one user, as kept in snapshots and handed between cluster nodes
+def dump_user(user):
+    inbox = user["inbox"]
+    return {"password": user["password"],
+            "read": [m.to_dict() for m in inbox.read_messages()],
+            "unread": [m.to_dict() for m in inbox.unread_messages()],
+            "sent": [dict(m.to_dict(), to=to_user) for to_user, m in inbox.sent.values()]}
+
+
+def load_user(data):
+    user = new_user(data["password"])
+    inbox = user["inbox"]
+    for m in data["read"]:
+        inbox.append(Message.from_dict(m))
+    inbox.take_unread(0)
+    for m in data["unread"]:
+        inbox.append(Message.from_dict(m))
+    # absent from snapshots taken before sent copies were kept
+    for m in data.get("sent", ()):
+        inbox.add_sent(m["to"], Message.from_dict(m))
+    return user
+
+
+#highest message id in a dumped user, 0 if it has none
+def last_id_of(data):
+    return max((m["id"] for m in chain(data["read"], data["unread"], data.get("sent", ()))), default=0)
+
+
+#give the sender of a logged "send" their copy (see Inbox.sent), under their inbox lock; a message
+#to oneself is kept once, and a sender who is not here (another worker's user, or gone) gets none
+def keep_sent(db, record, message):
+    if record["from"] == record["to"]:
+        return
+    sender = db.get(record["from"])
+    if sender is None:
+        return
+    inbox = sender["inbox"]
+    with inbox.changed:
+        if not inbox.closed:
+            inbox.add_sent(record["to"], message)
+
+
+#apply one log record to a users dict (and the GroupStore), mirroring what the RPC handler did
+def apply_record(db, record, groups):
+    op = record["op"]
+    if op.startswith("group_"):
+        apply_group_record(groups, record)
+        return
+    if op == "create":
+        db[record["user"]] = new_user(record["password"])
+        return
+    if op == "restore":
+        # a whole user received from another cluster node
+        db[record["user"]] = load_user(record)
+        return
+    user = db.get(record.get("user") or record.get("to"))
+    if user is None:
+        return
+    inbox = user["inbox"]
+    if op == "send":
+        message = Message.from_dict(record)
+        inbox.append(message)
+        keep_sent(db, record, message)
+    elif op == "sent":
+        # the sender's copy of a message another worker delivered
+        inbox.add_sent(record["to"], Message(record["id"], record["user"], record["content"], record["timestamp"]))
+    elif op == "read":
+        inbox.take_unread(record["count"])
+    elif op == "delete" or op == "evict":
+        # "evict": removed by the retention sweeper (see retention.py)
+        inbox.delete_ids(record["ids"])
+    elif op == "evict_sent":
+        inbox.delete_sent(record["ids"])
+    elif op == "delete_all":
+        inbox.clear()
+    elif op == "drop":
+        del db[record["user"]]
+        groups.forget_user(record["user"])
+
+
+def apply_group_record(groups, record):
+    op = record["op"]
+    if op == "group_create":
+        groups.create(record["group"], record["user"], not_logged)
+    elif op == "group_join":
+        groups.join(record["group"], record["user"], not_logged)
+    elif op == "group_send":
+        groups.append(record["group"], record["from"], record["content"], record["timestamp"], lambda: record["id"], not_logged)
+    elif op == "group_read":
+        groups.set_cursors(record["user"], record["cursors"])
+    elif op == "group_restore":
+        # a whole group, from a snapshot sent to a follower
+        groups.load({record["group"]: record})
+
+
+#snapshot form of a users dict: plain JSON-able data
+def dump_users(db):
+    return {username: dump_user(user) for username, user in db.items()}
+
+
+def load_users(data, db):
+    for username, user in data.items():
+        db[username] = load_user(user)
+
+
+#a second name for `source` at `target` (a copy where hard links are not supported), if it exists.
+#a linked file outlives compaction deleting or replacing the original
+def keep(source, target):
+    try:
+        os.link(source, target)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class WriteAheadLog:
+    #`group_history` is the live GroupStore's max_history, so compaction trims groups the same way
+    def __init__(self, data_dir, fsync="batch", fsync_interval_ms=10, snapshot_interval_s=60, group_history=DEFAULT_MAX_HISTORY):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, got '{fsync}'")
+        self.data_dir = data_dir
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.snapshot_interval = snapshot_interval_s
+        self.group_history = group_history
+        os.makedirs(data_dir, exist_ok=True)
+
+        # `lock` guards the pending buffer and sequence numbers; `io_lock` serialises
+        # writes to the current segment file against rotation; `compact_lock` keeps
+        # segments in place while a follower catches up from them
+        self.lock = threading.Condition()
+        self.io_lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.pending = []
+        self.appended_seq = 0
+        self.durable_seq = 0
+        self.records_since_snapshot = 0
+        self.stopping = False
+        self.segment = 0
+        self.file = None
+        # highest message id seen in the snapshot or log, so ids are never reused after a restart
+        self.last_message_id = 0
+        self.threads = []
+        # a replication.ReplicationFeed on a primary, given every batch once written
+        self.feed = None
+
+    def segment_path(self, segment, directory=None):
+        return os.path.join(directory or self.data_dir, f"wal.{segment:08d}.log")
+
+    def segments(self):
+        found = []
+        for name in os.listdir(self.data_dir):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    #load the snapshot into db and groups, returns (last segment it covers, last message id)
+    def load_snapshot(self, db, groups):
+        path = os.path.join(self.data_dir, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+        load_users(snapshot["users"], db)
+        groups.load(snapshot.get("groups", {}))
+        return snapshot["segment"], snapshot["last_message_id"]
+
+    #replay one segment into db; a torn final line from a crash is ignored.
+    #returns (records applied, highest message id sent in the segment)
+    def replay_segment(self, segment, db, groups):
+        applied = 0
+        last_message_id = 0
+        with open(self.segment_path(segment), "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    logging.warning("Ignoring torn record at end of %s", self.segment_path(segment))
+                    break
+                record = json.loads(line)
+                apply_record(db, record, groups)
+                if record["op"] in ("send", "sent", "group_send"):
+                    last_message_id = max(last_message_id, record["id"])
+                elif record["op"] == "restore":
+                    last_message_id = max(last_message_id, last_id_of(record))
+                applied += 1
+        return applied, last_message_id
+
+    #rebuild db (and `groups`, a GroupStore) from the latest snapshot plus the log tail, then open a fresh segment
+    def recover(self, db, groups=None):
+        if groups is None:
+            groups = GroupStore(self.group_history)
+        # files of a catch-up a crash interrupted
+        for name in os.listdir(self.data_dir):
+            if name.startswith(CATCH_UP_PREFIX):
+                shutil.rmtree(os.path.join(self.data_dir, name), ignore_errors=True)
+        covered, self.last_message_id = self.load_snapshot(db, groups)
+        replayed = 0
+        segments = self.segments()
+        for segment in segments:
+            if segment > covered:
+                applied, last_message_id = self.replay_segment(segment, db, groups)
+                replayed += applied
+                self.last_message_id = max(self.last_message_id, last_message_id)
+        self.records_since_snapshot = replayed
+        self.segment = max([covered] + segments) + 1
+        self.file = open(self.segment_path(self.segment), "a")
+        logging.info("Recovered %d users from snapshot (segment %d) and %d log records", len(db), covered, replayed)
+
+    def start(self):
+        for target in (self.flush_loop, self.compact_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    #buffer a record and return its sequence number; cheap enough to call under an inbox lock
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.pending.append(line)
+            self.appended_seq += 1
+            self.records_since_snapshot += 1
+            if self.fsync == "always":
+                self.lock.notify_all()
+            return self.appended_seq
+
+    #whether commit(seq) would return immediately
+    def is_committed(self, seq):
+        return self.fsync != "always" or self.durable_seq >= seq or self.stopping
+
+    #block until `seq` is durable when the policy requires it
+    def commit(self, seq):
+        if self.fsync != "always":
+            return
+        with self.lock:
+            while self.durable_seq < seq and not self.stopping:
+                self.lock.wait()
+
+    #write everything pending to the current segment (caller holds io_lock)
+    def write_pending(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+            seq = self.appended_seq
+        if batch:
+            self.file.write("".join(batch))
+            self.file.flush()
+            if self.fsync != "off":
+                os.fsync(self.file.fileno())
+            if self.feed is not None:
+                self.feed.publish(seq - len(batch) + 1, batch)
+        with self.lock:
+            self.durable_seq = seq
+            self.lock.notify_all()
+
+    def flush_loop(self):
+        while True:
+            with self.lock:
+                if self.fsync == "always":
+                    while not self.pending and not self.stopping:
+                        self.lock.wait()
+                elif not self.stopping:
+                    self.lock.wait(timeout=self.fsync_interval)
+                stopping = self.stopping
+            with self.io_lock:
+                self.write_pending()
+            if stopping:
+                return
+
+    def compact_loop(self):
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.stopping, timeout=self.snapshot_interval)
+                if self.stopping:
+                    return
+            try:
+                self.compact()
+            except OSError:
+                logging.exception("Log compaction failed")
+
+    #close the current segment and fold every closed segment into a new snapshot
+    def compact(self):
+        with self.compact_lock:
+            self.compact_segments()
+
+    def compact_segments(self):
+        with self.lock:
+            if not self.records_since_snapshot:
+                return
+            self.records_since_snapshot = 0
+        with self.io_lock:
+            self.write_pending()
+            self.file.close()
+            closed = self.segment
+            self.segment += 1
+            self.file = open(self.segment_path(self.segment), "a")
+
+        started = time.perf_counter()
+        db = {}
+        groups = GroupStore(self.group_history)
+        covered, last_message_id = self.load_snapshot(db, groups)
+        folded = [s for s in self.segments() if covered < s <= closed]
+        for segment in folded:
+            last_message_id = max(last_message_id, self.replay_segment(segment, db, groups)[1])
+        tmp_path = os.path.join(self.data_dir, SNAPSHOT_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": closed, "last_message_id": last_message_id, "users": dump_users(db), "groups": groups.dump()},
+                      f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.data_dir, SNAPSHOT_FILE))
+        for segment in folded:
+            os.remove(self.segment_path(segment))
+        logging.info("Snapshot written through segment %d (%d segments folded) in %.1f ms",
+                     closed, len(folded), (time.perf_counter() - started) * 1000)
+
+    #the whole state for a follower: yields (seq, lines), the log lines (without newlines) that rebuild
+    #it from nothing, and the seq of the last record they include. The files are linked aside under
+    #the compaction lock, which is released before the block runs
+    @contextmanager
+    def catch_up(self):
+        directory = tempfile.mkdtemp(prefix=CATCH_UP_PREFIX, dir=self.data_dir)
+        try:
+            with self.compact_lock:
+                with self.io_lock:
+                    self.write_pending()
+                    seq = self.durable_seq
+                    sizes = {segment: os.path.getsize(self.segment_path(segment)) for segment in self.segments()}
+                keep(os.path.join(self.data_dir, SNAPSHOT_FILE), os.path.join(directory, SNAPSHOT_FILE))
+                for segment in sizes:
+                    keep(self.segment_path(segment), self.segment_path(segment, directory))
+            yield seq, self.state_lines(sizes, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    #snapshot as "restore" and "group_restore" records, then the segments after it up to `sizes`,
+    #read from `directory` (the data directory by default)
+    def state_lines(self, sizes, directory=None):
+        covered = 0
+        path = os.path.join(directory or self.data_dir, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                snapshot = json.load(f)
+            covered = snapshot["segment"]
+            for username, data in snapshot["users"].items():
+                yield json.dumps(dict(data, op="restore", user=username), separators=(",", ":"))
+            for name, data in snapshot.get("groups", {}).items():
+                yield json.dumps(dict(data, op="group_restore", group=name), separators=(",", ":"))
+        for segment, size in sorted(sizes.items()):
+            if segment <= covered:
+                continue
+            with open(self.segment_path(segment, directory), "rb") as f:
+                lines = f.read(size).split(b"\n")
+            # the last piece is empty, or a torn record left by a crash in an earlier run
+            for line in lines[:-1]:
+                yield line.decode()
+
+    #flush what is left and stop the background threads
+    def close(self):
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join()
+        with self.io_lock:
+            self.write_pending()
+            self.file.close()
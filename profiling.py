@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import logging
+import marshal
+import datetime
+import threading
+from collections import Counter
+
+# ---------------------------
+# On-demand sampling profiler for the RPC handlers of a running server.
+# Nothing is installed on the request path: while no window is open the
+# profiler costs nothing at all. Opening a window (SIGUSR1, see server.py)
+# starts a daemon thread that wakes every `interval_ms`, reads every thread's
+# stack with sys._current_frames() and keeps the stacks that are inside a
+# handler. The handler's own frame tags the sample with its gRPC method, so no
+# per-call bookkeeping is needed; in asyncio mode the event loop thread is
+# sampled the same way, its running coroutine chain naming the method.
+# A window closes after `duration_s` or on SIGUSR2, and the samples are written
+# under logs/ twice: as collapsed stacks ("Method;file:function;... count", one
+# line per distinct stack, for flame graph tools) and as a pstats file
+# (python -m pstats <file>) whose times are sample counts times the interval.
+# ---------------------------
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_DURATION_S = 30
+MAX_DURATION_S = 600
+
+
+#code object -> gRPC method name for every RPC handler defined on the servicer classes
+def handler_codes(method_names, *classes):
+    codes = {}
+    for cls in classes:
+        for name in method_names:
+            handler = cls.__dict__.get(name)
+            if handler is not None:
+                codes[handler.__code__] = name
+    return codes
+
+
+#the frame's code objects from the outermost handler frame down to the running one, and that
+#handler's method; (None, ()) when the thread is not inside a handler
+def handler_stack(frame, handlers):
+    codes = []
+    method = None
+    depth = 0
+    while frame is not None:
+        code = frame.f_code
+        codes.append(code)
+        if code in handlers:
+            method = handlers[code]
+            depth = len(codes)
+        frame = frame.f_back
+    if method is None:
+        return None, ()
+    return method, tuple(reversed(codes[:depth]))
+
+
+#pstats key of a code object
+def function_key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def function_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Profiler:
+    def __init__(self, handlers, log_dir="logs", name="profile", interval_ms=DEFAULT_INTERVAL_MS,
+                 duration_s=DEFAULT_DURATION_S):
+        self.handlers = handlers
+        self.log_dir = log_dir
+        self.name = name
+        self.interval_s = interval_ms / 1000.0
+        self.duration_s = duration_s
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        # (method, stack of code objects) -> samples; only touched by the sampling thread
+        self.samples = Counter()
+        # paths written by the last window
+        self.written = []
+
+    @property
+    def running(self):
+        thread = self.thread
+        return thread is not None and thread.is_alive()
+
+    #open a window of `duration_s` seconds (the configured one by default, at most MAX_DURATION_S);
+    #False if one is already open. Safe to call from a signal handler
+    def start(self, duration_s=None):
+        with self.lock:
+            if self.running:
+                return False
+            duration_s = min(duration_s or self.duration_s, MAX_DURATION_S)
+            self.stopping.clear()
+            self.samples = Counter()
+            self.thread = threading.Thread(target=self.run, args=(duration_s,), name="profiler", daemon=True)
+            self.thread.start()
+        logging.info("Profiling RPC handlers for up to %ss", duration_s)
+        return True
+
+    #close the window early; with wait, return once the output is written
+    def stop(self, wait=True):
+        self.stopping.set()
+        thread = self.thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def run(self, duration_s):
+        deadline = time.monotonic() + duration_s
+        while not self.stopping.wait(self.interval_s) and time.monotonic() < deadline:
+            self.sample()
+        self.write()
+
+    #one pass over every other thread's stack
+    def sample(self):
+        me = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            method, stack = handler_stack(frame, self.handlers)
+            if method is not None:
+                self.samples[method, stack] += 1
+
+    def collapsed(self):
+        lines = Counter()
+        for (method, stack), count in self.samples.items():
+            lines[";".join([method] + [function_label(code) for code in stack])] += count
+        return [f"{line} {count}" for line, count in sorted(lines.items())]
+
+    #the samples as a pstats table: {function: (primitive calls, calls, own time, total time, callers)}.
+    #A "call" is a sample the function was on the stack for; each method is a root caller of its handler
+    def pstats_table(self):
+        table = {}
+
+        def entry(key):
+            if key not in table:
+                table[key] = [0, 0, 0.0, 0.0, {}]
+            return table[key]
+
+        for (method, stack), count in self.samples.items():
+            seconds = count * self.interval_s
+            keys = [("<rpc>", 0, method)] + [function_key(code) for code in stack]
+            for caller, callee in zip(keys, keys[1:]):
+                callers = entry(callee)[4]
+                callers[caller] = callers.get(caller, 0) + count
+            for key in set(keys):
+                stats = entry(key)
+                stats[0] += count
+                stats[1] += count
+                stats[3] += seconds
+            entry(keys[-1])[2] += seconds
+        return {key: tuple(stats) for key, stats in table.items()}
+
+    def write(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        base = os.path.join(self.log_dir, f"{self.name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        written = [base + ".collapsed"]
+        with open(written[0], "w") as f:
+            f.writelines(line + "\n" for line in self.collapsed())
+        if self.samples:
+            written.append(base + ".pstats")
+            with open(written[1], "wb") as f:
+                marshal.dump(self.pstats_table(), f)
+        self.written = written
+        logging.info("Profile of %s samples written to %s", sum(self.samples.values()), ", ".join(written))
@@ -0,0 +1,247 @@
+import time
+import threading
+from collections import OrderedDict
+
+import grpc
+
+from auth import token_from_metadata
+from metrics import method_name, rewrap
+
+# ---------------------------
+# Admission control.
+# Two checks run before a ChatService handler, and both fail fast with
+# RESOURCE_EXHAUSTED rather than queueing the call:
+#   - a token bucket per (caller, method) for every method given a limit in
+#     config.json ("rate_limits": {"methods": {name: {"rate", "burst"}}}).
+#     The caller is the session's user, or the peer's address for calls
+#     without a session (CreateAccount, Login)
+#   - a cap on calls running at once over the whole process
+#     ("max_concurrent"). Server-streaming calls (Subscribe) are long-lived
+#     and not counted; the thread-pool server caps them on their own
+#     ("max_streams"), since each open stream holds a worker thread
+# A rejection carries a hint in the "retry-after-ms" trailing metadata and in
+# its details. Each check is one dictionary lookup and a few arithmetic steps
+# under one lock. The bucket table is an LRU capped at "max_buckets"; a caller
+# whose bucket was dropped starts again with a full burst.
+# ---------------------------
+RETRY_AFTER_HEADER = "retry-after-ms"
+# hint for calls turned away by the concurrency cap, which frees up as soon as any call ends
+BUSY_RETRY_AFTER_MS = 50
+DEFAULT_MAX_BUCKETS = 100000
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    #`methods` maps method names to {"rate": tokens per second, "burst": bucket size}
+    def __init__(self, methods=None, max_buckets=DEFAULT_MAX_BUCKETS, max_concurrent=0, max_streams=0):
+        self.limits = {}
+        for name, limit in (methods or {}).items():
+            rate = float(limit.get("rate", 0))
+            if rate > 0:
+                self.limits[name] = (rate, max(1.0, float(limit.get("burst", rate))))
+        self.max_buckets = max_buckets
+        self.max_concurrent = max_concurrent
+        self.max_streams = max_streams
+        self.lock = threading.Lock()
+        # (caller, method) -> TokenBucket, least recently used first
+        self.buckets = OrderedDict()
+        self.running = 0
+        self.streams = 0
+        self.rate_limited = 0
+        self.over_capacity = 0
+
+    @property
+    def enabled(self):
+        return bool(self.limits or self.max_concurrent or self.max_streams)
+
+    #take a token for one call; returns 0 if allowed, else milliseconds until a token is due
+    def acquire(self, caller, method, now=None):
+        limit = self.limits.get(method)
+        if limit is None:
+            return 0
+        rate, burst = limit
+        if now is None:
+            now = time.monotonic()
+        key = (caller, method)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    self.buckets.popitem(last=False)
+                bucket = self.buckets[key] = TokenBucket(burst, now)
+            else:
+                self.buckets.move_to_end(key)
+                bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            self.rate_limited += 1
+            return max(1, int((1 - bucket.tokens) / rate * 1000 + 0.999))
+
+    #count a call in; False when the process is already at its cap
+    def enter(self):
+        with self.lock:
+            if self.max_concurrent and self.running >= self.max_concurrent:
+                self.over_capacity += 1
+                return False
+            self.running += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.running -= 1
+
+    #count a server stream in; False when max_streams are already open
+    def enter_stream(self):
+        with self.lock:
+            if self.max_streams and self.streams >= self.max_streams:
+                self.over_capacity += 1
+                return False
+            self.streams += 1
+            return True
+
+    def leave_stream(self):
+        with self.lock:
+            self.streams -= 1
+
+
+#who a call is charged to: the session's user, else the client's host. With `partitions` (multi-process
+#mode) a call forwarded by another worker is charged to the client that made it, not to that worker
+def caller_of(sessions, partitions, handler_call_details, context):
+    username = sessions.lookup(token_from_metadata(handler_call_details.invocation_metadata))
+    if username is not None:
+        return username
+    peer = context.peer() if partitions is None else partitions.client_peer(context)
+    # "ipv4:1.2.3.4:5678" / "ipv6:[::1]:5678": drop the port, so new connections share the bucket
+    return "peer:" + peer.rpartition(":")[0]
+
+
+def rejection(retry_after_ms, reason):
+    return ((RETRY_AFTER_HEADER, str(retry_after_ms)),), f"{reason}, retry after {retry_after_ms} ms"
+
+
+class RateLimitInterceptor(grpc.ServerInterceptor):
+    def __init__(self, limiter, sessions, partitions=None):
+        self.limiter = limiter
+        self.sessions = sessions
+        self.partitions = partitions
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not handler_call_details.method.startswith("/chat.ChatService/"):
+            return handler
+        limiter = self.limiter
+        sessions = self.sessions
+        partitions = self.partitions
+        name = method_name(handler_call_details.method)
+        limited = name in limiter.limits
+        if not limited and not limiter.max_concurrent and not limiter.max_streams:
+            return handler
+
+        def reject(context, retry_after_ms, reason):
+            trailing, details = rejection(retry_after_ms, reason)
+            context.set_trailing_metadata(trailing)
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, details)
+
+        def admit(context):
+            if not limited:
+                return
+            retry_after_ms = limiter.acquire(caller_of(sessions, partitions, handler_call_details, context), name)
+            if retry_after_ms:
+                reject(context, retry_after_ms, f"Rate limit for {name} exceeded")
+
+        def counted(behavior):
+            def wrapper(request, context):
+                admit(context)
+                if not limiter.enter():
+                    reject(context, BUSY_RETRY_AFTER_MS, "Server busy")
+                try:
+                    return behavior(request, context)
+                finally:
+                    limiter.leave()
+            return wrapper
+
+        # each open stream holds a worker until the client goes away
+        def unary_stream(behavior):
+            def wrapper(request, context):
+                admit(context)
+                if not limiter.enter_stream():
+                    reject(context, BUSY_RETRY_AFTER_MS, "Too many open streams")
+                try:
+                    yield from behavior(request, context)
+                finally:
+                    limiter.leave_stream()
+            return wrapper
+
+        def streaming(behavior):
+            def wrapper(request, context):
+                admit(context)
+                return behavior(request, context)
+            return wrapper
+
+        return rewrap(handler, counted, unary_stream, counted, streaming)
+
+
+class AsyncRateLimitInterceptor(grpc.aio.ServerInterceptor):
+    def __init__(self, limiter, sessions, partitions=None):
+        self.limiter = limiter
+        self.sessions = sessions
+        self.partitions = partitions
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or not handler_call_details.method.startswith("/chat.ChatService/"):
+            return handler
+        limiter = self.limiter
+        sessions = self.sessions
+        partitions = self.partitions
+        name = method_name(handler_call_details.method)
+        limited = name in limiter.limits
+        if not limited and not limiter.max_concurrent:
+            return handler
+
+        async def reject(context, retry_after_ms, reason):
+            trailing, details = rejection(retry_after_ms, reason)
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, details, trailing_metadata=trailing)
+
+        async def admit(context):
+            if not limited:
+                return
+            retry_after_ms = limiter.acquire(caller_of(sessions, partitions, handler_call_details, context), name)
+            if retry_after_ms:
+                await reject(context, retry_after_ms, f"Rate limit for {name} exceeded")
+
+        def counted(behavior):
+            async def wrapper(request, context):
+                await admit(context)
+                if not limiter.enter():
+                    await reject(context, BUSY_RETRY_AFTER_MS, "Server busy")
+                try:
+                    return await behavior(request, context)
+                finally:
+                    limiter.leave()
+            return wrapper
+
+        def unary_stream(behavior):
+            async def wrapper(request, context):
+                await admit(context)
+                async for response in behavior(request, context):
+                    yield response
+            return wrapper
+
+        def stream_stream(behavior):
+            async def wrapper(request_iterator, context):
+                await admit(context)
+                async for response in behavior(request_iterator, context):
+                    yield response
+            return wrapper
+
+        return rewrap(handler, counted, unary_stream, counted, stream_stream)
@@ -0,0 +1,311 @@
+import json
+import time
+import logging
+import secrets
+import threading
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from metrics import method_name, rewrap
+from persistence import apply_record, keep_sent
+from inbox import Message
+
+# ---------------------------
+# Primary-follower replication.
+# The primary's write-ahead log is the replication stream: every batch the
+# flusher writes is also published to a ReplicationFeed, which keeps the newest
+# `backlog` records of this run numbered by their log sequence number. A
+# follower opens ReplicationService.Follow and is sent the records after the
+# position it reports, in log order, with an empty batch as a heartbeat when
+# the primary is idle. A follower that is new, was following an earlier run
+# of the primary (another epoch), or fell further behind than the backlog
+# catches up first: the primary sends the snapshot and the log segments on disk
+# as records (WriteAheadLog.catch_up), and the follower drops its state and
+# applies them before the live records.
+# A follower applies each record under the same shard and inbox locks the
+# primary's handlers take, and serves only the read-only RPCs. A read is
+# refused with UNAVAILABLE while the follower is catching up or, with
+# `max_staleness_ms`, when it last matched the primary longer ago than that,
+# so a client can go to the primary or another follower instead.
+# ---------------------------
+SECRET_HEADER = "x-replication-secret"
+DEFAULT_BACKLOG = 100000
+DEFAULT_HEARTBEAT_MS = 500
+# records per batch, and roughly the bytes, so a batch stays well under the message size limit
+BATCH_RECORDS = 1000
+BATCH_BYTES = 1 << 20
+# catch-ups one Follow stream may need before it is given up on as unable to keep up
+MAX_CATCH_UPS = 3
+# a single record (a whole user in a catch-up) can be large
+CHANNEL_OPTIONS = [("grpc.max_receive_message_length", 256 * 1024 * 1024)]
+# what a follower serves; every other ChatService method changes state and belongs on the primary
+READ_METHODS = frozenset({"Login", "Logout", "ListAccounts", "ListMessages", "SearchMessages", "ConversationHistory",
+                          "GetStats"})
+# served however far behind the follower is
+ALWAYS_SERVED = frozenset({"Logout", "GetStats"})
+
+
+#the primary's log records of this run, the newest `backlog` of them, for the Follow streams
+class ReplicationFeed:
+    def __init__(self, backlog=DEFAULT_BACKLOG):
+        self.backlog = backlog
+        # a fresh epoch per run: sequence numbers start again at 1 when the primary restarts
+        self.epoch = secrets.token_hex(8)
+        self.changed = threading.Condition()
+        # records[i] has seq first_seq + i
+        self.records = []
+        self.first_seq = 1
+        self.last_seq = 0
+        # stream -> seq last sent to it, for the lag gauge
+        self.followers = {}
+
+    #records just written to the log, starting at `first_seq` (called by the WAL under its io_lock)
+    def publish(self, first_seq, lines):
+        with self.changed:
+            self.records.extend(line[:-1] for line in lines)
+            self.last_seq = first_seq + len(lines) - 1
+            if len(self.records) > self.backlog:
+                # a tenth at a time, so trimming costs O(1) per record on average
+                cut = len(self.records) - self.backlog + self.backlog // 10
+                del self.records[:cut]
+            self.first_seq = self.last_seq - len(self.records) + 1
+            self.changed.notify_all()
+
+    #whether the records after `seq` can still be sent
+    def holds(self, seq):
+        with self.changed:
+            return self.first_seq - 1 <= seq <= self.last_seq
+
+    #up to `limit` records after `seq`, waiting up to `timeout` for one; returns (records, last seq),
+    #records None once they have been trimmed
+    def after(self, seq, limit, timeout):
+        with self.changed:
+            if seq == self.last_seq:
+                self.changed.wait(timeout)
+            if seq < self.first_seq - 1:
+                return None, self.last_seq
+            start = seq + 1 - self.first_seq
+            return self.records[start:start + limit], self.last_seq
+
+    #the most records any follower stream is behind
+    def max_lag(self):
+        with self.changed:
+            return max((self.last_seq - seq for seq in self.followers.values()), default=0)
+
+
+#consecutive records grouped into batches of at most BATCH_RECORDS records / about BATCH_BYTES
+def batched(lines):
+    batch = []
+    size = 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if len(batch) == BATCH_RECORDS or size >= BATCH_BYTES:
+            yield batch
+            batch = []
+            size = 0
+    yield batch
+
+
+class ReplicationService(chat_pb2_grpc.ReplicationServiceServicer):
+    def __init__(self, wal, feed, secret, heartbeat_ms=DEFAULT_HEARTBEAT_MS):
+        self.wal = wal
+        self.feed = feed
+        self.secret = secret
+        self.heartbeat_s = heartbeat_ms / 1000.0
+
+    def Follow(self, request, context):
+        if not self.secret or (SECRET_HEADER, self.secret) not in tuple(context.invocation_metadata()):
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Replication call")
+        feed = self.feed
+        seq = request.applied_seq
+        caught_up = request.epoch == feed.epoch and feed.holds(seq)
+        logging.info("Follower '%s' connected at %s", request.name, seq if caught_up else "a catch-up")
+        stream = object()
+        catch_ups = 0
+        try:
+            while context.is_active():
+                if not caught_up:
+                    catch_ups += 1
+                    if catch_ups > MAX_CATCH_UPS:
+                        logging.error("Follower '%s' fell behind again after %s catch-ups, dropping it", request.name, MAX_CATCH_UPS)
+                        context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                      f"Fell more than {feed.backlog} records behind after {MAX_CATCH_UPS} catch-ups")
+                    seq = yield from self.catch_up()
+                    caught_up = True
+                with feed.changed:
+                    feed.followers[stream] = seq
+                records, last_seq = feed.after(seq, BATCH_RECORDS, self.heartbeat_s)
+                if records is None:
+                    logging.warning("Follower '%s' fell more than %s records behind, catching up again", request.name, feed.backlog)
+                    caught_up = False
+                    continue
+                seq += len(records)
+                yield chat_pb2.ReplicationBatch(records=records, synced=True, seq=seq, primary_seq=last_seq, epoch=feed.epoch)
+        finally:
+            with feed.changed:
+                feed.followers.pop(stream, None)
+            logging.info("Follower '%s' disconnected", request.name)
+
+    #the whole state from disk, first batch resetting the follower; returns the seq it brings the follower to
+    def catch_up(self):
+        with self.wal.catch_up() as (seq, lines):
+            reset = True
+            pending = None
+            for batch in batched(lines):
+                if pending is not None:
+                    yield chat_pb2.ReplicationBatch(records=pending, reset=reset, epoch=self.feed.epoch)
+                    reset = False
+                pending = batch
+            yield chat_pb2.ReplicationBatch(records=pending, reset=reset, synced=True, seq=seq,
+                                            primary_seq=self.feed.last_seq, epoch=self.feed.epoch)
+        return seq
+
+
+#apply one replicated record under the locks the primary's handler held (see store.py)
+def apply_replicated(users, groups, record):
+    op = record["op"]
+    if op.startswith("group_"):
+        # the GroupStore locks for itself
+        apply_record(users, record, groups)
+        return
+    username = record.get("user") or record.get("to")
+    with users.shard_lock(username):
+        user = users.get(username)
+        if user is None or op in ("create", "restore", "drop"):
+            apply_record(users, record, groups)
+            if user is not None and op != "create":
+                user["inbox"].close()
+            return
+        inbox = user["inbox"]
+        if op != "send":
+            with inbox.changed:
+                apply_record(users, record, groups)
+            return
+        message = Message.from_dict(record)
+        with inbox.changed:
+            inbox.append(message)
+    # as in MemoryStorage.append, the sender's copy once the recipient's locks are released
+    keep_sent(users, record, message)
+
+
+#follower side: keeps `users` and `groups` in step with the primary from a background thread
+class Replica:
+    def __init__(self, primary, secret, name, users, groups, max_staleness_ms=0, retry_s=1.0):
+        self.primary = primary
+        self.secret = secret
+        self.name = name
+        self.users = users
+        self.groups = groups
+        self.max_staleness_ms = max_staleness_ms
+        self.retry_s = retry_s
+        self.channel = grpc.insecure_channel(primary, options=CHANNEL_OPTIONS)
+        self.stub = chat_pb2_grpc.ReplicationServiceStub(self.channel)
+        self.epoch = ""
+        self.applied_seq = 0
+        self.primary_seq = 0
+        # False from the start of a catch-up until its last batch
+        self.synced = False
+        # time.monotonic() of the last batch that left the follower level with the primary
+        self.caught_up_at = None
+        self.resets = 0
+        self.call = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="replica", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.call = self.stub.Follow(
+                    chat_pb2.FollowRequest(name=self.name, epoch=self.epoch, applied_seq=self.applied_seq),
+                    metadata=((SECRET_HEADER, self.secret),), wait_for_ready=True)
+                for batch in self.call:
+                    self.receive(batch)
+            except grpc.RpcError as e:
+                if self.stopping.is_set():
+                    return
+                logging.warning("Replication stream from %s ended: %s", self.primary, e.code().name)
+            self.stopping.wait(self.retry_s)
+
+    def receive(self, batch):
+        if batch.reset:
+            self.synced = False
+            self.users.clear()
+            self.groups.clear()
+            self.resets += 1
+        for line in batch.records:
+            apply_replicated(self.users, self.groups, json.loads(line))
+        if batch.synced:
+            self.epoch = batch.epoch
+            self.applied_seq = batch.seq
+            self.primary_seq = batch.primary_seq
+            self.synced = True
+            if batch.seq >= batch.primary_seq:
+                self.caught_up_at = time.monotonic()
+
+    #records the follower is known to be behind
+    def lag(self):
+        return max(0, self.primary_seq - self.applied_seq) if self.synced else 0
+
+    #ms since the follower last matched the primary, -1 while it never has or is catching up
+    def staleness_ms(self):
+        caught_up_at = self.caught_up_at
+        if not self.synced or caught_up_at is None:
+            return -1
+        return int((time.monotonic() - caught_up_at) * 1000)
+
+    #why a read cannot be served now, None if it can
+    def read_error(self):
+        staleness_ms = self.staleness_ms()
+        if staleness_ms < 0:
+            return "Follower is catching up with the primary"
+        if self.max_staleness_ms and staleness_ms > self.max_staleness_ms:
+            return f"Follower last matched the primary {staleness_ms} ms ago"
+        return None
+
+    def stop(self):
+        self.stopping.set()
+        if self.call is not None:
+            self.call.cancel()
+        self.channel.close()
+        if self.thread is not None:
+            self.thread.join()
+
+
+#on a follower: refuses calls that change state, and reads while the follower is too far behind
+class FollowerInterceptor(grpc.ServerInterceptor):
+    def __init__(self, replica):
+        self.replica = replica
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not handler_call_details.method.startswith("/chat.ChatService/"):
+            return handler
+        replica = self.replica
+        name = method_name(handler_call_details.method)
+        if name in ALWAYS_SERVED:
+            return handler
+
+        def refused(behavior):
+            def wrapper(request, context):
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION,
+                              f"Read-only follower: send {name} to the primary at {replica.primary}")
+            return wrapper
+
+        def fresh(behavior):
+            def wrapper(request, context):
+                error = replica.read_error()
+                if error:
+                    context.abort(grpc.StatusCode.UNAVAILABLE, error)
+                return behavior(request, context)
+            return wrapper
+
+        if name not in READ_METHODS:
+            return rewrap(handler, refused, refused, refused, refused)
+        return rewrap(handler, fresh, fresh, fresh, fresh)
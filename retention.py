@@ -0,0 +1,238 @@
+import os
+import gzip
+import json
+import time
+import zlib
+import shutil
+import logging
+import threading
+
+from inbox import Message
+
+# ---------------------------
+# Inbox retention.
+# A RetentionPolicy picks read messages to evict from an inbox. It picks read
+# messages older than `read_ttl_s`, and the oldest read messages of an inbox
+# holding more than `max_messages`. Unread messages are never evicted.
+# The user's copies of the messages they sent (see inbox.py) are picked the
+# same way, with a `max_messages` cap of their own; they are dropped, never
+# archived.
+# A RetentionSweeper thread walks the storage backend (see storage.py) a few
+# users at a time and evicts whatever the policy picks. The backend holds a
+# user's lock only while it picks and removes, never while the sweeper writes
+# files. Evictions are logged to the write-ahead log like deletes.
+# With an archive, evicted messages are first written to a gzip-compressed
+# segment per user and sweep (MessageArchive). ListMessages can then page
+# through them, newest first, when asked. Segment files are named by their
+# first and last message id, so a page only opens the segments it returns.
+# ---------------------------
+# an inbox over max_messages is trimmed to this share of the cap, so messages
+# leave (and are archived) in batches rather than one at a time
+CAP_SLACK = 0.9
+SEGMENT_SUFFIX = ".json.gz"
+ARCHIVE_LOCK_STRIPES = 64
+
+
+class RetentionPolicy:
+    def __init__(self, read_ttl_s=0, max_messages=0):
+        self.read_ttl_s = read_ttl_s
+        self.max_messages = max_messages
+
+    @property
+    def enabled(self):
+        return bool(self.read_ttl_s or self.max_messages)
+
+    #read messages to evict from `inbox`, oldest first (caller holds the inbox lock)
+    def select(self, inbox, now_ms):
+        return self.pick(inbox.read.values(), len(inbox), now_ms)
+
+    #sent copies to evict from `inbox`, oldest first (caller holds the inbox lock)
+    def select_sent(self, inbox, now_ms):
+        return self.pick((message for _, message in inbox.sent.values()), len(inbox.sent), now_ms)
+
+    #the same for any storage: `read` yields a user's read messages oldest first (it may be
+    #lazy, e.g. a database cursor) and `size` counts all of their messages, read or not.
+    #the read history is in arrival order, so this stops at the first message it keeps
+    def pick(self, read, size, now_ms):
+        excess = 0
+        if self.max_messages and size > self.max_messages:
+            excess = size - int(self.max_messages * CAP_SLACK)
+        cutoff = now_ms - self.read_ttl_s * 1000 if self.read_ttl_s else None
+        victims = []
+        for m in read:
+            if len(victims) < excess or (cutoff is not None and m.timestamp < cutoff):
+                victims.append(m)
+            else:
+                break
+        return victims
+
+
+class MessageArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # one lock per group of users, guarding their segment files; a leaf lock
+        self.locks = [threading.Lock() for _ in range(ARCHIVE_LOCK_STRIPES)]
+
+    #any username becomes a safe directory name
+    def user_dir(self, username):
+        return os.path.join(self.directory, username.encode().hex())
+
+    def lock(self, username):
+        return self.locks[zlib.crc32(username.encode()) % len(self.locks)]
+
+    #(first id, last id, path) of a user's segments, oldest first
+    def segments(self, username):
+        path = self.user_dir(username)
+        if not os.path.isdir(path):
+            return []
+        found = []
+        for name in os.listdir(path):
+            if name.endswith(SEGMENT_SUFFIX):
+                first, last = name[:-len(SEGMENT_SUFFIX)].split("-")
+                found.append((int(first), int(last), os.path.join(path, name)))
+        return sorted(found)
+
+    def has(self, username):
+        return bool(self.segments(username))
+
+    def read_segment(self, path):
+        with gzip.open(path, "rt") as f:
+            return [Message.from_dict(m) for m in json.load(f)]
+
+    #write a segment atomically (temp file + rename), so a crash never leaves half of one
+    def write_segment(self, username, messages):
+        path = self.user_dir(username)
+        os.makedirs(path, exist_ok=True)
+        final = os.path.join(path, f"{messages[0].id:020d}-{messages[-1].id:020d}{SEGMENT_SUFFIX}")
+        tmp = final + ".tmp"
+        with open(tmp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps([m.to_dict() for m in messages], separators=(",", ":")).encode())
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, final)
+
+    #archive evicted messages (in id order) as one new segment
+    def append(self, username, messages):
+        if messages:
+            with self.lock(username):
+                self.write_segment(username, messages)
+
+    #up to about `limit` archived messages older than `before_id` (0: the newest), in arrival
+    #order, plus the id to pass as before_id for the next older page (0 when there is none)
+    def page(self, username, before_id=0, limit=100):
+        with self.lock(username):
+            older = [s for s in self.segments(username) if not before_id or s[0] < before_id]
+            pages = []
+            found = 0
+            while older and found < limit:
+                first, last, path = older.pop()
+                messages = [m for m in self.read_segment(path) if not before_id or m.id < before_id]
+                pages.append(messages)
+                found += len(messages)
+        messages = [m for page in reversed(pages) for m in page]
+        next_before_id = messages[0].id if older and messages else 0
+        return messages, next_before_id
+
+    #delete archived messages by id, returns how many were removed
+    def delete_ids(self, username, ids):
+        ids = set(ids)
+        deleted = 0
+        with self.lock(username):
+            for first, last, path in self.segments(username):
+                if not any(first <= i <= last for i in ids):
+                    continue
+                messages = self.read_segment(path)
+                kept = [m for m in messages if m.id not in ids]
+                if len(kept) == len(messages):
+                    continue
+                deleted += len(messages) - len(kept)
+                os.remove(path)
+                if kept:
+                    self.write_segment(username, kept)
+            self.remove_if_empty(username)
+        return deleted
+
+    def remove_if_empty(self, username):
+        path = self.user_dir(username)
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+
+    #drop a user's whole archive (account deleted, or all messages deleted)
+    def drop(self, username):
+        with self.lock(username):
+            shutil.rmtree(self.user_dir(username), ignore_errors=True)
+
+    #every archived message of a user, in arrival order (the user is moving to another node)
+    def take_all(self, username):
+        with self.lock(username):
+            return [m for _, _, path in self.segments(username) for m in self.read_segment(path)]
+
+
+class RetentionSweeper:
+    #`commit_mutation` is the server's write-ahead log hook for the seqs `storage` returns
+    def __init__(self, storage, policy, archive, commit_mutation, interval_s=60, batch=100, pause_s=0.01):
+        self.storage = storage
+        self.policy = policy
+        self.archive = archive
+        self.commit_mutation = commit_mutation
+        self.interval_s = interval_s
+        self.batch = batch
+        self.pause_s = pause_s
+        self.evicted = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopping.wait(self.interval_s):
+            try:
+                self.sweep()
+            except OSError:
+                logging.exception("Retention sweep failed")
+
+    #one pass over every user, `batch` users at a time with a short pause in between; returns messages evicted
+    def sweep(self):
+        started = time.perf_counter()
+        usernames = self.storage.usernames()
+        evicted = 0
+        for start in range(0, len(usernames), self.batch):
+            if self.stopping.is_set():
+                break
+            now_ms = int(time.time() * 1000)
+            for username in usernames[start:start + self.batch]:
+                evicted += self.sweep_user(username, now_ms)
+            time.sleep(self.pause_s)
+        if evicted:
+            logging.info("Retention sweep evicted %d messages from %d users in %.1f ms",
+                         evicted, len(usernames), (time.perf_counter() - started) * 1000)
+        return evicted
+
+    #evict one user's expired messages, archiving them first, and expired sent copies; returns how many were evicted
+    def sweep_user(self, username, now_ms):
+        evicted = []
+        victims = self.storage.expired(username, self.policy, now_ms)
+        if victims:
+            if self.archive is not None:
+                self.archive.append(username, victims)
+            # the user may have deleted some meanwhile, or the whole account
+            evicted, seq = self.storage.evict(username, [m.id for m in victims])
+            if self.archive is not None and len(evicted) < len(victims):
+                self.archive.delete_ids(username, {m.id for m in victims}.difference(evicted))
+            self.commit_mutation(seq)
+        sent = self.storage.expired_sent(username, self.policy, now_ms)
+        if sent:
+            dropped, seq = self.storage.evict_sent(username, [m.id for m in sent])
+            self.commit_mutation(seq)
+            evicted += dropped
+        self.evicted += len(evicted)
+        return len(evicted)
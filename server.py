@@ -1,15 +1,36 @@
 import os
+import sys
 import json
+import signal
+import secrets
+import threading
+import subprocess
+import asyncio
+import contextvars
 import grpc
 from concurrent import futures
 import time
-import re
 import logging
-import datetime
-import hashlib
 
 import chat_pb2
 import chat_pb2_grpc
+from persistence import WriteAheadLog, last_id_of
+from store import UserStore
+from storage import MemoryStorage, SQLiteStorage, UnknownUser, UnknownSender, UnknownRecipient
+from groups import GroupStore, GroupFanout, UnknownGroup, NotAMember, MAX_GROUP_NAME_LENGTH, DEFAULT_MAX_HISTORY
+from retention import RetentionPolicy, MessageArchive, RetentionSweeper
+from dedup import DedupCache, MAX_REQUEST_ID_LENGTH
+from ratelimit import RateLimiter, RateLimitInterceptor, AsyncRateLimitInterceptor, DEFAULT_MAX_BUCKETS
+from account_index import MAX_PATTERN_LENGTH
+from message_index import MAX_QUERY_LENGTH, MAX_QUERY_WORDS, words
+from log_pipeline import rpc_log, start_logging
+from metrics import Metrics, MetricsInterceptor, AsyncMetricsInterceptor
+from profiling import Profiler, handler_codes, DEFAULT_INTERVAL_MS, DEFAULT_DURATION_S
+from auth import (SessionCache, AuthInterceptor, AsyncAuthInterceptor, make_password_hash, check_password,
+                  token_from_metadata, DEFAULT_SCRYPT_N)
+from partition import Partitioning, RoutingInterceptor, HashRing
+from replication import (ReplicationFeed, ReplicationService, Replica, FollowerInterceptor,
+                         DEFAULT_BACKLOG, DEFAULT_HEARTBEAT_MS)
 
 # ---------------------------
 # Load configuration from config.json
@@ -19,31 +40,222 @@ with open("config.json", "r") as config_file:
 
 HOST = config.get("server_host", "0.0.0.0")
 PORT = config.get("server_port", 50051)
+# every open Subscribe stream holds one worker thread (at most rate_limits.max_streams of them)
+MAX_WORKERS = config.get("max_workers", 10)
+PERSISTENCE = config.get("persistence", {})
+# "threads" (grpc.server on a thread pool), "asyncio" (grpc.aio event loop),
+# "multiprocess" (a supervisor running `workers` thread-pool servers, see partition.py)
+# or "cluster" (one node of several, listed under "cluster")
+SERVER_MODE = config.get("server_mode", "threads")
+WORKERS = config.get("workers", os.cpu_count() or 1)
+# private localhost ports of the workers are worker_base_port, worker_base_port + 1, ...
+WORKER_BASE_PORT = config.get("worker_base_port", PORT + 1)
+
+# cluster mode: this node's name, the peer list and the ring settings (see partition.py)
+CLUSTER = config.get("cluster", {})
+# users per Handoff call when a node joins
+HANDOFF_BATCH = 100
+# message id residue classes in cluster mode, i.e. the most nodes a cluster can grow to
+MAX_CLUSTER_NODES = 1024
+
+# clients (chat_client.py) keep one channel open and ping it while idle; accept those pings
+SERVER_OPTIONS = [
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.min_ping_interval_without_data_ms", 20000),
+]
+
+# set in a worker process of the multi-process mode, or on a cluster node: which users this process owns
+partitions = None
+
+# ---------------------------
+# Logging goes through a queue to a background writer (see log_pipeline.py),
+# installed by serve()/serve_async(). Per-RPC lines use `rpc_log`, which can be
+# sampled, and pass their values as %-style args so formatting is deferred.
+# ---------------------------
+LOGGING = config.get("logging", {})
+log_listener = None
+
+# ---------------------------
+# Per-RPC metrics (see metrics.py), recorded by an interceptor that serve() and
+# serve_async() install, read through GetStats or the optional Prometheus port.
+# ---------------------------
+METRICS = config.get("metrics", {})
+metrics = Metrics()
+metrics_http = None
+
+# ---------------------------
+# Replication (see replication.py): with "role": "primary" the write-ahead log is
+# streamed to followers over ReplicationService.Follow; with "role": "follower"
+# the process applies the primary's log in memory and serves only reads. Needs
+# the threads server mode and, on the primary, the memory backend with persistence.
+# ---------------------------
+REPLICATION = config.get("replication", {})
+REPLICATION_ROLE = REPLICATION.get("role", "")
+REPLICATION_ROLES = ("", "primary", "follower")
+replication_feed = None
+replica = None
+
+# ---------------------------
+# On-demand profiling (see profiling.py): SIGUSR1 samples the RPC handlers for
+# `profiling.duration_s` seconds, SIGUSR2 ends the window early; the output goes
+# to logs/. Only someone who may signal the server process can turn it on, and
+# nothing runs while it is off.
+# ---------------------------
+PROFILING = config.get("profiling", {})
+profiler = None
+
+# ---------------------------
+# Sessions (see auth.py): Login pays for the password hash once and hands out a
+# token; serve()/serve_async() install an interceptor that checks it on every
+# other call. The handlers themselves trust their username/sender fields.
+# ---------------------------
+AUTH = config.get("auth", {})
+SCRYPT_N = AUTH.get("scrypt_n", DEFAULT_SCRYPT_N)
+sessions = SessionCache(ttl_s=AUTH.get("session_ttl_s", 3600), max_sessions=AUTH.get("max_sessions", 100000))
+
+# ---------------------------
+# Retention (see retention.py): a background sweeper evicts expired read
+# messages, optionally archiving them under <data_dir>/archive for paged
+# ListMessages. Started by serve()/serve_async() when a limit is configured.
+# ---------------------------
+RETENTION = config.get("retention", {})
+retention_policy = RetentionPolicy(RETENTION.get("read_ttl_s", 0), RETENTION.get("max_messages", 0))
+# archived messages per ListMessages page unless the request asks for fewer
+ARCHIVE_PAGE_SIZE = 100
+# read messages per ListMessages page unless the request asks for fewer
+LIST_PAGE_SIZE = 100
+archive = None
+sweeper = None
+# SearchMessages results per page unless the request asks for fewer
+SEARCH_PAGE_SIZE = 100
+# ConversationHistory messages per page unless the request asks for fewer
+CONVERSATION_PAGE_SIZE = 100
 
 # ---------------------------
-# Ensure logs folder exists
+# Admission control (see ratelimit.py): per-caller token buckets for the
+# methods listed under "rate_limits" and a cap on calls running at once,
+# enforced by an interceptor that serve()/serve_async() install.
 # ---------------------------
-os.makedirs("logs", exist_ok=True)
-timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-log_filename = os.path.join("logs", f"chat_server_{timestamp}.log")
-logging.basicConfig(
-    filename=log_filename,
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s"
+RATE_LIMITS = config.get("rate_limits", {})
+rate_limiter = RateLimiter(
+    RATE_LIMITS.get("methods", {}),
+    max_buckets=RATE_LIMITS.get("max_buckets", DEFAULT_MAX_BUCKETS),
+    max_concurrent=RATE_LIMITS.get("max_concurrent", 0),
+    # by default a quarter of the thread pool
+    max_streams=RATE_LIMITS.get("max_streams", max(1, MAX_WORKERS // 4))
 )
-logging.info("-------------------------------------------------")
-logging.info("Chat Server started.")
-logging.info(f"Logging to file: {log_filename}")
+metrics.gauge("rate_limited", lambda: rate_limiter.rate_limited)
+metrics.gauge("over_capacity", lambda: rate_limiter.over_capacity)
+metrics.gauge("open_streams", lambda: rate_limiter.streams)
 
 # ---------------------------
-# In-memory storage for users.
-# Each user is a dict with keys: "password" and "messages"
-# "messages" is a list of dicts with keys: "from", "content", "read", "timestamp"
+# Idempotent sends (see dedup.py): responses of SendMessage calls that carry a
+# request_id, kept per (sender, request_id) so a retried call is not delivered twice.
 # ---------------------------
-users_db = {}
+DEDUP = config.get("dedup", {})
+sent_requests = DedupCache(ttl_s=DEDUP.get("ttl_s", 300), max_entries=DEDUP.get("max_entries", 100000))
+
+# ---------------------------
+# Storage for users and messages (see storage.py). The handlers go through
+# `storage`, which open_storage() points at the backend config.json picks:
+#   "memory" - users_db below, made durable by the write-ahead log
+#   "sqlite" - an SQLite database in the data directory, for data sets larger than RAM
+# In users_db each user is a dict with keys: "password" (a salted hash, see auth.py) and "inbox"
+# "inbox" is an Inbox (see inbox.py) holding compact Message records: id, sender, content, timestamp
+# ("timestamp" is epoch milliseconds; formatting for display is left to the client)
+# users_db is a lock-striped UserStore (see store.py for the locking rules),
+# so the handlers can run in parallel on the thread pool.
+# ---------------------------
+STORAGE = config.get("storage", {})
+STORAGE_BACKENDS = ("memory", "sqlite")
+users_db = UserStore(config.get("store_shards", 64))
+
+# server-assigned message ids, monotonically increasing and never reused;
+# open_persistence() resumes the sequence after the last logged id.
+# With partitions, each worker/node hands out only the ids congruent to its
+# index, so ids stay unique across processes.
+class MessageIds:
+    def __init__(self, after=0, index=0, step=1):
+        self.lock = threading.Lock()
+        self.last = after
+        self.index = index
+        self.step = step
+
+    def __call__(self):
+        with self.lock:
+            self.last += 1 + (self.index - self.last - 1) % self.step
+            return self.last
+
+    #never hand out an id at or below `floor` (messages received from another node)
+    def advance(self, floor):
+        with self.lock:
+            self.last = max(self.last, floor)
+
+def message_ids(after=0):
+    if partitions is None:
+        return MessageIds(after)
+    return MessageIds(after, (partitions.index + 1) % partitions.id_step, partitions.id_step)
+
+next_message_id = message_ids()
+
+# ---------------------------
+# Write-ahead log (see persistence.py), opened by serve().
+# None when persistence is disabled, e.g. when the handlers run under unit tests.
+# Handlers append their record while still holding the lock that ordered the
+# change, and only commit (wait for fsync) once the lock is released.
+# ---------------------------
+wal = None
+
+# set by the asyncio server while it runs a handler: commits are collected here
+# and awaited afterwards instead of blocking the event loop
+deferred_commits = contextvars.ContextVar("deferred_commits", default=None)
+
+def log_mutation(record):
+    return wal.append(record) if wal is not None else 0
+
+def commit_mutation(seq):
+    if wal is None or not seq:
+        return
+    pending = deferred_commits.get()
+    if pending is not None:
+        pending.append(seq)
+    else:
+        wal.commit(seq)
+
+async def commit_mutation_async(seq):
+    if wal is not None and seq and not wal.is_committed(seq):
+        await asyncio.get_running_loop().run_in_executor(None, wal.commit, seq)
+
+# ---------------------------
+# Group channels (see groups.py): the memory backend keeps them in `groups`,
+# logged with the users; `group_fanout` wakes the Subscribe streams of online
+# members. Groups live with the users of one process, so the multi-process and
+# cluster modes do not offer them.
+# ---------------------------
+GROUPS = config.get("groups", {})
+groups = GroupStore(GROUPS.get("max_history", DEFAULT_MAX_HISTORY))
+group_fanout = GroupFanout()
+
+# the memory backend until open_storage() runs; ids are allocated through the
+# current next_message_id, which serve_worker()/serve_cluster() replace
+storage = MemoryStorage(users_db, log_mutation, lambda: next_message_id(), groups)
+
+#`group` names the group of a group message
+def message_to_proto(m, group=""):
+    return chat_pb2.Message(id=m.id, sender=m.sender, timestamp_ms=m.timestamp, content=m.content, group=group)
+
+#reply to a stored message, or to one whose recipient does not exist (message_id None)
+def sent_response(to_user, message_id):
+    if message_id is None:
+        return chat_pb2.SendMessageResponse(message=f"Recipient '{to_user}' does not exist", success=False)
+    return chat_pb2.SendMessageResponse(message="Message sent successfully", success=True, message_id=message_id)
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+#dumped (JSON-able) message dicts to and from the wire, for users moving between nodes
+def dumped_message_to_proto(m):
+    return chat_pb2.Message(id=m["id"], sender=m["from"], timestamp_ms=m["timestamp"], content=m["content"])
+
+def message_from_proto(message):
+    return {"id": message.id, "from": message.sender, "content": message.content, "timestamp": message.timestamp_ms}
 
 class ChatService(chat_pb2_grpc.ChatServiceServicer):
     #handling user registration with create account method
@@ -52,42 +264,62 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         password = request.password
         if not username or not password:
             return chat_pb2.CreateAccountResponse(message="Username or password missing", success=False)
-        if username in users_db:
+        if storage.exists(username):
+            return chat_pb2.CreateAccountResponse(message="Username already taken", success=False)
+        # the slow hash runs before any lock is taken; only the hash is stored and logged
+        password_hash = make_password_hash(password, n=SCRYPT_N)
+        created, seq = storage.create_account(username, password_hash)
+        if not created:
             return chat_pb2.CreateAccountResponse(message="Username already taken", success=False)
-        users_db[username] = {"password": password, "messages": []}
-        logging.info(f"Account created: {username}")
+        commit_mutation(seq)
+        rpc_log.info("Account created: %s", username)
         return chat_pb2.CreateAccountResponse(message=f"Account '{username}' created successfully", success=True)
         
-    #authenticating a user and returning the number of unread messages
+    #authenticating a user and returning the number of unread messages and a session token
     def Login(self, request, context):
         username = request.username
         password = request.password
         if not username or not password:
             return chat_pb2.LoginResponse(message="Username or password missing", unread_count=0, success=False)
-        if username not in users_db:
+        password_hash = storage.password(username)
+        if password_hash is None:
             return chat_pb2.LoginResponse(message="No such user", unread_count=0, success=False)
-        if users_db[username]["password"] != password:
+        if not check_password(password_hash, password):
             return chat_pb2.LoginResponse(message="Incorrect password", unread_count=0, success=False)
-        unread_count = sum(1 for m in users_db[username]["messages"] if not m.get("read", False))
-        logging.info(f"User logged in: {username}")
+        unread_count = (storage.unread_count(username) or 0) + storage.group_unread_count(username)
+        token = sessions.issue(username)
+        if token is None:
+            rpc_log.warning("Login refused, session cache full: %s", username)
+            return chat_pb2.LoginResponse(message="Too many sessions, try again later", unread_count=0, success=False)
+        rpc_log.info("User logged in: %s", username)
         return chat_pb2.LoginResponse(
             message=f"User '{username}' logged in successfully",
             unread_count=unread_count,
-            success=True
+            success=True,
+            session_token=token
         )
 
-    # List all user accounts, also made flexible to list accounts with pattern
-    
+    #ends the session whose token the call carries
+    def Logout(self, request, context):
+        token = token_from_metadata(context.invocation_metadata())
+        username = sessions.lookup(token) if token is not None else None
+        if username is None:
+            return chat_pb2.LogoutResponse(message="Not logged in", success=False)
+        sessions.revoke(token)
+        rpc_log.info("User logged out: %s", username)
+        return chat_pb2.LogoutResponse(message="Logged out", success=True)
 
+    # List all user accounts, also made flexible to list accounts with a wildcard pattern, one page at a time
     def ListAccounts(self, request, context):
         pattern = request.pattern
-        all_users = list(users_db.keys())
-        if pattern:
-            matches = [u for u in all_users if re.search(pattern, u, re.IGNORECASE)]
+        if len(pattern) > MAX_PATTERN_LENGTH:
+            return chat_pb2.ListAccountsResponse(accounts=[], success=False)
+        if partitions is None:
+            matches, next_page_token = storage.search(pattern, request.page_size, request.page_token)
         else:
-            matches = all_users
-        logging.info(f"Listing accounts with pattern: '{pattern}'")
-        return chat_pb2.ListAccountsResponse(accounts=matches, success=True)
+            matches, next_page_token = partitions.search_all(pattern, request.page_size, request.page_token, storage.search)
+        rpc_log.info("Listing accounts with pattern: '%s'", pattern)
+        return chat_pb2.ListAccountsResponse(accounts=matches, next_page_token=next_page_token, success=True)
     
     #sending a message from one user to another 
     def SendMessage(self, request, context):
@@ -97,19 +329,94 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         content = request.content
         if not from_user or not to_user or content is None:
             return chat_pb2.SendMessageResponse(message="Missing fields", success=False)
-        if from_user not in users_db:
+        if not request.request_id:
+            return self.send_message(from_user, to_user, content)
+        if len(request.request_id) > MAX_REQUEST_ID_LENGTH:
+            return chat_pb2.SendMessageResponse(message="request_id too long", success=False)
+        # a retry gets the first call's response, waiting for it if that call is still running
+        return sent_requests.run((from_user, request.request_id), lambda: self.send_message(from_user, to_user, content))
+
+    #SendMessage after validation, without the dedup step
+    def send_message(self, from_user, to_user, content):
+        timestamp_ms = int(time.time() * 1000)
+        # a recipient in another worker gets the message through a call to it, made holding no lock
+        remote = partitions is not None and not partitions.is_local(to_user)
+        try:
+            if remote and not storage.exists(from_user):
+                raise UnknownSender(from_user)
+            # a local send checks the sender in the same step that stores the message
+            response, seq = self.deliver(from_user, to_user, content, timestamp_ms, check_sender=not remote)
+        except UnknownSender:
             return chat_pb2.SendMessageResponse(message=f"Sender '{from_user}' does not exist", success=False)
-        if to_user not in users_db:
-            return chat_pb2.SendMessageResponse(message=f"Recipient '{to_user}' does not exist", success=False)
-        timestamp_str = datetime.datetime.now().strftime('%m/%d %H:%M')
-        users_db[to_user]["messages"].append({
-            "from": from_user,
-            "content": content,
-            "read": False,
-            "timestamp": timestamp_str
-        })
-        logging.info(f"Message from '{from_user}' to '{to_user}' sent")
-        return chat_pb2.SendMessageResponse(message="Message sent successfully", success=True)
+        commit_mutation(seq)
+        if response.success:
+            rpc_log.info("Message from '%s' to '%s' sent", from_user, to_user)
+        return response
+
+    #store one message, shared by SendMessage and the stream APIs; the sender is already validated
+    #unless `check_sender` (then UnknownSender is raised). Returns (SendMessageResponse, wal seq);
+    #the caller commits the seq
+    def deliver(self, from_user, to_user, content, timestamp_ms, check_sender=False):
+        if not to_user:
+            return chat_pb2.SendMessageResponse(message="Missing fields", success=False), 0
+        if partitions is not None and not partitions.is_local(to_user):
+            item = chat_pb2.BatchItem(to=to_user, content=content)
+            response = partitions.deliver_remote(partitions.owner(to_user), from_user, [item], timestamp_ms)[0]
+            return response, self.keep_sent(from_user, item, response, timestamp_ms)
+        try:
+            message_id, seq = storage.append(from_user, to_user, content, timestamp_ms, check_sender)
+        except UnknownRecipient:
+            message_id, seq = None, 0
+        return sent_response(to_user, message_id), seq
+
+    #the sender's copy of a message another worker stored (a local send keeps it itself); returns the seq
+    def keep_sent(self, from_user, item, response, timestamp_ms):
+        if not response.success:
+            return 0
+        return storage.append_sent(from_user, item.to, response.message_id, item.content, timestamp_ms)
+
+    #many messages from one sender: one sender lookup, one timestamp, one log commit
+    def SendMessageBatch(self, request, context):
+        from_user = request.sender
+        if not from_user or not request.items:
+            return chat_pb2.SendMessageBatchResponse(results=[], sent_count=0, success=False)
+        if not storage.exists(from_user):
+            failed = chat_pb2.SendMessageResponse(message=f"Sender '{from_user}' does not exist", success=False)
+            return chat_pb2.SendMessageBatchResponse(results=[failed] * len(request.items), sent_count=0, success=False)
+        timestamp_ms = int(time.time() * 1000)
+        results = [None] * len(request.items)
+        # local items are stored in one storage call (one SQLite transaction),
+        # items for other workers' users go out as one Deliver call per worker
+        local = []
+        remote = {}
+        for position, item in enumerate(request.items):
+            if not item.to:
+                results[position] = chat_pb2.SendMessageResponse(message="Missing fields", success=False)
+            elif partitions is not None and not partitions.is_local(item.to):
+                remote.setdefault(partitions.owner(item.to), []).append(position)
+            else:
+                local.append(position)
+        message_ids, last_seq = storage.append_batch(
+            from_user, [(request.items[p].to, request.items[p].content) for p in local], timestamp_ms)
+        for position, message_id in zip(local, message_ids):
+            results[position] = sent_response(request.items[position].to, message_id)
+        for owner, positions in remote.items():
+            items = [request.items[position] for position in positions]
+            for position, item, response in zip(positions, items, partitions.deliver_remote(owner, from_user, items, timestamp_ms)):
+                results[position] = response
+                last_seq = max(last_seq, self.keep_sent(from_user, item, response, timestamp_ms))
+        commit_mutation(last_seq)
+        sent_count = sum(1 for r in results if r.success)
+        rpc_log.info("Batch from '%s': %s of %s messages sent", from_user, sent_count, len(results))
+        return chat_pb2.SendMessageBatchResponse(results=results, sent_count=sent_count, success=True)
+
+    #continuous producer: messages are delivered as they stream in, the log is committed once at the end
+    def SendMessageStream(self, request_iterator, context):
+        batch = StreamedSends(self)
+        for request in request_iterator:
+            batch.add(request)
+        commit_mutation(batch.last_seq)
+        return batch.summary()
 
     #Retrival of unread messages
     def ReadNewMessages(self, request, context):
@@ -117,42 +424,49 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         count = request.count
         if not username:
             return chat_pb2.ReadNewMessagesResponse(messages=[], success=False)
-        if username not in users_db:
+        selected, seq = storage.take_unread(username, count)
+        if selected is None:
             return chat_pb2.ReadNewMessagesResponse(messages=[], success=False)
-        all_messages = users_db[username]["messages"]
-        unread = [m for m in all_messages if not m.get("read", False)]
-        if count <= 0 or count > len(unread):
-            count = len(unread)
-        selected = unread[:count]
-        for m in selected:
-            m["read"] = True
-        encoded = [f"{m['timestamp']} - From: {m['from']} - {m['content']}" for m in selected]
-        logging.info(f"Read {len(encoded)} new messages for user '{username}'")
-        return chat_pb2.ReadNewMessagesResponse(messages=encoded, success=True)
+        commit_mutation(seq)
+        messages = [message_to_proto(m) for m in selected]
+        if count <= 0 or len(selected) < count:
+            messages += self.take_group_mail(username, count - len(selected) if count > 0 else 0)
+        rpc_log.info("Read %s new messages for user '%s'", len(messages), username)
+        return chat_pb2.ReadNewMessagesResponse(messages=messages, success=True)
+
+    #up to `count` (all if count <= 0) of the user's unread group messages, as Message protos naming their group
+    def take_group_mail(self, username, count):
+        taken, seq = storage.take_group_unread(username, count)
+        commit_mutation(seq)
+        return [message_to_proto(m, group) for group, m in taken]
 
 
     #Message Deletion, option to delete all messages if requested
     def DeleteMessages(self, request, context):
         username = request.username
-        msg_ids = request.message_ids  # list of ints; a single value -1 indicates "delete all"
-        if not username or not msg_ids:
+        msg_ids = request.message_ids
+        if not username or not (msg_ids or request.delete_all):
             return chat_pb2.DeleteMessagesResponse(message="Missing fields", success=False)
-        if username not in users_db:
-            return chat_pb2.DeleteMessagesResponse(message=f"User '{username}' does not exist", success=False)
-        messages = users_db[username]["messages"]
-        if len(msg_ids) == 1 and msg_ids[0] == -1:
-            users_db[username]["messages"] = []
-            logging.info(f"All messages deleted for user '{username}'")
+        if request.delete_all:
+            done, seq = storage.delete_all(username)
+            if not done:
+                return chat_pb2.DeleteMessagesResponse(message=f"User '{username}' does not exist", success=False)
+            commit_mutation(seq)
+            if archive is not None:
+                archive.drop(username)
+            rpc_log.info("All messages deleted for user '%s'", username)
             return chat_pb2.DeleteMessagesResponse(message="All messages deleted", success=True)
-        # Delete messages using 1-indexed positions
-        indices = sorted(msg_ids, reverse=True)
-        deleted_count = 0
-        for i in indices:
-            idx = i - 1
-            if 0 <= idx < len(messages):
-                del messages[idx]
-                deleted_count += 1
-        logging.info(f"Deleted {deleted_count} messages for user '{username}'")
+        # Delete messages by id, O(number of ids)
+        deleted, seq = storage.delete_ids(username, msg_ids)
+        if deleted is None:
+            return chat_pb2.DeleteMessagesResponse(message=f"User '{username}' does not exist", success=False)
+        commit_mutation(seq)
+        deleted_count = len(deleted)
+        # ids no longer stored may belong to archived messages
+        missing = set(msg_ids).difference(deleted) if archive is not None else ()
+        if missing:
+            deleted_count += archive.delete_ids(username, missing)
+        rpc_log.info("Deleted %s messages for user '%s'", deleted_count, username)
         return chat_pb2.DeleteMessagesResponse(message=f"Deleted {deleted_count} messages.", success=True)
 
 
@@ -161,42 +475,941 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         username = request.username
         if not username:
             return chat_pb2.DeleteAccountResponse(message="Username missing", success=False)
-        if username not in users_db:
+        done, seq = storage.drop_account(username)
+        if not done:
             return chat_pb2.DeleteAccountResponse(message=f"No such user '{username}'", success=False)
-        del users_db[username]
-        logging.info(f"Account deleted: {username}")
+        commit_mutation(seq)
+        sessions.revoke_user(username)
+        if archive is not None:
+            archive.drop(username)
+        rpc_log.info("Account deleted: %s", username)
         return chat_pb2.DeleteAccountResponse(message=f"Account '{username}' deleted.", success=True)
 
-    #List all read messages for a user
+    #List all read messages for a user, or a page of their archived ones
     def ListMessages(self, request, context):
         username = request.username
-        if not username or username not in users_db:
+        if request.archived:
+            if not username or not storage.exists(username):
+                return chat_pb2.ListMessagesResponse(messages=[], success=False)
+            return self.list_archived(username, request)
+        page_size = request.page_size if 0 < request.page_size <= LIST_PAGE_SIZE else LIST_PAGE_SIZE
+        page = storage.read_page(username, request.before_id, page_size) if username else None
+        if page is None:
             return chat_pb2.ListMessagesResponse(messages=[], success=False)
-        messages = [m for m in users_db[username]["messages"] if m.get("read", False)]
-        encoded = [f"{m['timestamp']} - From: {m['from']} - {m['content']}" for m in messages]
-        logging.info(f"Listing all read messages for user '{username}'")
-        return chat_pb2.ListMessagesResponse(messages=encoded, success=True)
+        messages, next_before_id = page
+        rpc_log.info("Listing %s read messages for user '%s'", len(messages), username)
+        return chat_pb2.ListMessagesResponse(messages=[message_to_proto(m) for m in messages], success=True,
+                                             has_archived=archive is not None and archive.has(username), next_before_id=next_before_id)
+
+    #messages the retention sweeper moved to disk, read lazily one page of segments at a time
+    def list_archived(self, username, request):
+        if archive is None:
+            return chat_pb2.ListMessagesResponse(messages=[], success=True)
+        page_size = request.page_size if 0 < request.page_size <= ARCHIVE_PAGE_SIZE else ARCHIVE_PAGE_SIZE
+        messages, next_before_id = archive.page(username, request.before_id, page_size)
+        # a crash between archiving and evicting can leave a message in both places
+        stored = storage.stored_ids(username, [m.id for m in messages])
+        messages = [m for m in messages if m.id not in stored]
+        rpc_log.info("Listing %s archived messages for user '%s'", len(messages), username)
+        return chat_pb2.ListMessagesResponse(messages=[message_to_proto(m) for m in messages], success=True,
+                                             has_archived=bool(next_before_id), next_before_id=next_before_id)
+
+    #Keyword search over the user's stored messages, newest first, served from the per-user index
+    def SearchMessages(self, request, context):
+        username = request.username
+        query_words = words(request.query)
+        if len(request.query) > MAX_QUERY_LENGTH or len(query_words) > MAX_QUERY_WORDS:
+            return chat_pb2.SearchMessagesResponse(messages=[], success=False)
+        page_size = request.page_size if 0 < request.page_size <= SEARCH_PAGE_SIZE else SEARCH_PAGE_SIZE
+        page = storage.search_messages(username, query_words, request.sender, request.since_ms, request.until_ms,
+                                       request.before_id, page_size) if username else None
+        if page is None:
+            return chat_pb2.SearchMessagesResponse(messages=[], success=False)
+        messages, next_before_id = page
+        rpc_log.info("Search by user '%s' found %s messages", username, len(messages))
+        return chat_pb2.SearchMessagesResponse(messages=[message_to_proto(m) for m in messages], success=True,
+                                               next_before_id=next_before_id)
+
+    #One page of the two-way conversation between the user and a peer, oldest first, from the per-user conversation index
+    def ConversationHistory(self, request, context):
+        username = request.username
+        peer = request.peer
+        if not username or not peer:
+            return chat_pb2.ConversationHistoryResponse(messages=[], success=False)
+        limit = request.limit if 0 < request.limit <= CONVERSATION_PAGE_SIZE else CONVERSATION_PAGE_SIZE
+        page = storage.conversation(username, peer, request.before_id, request.after_id, limit)
+        if page is None:
+            return chat_pb2.ConversationHistoryResponse(messages=[], success=False)
+        messages, has_older, has_newer = page
+        rpc_log.info("Listing %s messages between '%s' and '%s'", len(messages), username, peer)
+        return chat_pb2.ConversationHistoryResponse(messages=[message_to_proto(m) for m in messages], success=True,
+                                                    has_older=has_older, has_newer=has_newer)
+
+    #groups live with the users of one process; the multi-process and cluster modes would need them on every node
+    def check_groups_available(self, context):
+        if partitions is not None:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, "Groups are not available in multi-process or cluster mode")
+
+    #a new group channel; its creator is the first member
+    def CreateGroup(self, request, context):
+        self.check_groups_available(context)
+        username = request.username
+        name = request.group
+        if not username or not name:
+            return chat_pb2.GroupResponse(message="Missing fields", success=False)
+        if len(name) > MAX_GROUP_NAME_LENGTH:
+            return chat_pb2.GroupResponse(message="Group name too long", success=False)
+        try:
+            created, seq = storage.create_group(name, username)
+        except UnknownUser:
+            return chat_pb2.GroupResponse(message=f"User '{username}' does not exist", success=False)
+        if not created:
+            return chat_pb2.GroupResponse(message="Group name already taken", success=False)
+        commit_mutation(seq)
+        group_fanout.joined(name, username)
+        rpc_log.info("Group '%s' created by '%s'", name, username)
+        return chat_pb2.GroupResponse(message=f"Group '{name}' created successfully", success=True)
+
+    #join a group; the new member gets the messages sent from now on
+    def JoinGroup(self, request, context):
+        self.check_groups_available(context)
+        username = request.username
+        name = request.group
+        if not username or not name:
+            return chat_pb2.GroupResponse(message="Missing fields", success=False)
+        try:
+            joined, seq = storage.join_group(name, username)
+        except UnknownUser:
+            return chat_pb2.GroupResponse(message=f"User '{username}' does not exist", success=False)
+        except UnknownGroup:
+            return chat_pb2.GroupResponse(message=f"Group '{name}' does not exist", success=False)
+        if not joined:
+            return chat_pb2.GroupResponse(message=f"Already a member of group '{name}'", success=True)
+        commit_mutation(seq)
+        group_fanout.joined(name, username)
+        rpc_log.info("User '%s' joined group '%s'", username, name)
+        return chat_pb2.GroupResponse(message=f"Joined group '{name}'", success=True)
+
+    #a message to every member of a group, stored once
+    def SendGroupMessage(self, request, context):
+        self.check_groups_available(context)
+        sender = request.sender
+        name = request.group
+        if not sender or not name:
+            return chat_pb2.SendMessageResponse(message="Missing fields", success=False)
+        if not request.request_id:
+            return self.send_group_message(sender, name, request.content)
+        if len(request.request_id) > MAX_REQUEST_ID_LENGTH:
+            return chat_pb2.SendMessageResponse(message="request_id too long", success=False)
+        return sent_requests.run((sender, request.request_id, name), lambda: self.send_group_message(sender, name, request.content))
+
+    #SendGroupMessage after validation, without the dedup step
+    def send_group_message(self, sender, name, content):
+        try:
+            message_id, seq = storage.append_group(name, sender, content, int(time.time() * 1000))
+        except UnknownGroup:
+            return chat_pb2.SendMessageResponse(message=f"Group '{name}' does not exist", success=False)
+        except NotAMember:
+            return chat_pb2.SendMessageResponse(message=f"'{sender}' is not a member of group '{name}'", success=False)
+        commit_mutation(seq)
+        # one wake-up per online member; they all read the one stored copy
+        group_fanout.notify(name)
+        rpc_log.info("Message from '%s' to group '%s' sent", sender, name)
+        return chat_pb2.SendMessageResponse(message="Message sent successfully", success=True, message_id=message_id)
+
+    #Server performance stats collected by the metrics interceptor
+    def GetStats(self, request, context):
+        methods = []
+        for name, stats in sorted(metrics.methods.items()):
+            methods.append(chat_pb2.MethodStats(
+                method=name,
+                count=stats.count,
+                errors=stats.errors,
+                mean_ms=stats.total / stats.count * 1000 if stats.count else 0.0,
+                p50_ms=stats.percentile(50) * 1000,
+                p95_ms=stats.percentile(95) * 1000,
+                p99_ms=stats.percentile(99) * 1000
+            ))
+        gauges = metrics.read_gauges()
+        users, stored, largest = storage.stats()
+        return chat_pb2.GetStatsResponse(
+            methods=methods,
+            in_flight=gauges["in_flight"],
+            active_streams=gauges["active_streams"],
+            executor_backlog=gauges.get("executor_backlog", 0),
+            users=users,
+            stored_messages=stored,
+            max_inbox_size=largest,
+            max_rss_bytes=gauges["max_rss_bytes"],
+            replication_followers=gauges.get("replication_followers", 0),
+            replication_lag_records=gauges.get("replication_lag_records", 0),
+            replication_staleness_ms=gauges.get("replication_staleness_ms", 0)
+        )
+
+    #Push delivery of new messages, replaces polling ReadNewMessages
+    def Subscribe(self, request, context):
+        username = request.username
+        watch = storage.watch(username) if username else None
+        if watch is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"No such user '{username}'")
+            return
+
+        # wake the waiting loop below when the client cancels or disconnects
+        def on_done():
+            with watch.changed:
+                watch.notify()
+        context.add_callback(on_done)
+
+        self.follow_groups(username, watch)
+        rpc_log.info("User '%s' subscribed", username)
+        try:
+            while context.is_active():
+                with watch.changed:
+                    while not watch.unread_count and not watch.group_mail and not watch.closed and context.is_active():
+                        watch.changed.wait()
+                    if watch.closed:
+                        break
+                    group_mail, watch.group_mail = watch.group_mail, False
+                selected, seq = storage.take_unread(username, 0)
+                if selected is None:
+                    break
+                commit_mutation(seq)
+                for m in selected:
+                    yield chat_pb2.SubscribeResponse(message=message_to_proto(m))
+                if group_mail:
+                    for message in self.take_group_mail(username, 0):
+                        yield chat_pb2.SubscribeResponse(message=message)
+        finally:
+            group_fanout.unsubscribe(username, watch)
+        rpc_log.info("Subscription for user '%s' ended", username)
+
+    #have the user's groups wake `watch`, and look once for group mail that came while they were away
+    def follow_groups(self, username, watch):
+        # registered before the groups are read, so a group joined in between is not missed
+        group_fanout.subscribe(username, watch)
+        for name in storage.groups_of(username):
+            group_fanout.joined(name, username)
+        with watch.changed:
+            watch.group_mail = True
+
+
+# ---------------------------
+# Calls between the workers of the multi-process mode (see partition.py),
+# accepted only with the secret the supervisor gave its workers.
+# ---------------------------
+class PartitionService(chat_pb2_grpc.PartitionServiceServicer):
+    def __init__(self, service):
+        self.service = service
+
+    def check_caller(self, context):
+        if partitions is None or not partitions.is_internal_call(context):
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Internal call")
+
+    #messages for this worker's users from a sender another worker has already checked
+    def Deliver(self, request, context):
+        self.check_caller(context)
+        results = []
+        last_seq = 0
+        for item in request.items:
+            response, seq = self.service.deliver(request.sender, item.to, item.content, request.timestamp_ms)
+            results.append(response)
+            last_seq = max(last_seq, seq)
+        commit_mutation(last_seq)
+        sent_count = sum(1 for r in results if r.success)
+        return chat_pb2.SendMessageBatchResponse(results=results, sent_count=sent_count, success=True)
+
+    def SearchAccounts(self, request, context):
+        self.check_caller(context)
+        matches, next_page_token = storage.search(request.pattern, request.page_size, request.page_token)
+        return chat_pb2.ListAccountsResponse(accounts=matches, next_page_token=next_page_token, success=True)
+
+    #a node joining the cluster: hand it the users it now owns
+    def Join(self, request, context):
+        self.check_caller(context)
+        if partitions.ring is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Not a cluster node")
+        if request.name in partitions.ring.names:
+            return chat_pb2.JoinResponse(handed_off=0)
+        return chat_pb2.JoinResponse(handed_off=hand_off_to(request.name, request.address))
+
+    #users moving here from another node
+    def Handoff(self, request, context):
+        self.check_caller(context)
+        seq = 0
+        for record in request.users:
+            data = {
+                "password": record.password_hash,
+                "read": [message_from_proto(m) for m in record.read],
+                "unread": [message_from_proto(m) for m in record.unread],
+                "sent": [dict(message_from_proto(m.message), to=m.to) for m in record.sent]
+            }
+            seq = max(seq, storage.restore_user(record.username, data))
+            next_message_id.advance(last_id_of(data))
+            for token in record.session_tokens:
+                sessions.adopt(token, record.username)
+        commit_mutation(seq)
+        rpc_log.info("Received %s users from another node", len(request.users))
+        return chat_pb2.HandoffResponse(accepted=len(request.users))
 
 
-# logic to start a server, initialization of the gRPC sever and conecting it to the specified address
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), server)
+# one join at a time on this node
+join_lock = threading.Lock()
+
+#move the users that a newly joined node owns under the new ring to it, then switch to that ring.
+#each batch leaves this node before it is sent, so calls for it are already routed to the new
+#node; if sending fails the batch is put back. Accounts the new node will own are not created
+#here meanwhile (see Partitioning.begin_create). Returns how many users moved.
+def hand_off_to(name, address):
+    with join_lock:
+        ring, index = partitions.begin_join(name, address)
+        try:
+            moved = hand_off_users(ring, index)
+        except BaseException:
+            partitions.abort_join()
+            raise
+        partitions.finish_join(ring)
+        save_membership()
+        logging.info("Node '%s' joined at %s; handed off %s users", name, address, moved)
+        return moved
+
+#send the users `index` owns under `ring` over in batches; returns how many
+def hand_off_users(ring, index):
+    moving = [username for username in storage.usernames() if ring.owner(username) == index]
+    for start in range(0, len(moving), HANDOFF_BATCH):
+        exported = {}
+        seq = 0
+        for username in moving[start:start + HANDOFF_BATCH]:
+            data, user_seq = storage.take_user(username)
+            if data is None:
+                continue
+            exported[username] = data
+            seq = max(seq, user_seq)
+            partitions.moved[username] = index
+        commit_mutation(seq)
+        tokens = sessions.take_users(exported)
+        # archived history travels as the oldest read messages; the new node's sweeper archives it again
+        archived = {username: archive.take_all(username) for username in exported} if archive is not None else {}
+        records = [
+            chat_pb2.UserRecord(
+                username=username,
+                password_hash=data["password"],
+                read=[message_to_proto(m) for m in archived.get(username, ())] + [dumped_message_to_proto(m) for m in data["read"]],
+                unread=[dumped_message_to_proto(m) for m in data["unread"]],
+                session_tokens=tokens.get(username, []),
+                sent=[chat_pb2.SentMessage(to=m["to"], message=dumped_message_to_proto(m)) for m in data["sent"]]
+            )
+            for username, data in exported.items()
+        ]
+        try:
+            partitions.internal_stub(index).Handoff(
+                chat_pb2.HandoffRequest(users=records), metadata=partitions.internal_metadata(), wait_for_ready=True, timeout=60)
+        except grpc.RpcError:
+            restore_users(exported, tokens)
+            raise
+        for username in archived:
+            archive.drop(username)
+    return len(moving)
+
+#take back users whose handoff failed
+def restore_users(exported, tokens):
+    seq = 0
+    for username, data in exported.items():
+        seq = max(seq, storage.restore_user(username, data))
+        partitions.moved.pop(username, None)
+        for token in tokens.get(username, []):
+            sessions.adopt(token, username)
+    commit_mutation(seq)
+
+
+metrics.gauge("dedup_hits", lambda: sent_requests.hits)
+# storage-side gauges, computed only when stats are read
+metrics.gauge("users", lambda: len(storage))
+metrics.gauge("stored_messages", lambda: storage.stats()[1])
+metrics.gauge("max_inbox_size", lambda: storage.stats()[2])
+
+# ---------------------------
+# Running state of one SendMessageStream call, shared by both server modes.
+# Senders are looked up once per stream and the timestamp is refreshed once
+# per STREAM_CHUNK messages rather than per message.
+# ---------------------------
+STREAM_CHUNK = 256
+
+class StreamedSends:
+    def __init__(self, service):
+        self.service = service
+        self.senders = {}
+        self.sent_count = 0
+        self.failed_count = 0
+        self.last_seq = 0
+        self.timestamp_ms = 0
+
+    def add(self, request):
+        if (self.sent_count + self.failed_count) % STREAM_CHUNK == 0:
+            self.timestamp_ms = int(time.time() * 1000)
+        from_user = request.sender
+        if from_user not in self.senders:
+            self.senders[from_user] = bool(from_user) and storage.exists(from_user)
+        if not self.senders[from_user]:
+            self.failed_count += 1
+            return
+        seq = 0
+
+        def send():
+            nonlocal seq
+            response, seq = self.service.deliver(from_user, request.to, request.content, self.timestamp_ms)
+            return response
+        if request.request_id and len(request.request_id) <= MAX_REQUEST_ID_LENGTH:
+            # a retried stream does not deliver its messages twice (a repeat leaves seq at 0)
+            response = sent_requests.run((from_user, request.request_id), send)
+        else:
+            response = send()
+        if response.success:
+            self.sent_count += 1
+            self.last_seq = max(self.last_seq, seq)
+        else:
+            self.failed_count += 1
+
+    def summary(self):
+        rpc_log.info("Message stream closed: %s sent, %s failed", self.sent_count, self.failed_count)
+        return chat_pb2.SendMessageStreamResponse(sent_count=self.sent_count, failed_count=self.failed_count, success=True)
+
+
+# ---------------------------
+# asyncio flavour of ChatService for grpc.aio.
+# Unary handlers run the ChatService code inline on the event loop (the shard
+# and inbox locks are only ever held briefly); the one blocking step, waiting
+# for the write-ahead log to fsync, is deferred and awaited off the loop.
+# With the SQLite backend every storage call reads or writes the database
+# file, so handlers and the storage calls of the streams run on the executor.
+# Subscribe waits on an asyncio.Event registered as an inbox listener, so an
+# idle stream costs no thread.
+# ---------------------------
+class AsyncChatService(chat_pb2_grpc.ChatServiceServicer):
+    def __init__(self):
+        self.service = ChatService()
+
+    async def run(self, handler, request, context):
+        if isinstance(storage, SQLiteStorage):
+            return await self.run_in_thread(handler, request, context)
+        pending = []
+        token = deferred_commits.set(pending)
+        try:
+            response = handler(self.service, request, context)
+        finally:
+            deferred_commits.reset(token)
+        if pending:
+            await commit_mutation_async(max(pending))
+        return response
+
+    #for handlers that spend CPU time hashing passwords or do file IO: run them on the default executor instead of the loop
+    async def run_in_thread(self, handler, request, context):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, handler, self.service, request, context)
+
+    #`function(*args)` when it only touches memory, else (SQLite backend) on the default executor
+    async def run_storage(self, function, *args):
+        if isinstance(storage, SQLiteStorage):
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+        return function(*args)
+
+    async def CreateAccount(self, request, context):
+        return await self.run_in_thread(ChatService.CreateAccount, request, context)
+
+    async def Login(self, request, context):
+        return await self.run_in_thread(ChatService.Login, request, context)
+
+    async def Logout(self, request, context):
+        return await self.run(ChatService.Logout, request, context)
+
+    async def ListAccounts(self, request, context):
+        return await self.run(ChatService.ListAccounts, request, context)
+
+    async def SendMessage(self, request, context):
+        return await self.run(ChatService.SendMessage, request, context)
+
+    async def SendMessageBatch(self, request, context):
+        return await self.run(ChatService.SendMessageBatch, request, context)
+
+    async def SendMessageStream(self, request_iterator, context):
+        batch = StreamedSends(self.service)
+        async for request in request_iterator:
+            await self.run_storage(batch.add, request)
+        await commit_mutation_async(batch.last_seq)
+        return batch.summary()
+
+    async def ReadNewMessages(self, request, context):
+        return await self.run(ChatService.ReadNewMessages, request, context)
+
+    async def GetStats(self, request, context):
+        return await self.run(ChatService.GetStats, request, context)
+
+    async def DeleteMessages(self, request, context):
+        return await self.run(ChatService.DeleteMessages, request, context)
+
+    async def DeleteAccount(self, request, context):
+        return await self.run(ChatService.DeleteAccount, request, context)
+
+    async def ListMessages(self, request, context):
+        # archived pages are read from disk, so off the loop
+        if request.archived:
+            return await self.run_in_thread(ChatService.ListMessages, request, context)
+        return await self.run(ChatService.ListMessages, request, context)
+
+    async def SearchMessages(self, request, context):
+        return await self.run(ChatService.SearchMessages, request, context)
+
+    async def ConversationHistory(self, request, context):
+        return await self.run(ChatService.ConversationHistory, request, context)
+
+    async def CreateGroup(self, request, context):
+        return await self.run(ChatService.CreateGroup, request, context)
+
+    async def JoinGroup(self, request, context):
+        return await self.run(ChatService.JoinGroup, request, context)
+
+    async def SendGroupMessage(self, request, context):
+        return await self.run(ChatService.SendGroupMessage, request, context)
+
+    async def Subscribe(self, request, context):
+        username = request.username
+        watch = await self.run_storage(storage.watch, username) if username else None
+        if watch is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"No such user '{username}'")
+            return
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(wakeup.set)
+        watch.listeners.add(listener)
+        await self.run_storage(self.service.follow_groups, username, watch)
+        rpc_log.info("User '%s' subscribed (async)", username)
+        try:
+            while True:
+                # cleared before checking the inbox, so a notify in between is not lost
+                wakeup.clear()
+                if watch.closed:
+                    break
+                selected, seq = await self.run_storage(storage.take_unread, username, 0)
+                if selected is None:
+                    break
+                await commit_mutation_async(seq)
+                for m in selected:
+                    yield chat_pb2.SubscribeResponse(message=message_to_proto(m))
+                taken = []
+                if watch.group_mail:
+                    watch.group_mail = False
+                    taken, seq = await self.run_storage(storage.take_group_unread, username, 0)
+                    await commit_mutation_async(seq)
+                    for group, m in taken:
+                        yield chat_pb2.SubscribeResponse(message=message_to_proto(m, group))
+                if not selected and not taken:
+                    await wakeup.wait()
+        finally:
+            watch.listeners.discard(listener)
+            group_fanout.unsubscribe(username, watch)
+            rpc_log.info("Subscription for user '%s' ended", username)
+
+
+#switch `storage` to the configured backend, shared by both server modes
+def open_storage():
+    global storage
+    backend = STORAGE.get("backend", "memory")
+    if backend not in STORAGE_BACKENDS:
+        raise SystemExit(f"storage backend must be one of {STORAGE_BACKENDS}, got '{backend}'")
+    if backend != "sqlite":
+        return
+    data_dir = data_directory()
+    os.makedirs(data_dir, exist_ok=True)
+    storage = SQLiteStorage(
+        os.path.join(data_dir, STORAGE.get("sqlite_file", "chat.db")),
+        lambda: next_message_id(),
+        synchronous=STORAGE.get("synchronous", "NORMAL"),
+        cache_kib=STORAGE.get("cache_kib", 16384),
+        group_history=groups.max_history
+    )
+    next_message_id.advance(storage.last_message_id())
+    print(f"Opened {len(storage)} accounts from {storage.path}")
+
+def close_storage():
+    storage.close()
+
+#open the write-ahead log and replay it into users_db (memory backend only; SQLite is its own log)
+def open_persistence():
+    global wal, next_message_id
+    # a follower's state comes from the primary's log
+    if not PERSISTENCE.get("enabled", False) or not isinstance(storage, MemoryStorage) or REPLICATION_ROLE == "follower":
+        return
+    wal = WriteAheadLog(
+        data_directory(),
+        fsync=PERSISTENCE.get("fsync", "batch"),
+        fsync_interval_ms=PERSISTENCE.get("fsync_interval_ms", 10),
+        snapshot_interval_s=PERSISTENCE.get("snapshot_interval_s", 60),
+        group_history=groups.max_history
+    )
+    wal.recover(users_db, groups)
+    next_message_id = message_ids(wal.last_message_id)
+    wal.start()
+    print(f"Recovered {len(users_db)} accounts from {wal.data_dir}")
+
+def close_persistence():
+    if wal is not None:
+        wal.close()
+
+#this process's data directory (one per worker in the multi-process mode)
+def data_directory():
+    data_dir = PERSISTENCE.get("data_dir", "data")
+    if SERVER_MODE == "multiprocess":
+        data_dir = os.path.join(data_dir, f"partition{partitions.index}")
+    return data_dir
+
+#start the retention sweeper if any limit is configured (after open_persistence, so evictions are logged)
+def open_retention():
+    global archive, sweeper
+    # a follower applies the primary's evictions
+    if not retention_policy.enabled or REPLICATION_ROLE == "follower":
+        return
+    if RETENTION.get("archive", False):
+        archive = MessageArchive(os.path.join(data_directory(), "archive"))
+    sweeper = RetentionSweeper(storage, retention_policy, archive, commit_mutation,
+                               interval_s=RETENTION.get("sweep_interval_s", 60), batch=RETENTION.get("sweep_batch", 100))
+    metrics.gauge("evicted_messages", lambda: sweeper.evicted)
+    sweeper.start()
+
+def close_retention():
+    if sweeper is not None:
+        sweeper.stop()
+
+#primary: publish the log to followers; follower: start following the primary (after open_persistence)
+def open_replication():
+    global replication_feed, replica
+    if REPLICATION_ROLE not in REPLICATION_ROLES:
+        raise SystemExit(f"replication role must be one of {REPLICATION_ROLES[1:]}, got '{REPLICATION_ROLE}'")
+    if not REPLICATION_ROLE:
+        return
+    if SERVER_MODE != "threads":
+        raise SystemExit("replication needs server_mode \"threads\"")
+    if not REPLICATION.get("secret"):
+        raise SystemExit("replication needs a \"secret\" shared by the primary and its followers")
+    if REPLICATION_ROLE == "primary":
+        if wal is None:
+            raise SystemExit("a replication primary needs the memory backend with persistence enabled")
+        replication_feed = ReplicationFeed(REPLICATION.get("backlog", DEFAULT_BACKLOG))
+        wal.feed = replication_feed
+        metrics.gauge("replication_followers", lambda: len(replication_feed.followers))
+        metrics.gauge("replication_lag_records", replication_feed.max_lag)
+        return
+    if not isinstance(storage, MemoryStorage):
+        raise SystemExit("a replication follower needs the memory backend")
+    replica = Replica(REPLICATION["primary"], REPLICATION["secret"], REPLICATION.get("name") or f"{HOST}:{PORT}",
+                      users_db, groups, max_staleness_ms=REPLICATION.get("max_staleness_ms", 0))
+    metrics.gauge("replication_lag_records", replica.lag)
+    metrics.gauge("replication_staleness_ms", replica.staleness_ms)
+    metrics.gauge("replication_resets", lambda: replica.resets)
+    replica.start()
+    print(f"Following {replica.primary}")
+
+def close_replication():
+    if replica is not None:
+        replica.stop()
+
+#optional Prometheus text endpoint on a local port
+def open_metrics_http():
+    global metrics_http
+    port = METRICS.get("http_port")
+    if port and SERVER_MODE == "multiprocess":
+        port += partitions.index
+    if port:
+        metrics_http = metrics.start_http(port, METRICS.get("http_host", "127.0.0.1"))
+        print(f"Metrics on http://{METRICS.get('http_host', '127.0.0.1')}:{port}/metrics")
+
+def close_metrics_http():
+    if metrics_http is not None:
+        metrics_http.shutdown()
+
+def open_logging():
+    global log_listener
+    name = "chat_server" if partitions is None else f"chat_server_p{partitions.index}"
+    log_listener = start_logging(LOGGING, name=name)
+
+#SIGUSR1 / SIGUSR2 start and stop a profiling window (not on platforms without them)
+def open_profiling():
+    global profiler
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    methods = chat_pb2.DESCRIPTOR.services_by_name["ChatService"].methods_by_name
+    profiler = Profiler(
+        handler_codes(methods, ChatService, AsyncChatService),
+        name="profile" if partitions is None else f"profile_p{partitions.index}",
+        interval_ms=PROFILING.get("interval_ms", DEFAULT_INTERVAL_MS),
+        duration_s=PROFILING.get("duration_s", DEFAULT_DURATION_S)
+    )
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.stop(wait=False))
+
+#writes out a window that is still open
+def close_profiling():
+    if profiler is not None and profiler.running:
+        profiler.stop()
+
+#flushes whatever is still queued to the log file
+def close_logging():
+    if log_listener is not None:
+        log_listener.stop()
+
+#lets SIGTERM (e.g. from the supervisor) take the same clean shutdown path as Ctrl+C
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+#the thread-pool server runs at most MAX_WORKERS calls, so a concurrency cap at or above it never trips.
+#open streams hold workers too, and must leave some for the calls the cap counts
+def check_thread_budget():
+    if rate_limiter.max_concurrent >= MAX_WORKERS:
+        raise SystemExit(f"rate_limits.max_concurrent ({rate_limiter.max_concurrent}) must be below "
+                         f"max_workers ({MAX_WORKERS}) to turn calls away")
+    if rate_limiter.max_streams + rate_limiter.max_concurrent >= MAX_WORKERS:
+        raise SystemExit(f"rate_limits.max_streams ({rate_limiter.max_streams}) must be below max_workers "
+                         f"({MAX_WORKERS}) less max_concurrent ({rate_limiter.max_concurrent})")
+
+# logic to start a server, initialization of the gRPC sever and conecting it to the specified address.
+# `internal_address` is a multi-process worker's private port
+def serve(internal_address=None):
+    check_thread_budget()
+    open_logging()
+    open_storage()
+    open_persistence()
+    open_replication()
+    open_retention()
+    open_metrics_http()
+    open_profiling()
+
+    executor = futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    # RPCs accepted by gRPC but still waiting for a free worker (reads a private queue, stats only)
+    metrics.gauge("executor_backlog", lambda: executor._work_queue.qsize())
+    interceptors = [MetricsInterceptor(metrics), RateLimitInterceptor(rate_limiter, sessions, partitions), AuthInterceptor(sessions)]
+    if partitions is not None:
+        # routing goes before rate limits and authentication: the session lives on the owning worker
+        interceptors.insert(1, RoutingInterceptor(partitions))
+    if replica is not None:
+        interceptors.insert(1, FollowerInterceptor(replica))
+    # all workers of the multi-process mode share the public port
+    server = grpc.server(executor, interceptors=interceptors, options=SERVER_OPTIONS + [("grpc.so_reuseport", 1)])
+    service = ChatService()
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
     bind_address = f"{HOST}:{PORT}"
     server.add_insecure_port(bind_address)
+    if partitions is not None:
+        chat_pb2_grpc.add_PartitionServiceServicer_to_server(PartitionService(service), server)
+    if replication_feed is not None:
+        chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationService(
+            wal, replication_feed, REPLICATION["secret"], REPLICATION.get("heartbeat_ms", DEFAULT_HEARTBEAT_MS)), server)
+    if internal_address is not None:
+        server.add_insecure_port(internal_address)
     server.start()
     print(f"Server started on {bind_address}")
-    logging.info(f"Server listening on {bind_address}")
+    logging.info("Server listening on %s", bind_address)
 
     #Infinite loop to keep the server running, with keyboard interrupt exceptions
     try:
-        while True:
-            time.sleep(86400)
+        if partitions is None:
+            while True:
+                time.sleep(86400)
+        elif internal_address is None:
+            # cluster node
+            while True:
+                time.sleep(86400)
+        else:
+            # a worker exits with its supervisor
+            supervisor = os.getppid()
+            while os.getppid() == supervisor:
+                time.sleep(1)
     except KeyboardInterrupt:
         print("Shutting down server")
         logging.info("Server shutting down (KeyboardInterrupt).")
+    finally:
         server.stop(0)
+        if partitions is not None:
+            partitions.close()
+        close_replication()
+        close_profiling()
+        close_metrics_http()
+        close_retention()
+        close_persistence()
+        close_storage()
+        close_logging()
 
-#entryway into the main application, starting the server
-if __name__ == '__main__':
+#worker process of the multi-process mode: serve the users of one partition
+#each worker also listens on its own port (worker_base_port + index) on the public host: other
+#workers call it there, and Subscribe clients are sent there (partition.OWNER_HEADER)
+def serve_worker(index, count, secret):
+    global partitions, next_message_id
+    ports = [WORKER_BASE_PORT + i for i in range(count)]
+    worker_host = "127.0.0.1" if HOST in ("0.0.0.0", "::", "[::]") else HOST
+    partitions = Partitioning(index, [f"{worker_host}:{port}" for port in ports], secret,
+                              client_addresses=[f":{port}" for port in ports])
+    next_message_id = message_ids()
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    serve(internal_address=f"{HOST}:{ports[index]}")
+
+#cluster membership: the nodes recorded in the data directory (joins seen earlier), then any
+#others from config.json, as [{"name": ..., "address": ...}] in join order
+def load_membership():
+    nodes = []
+    path = os.path.join(PERSISTENCE.get("data_dir", "data"), "cluster.json")
+    if PERSISTENCE.get("enabled", False) and os.path.exists(path):
+        with open(path) as f:
+            nodes = json.load(f)["nodes"]
+    known = {node["name"] for node in nodes}
+    nodes.extend(node for node in CLUSTER.get("nodes", []) if node["name"] not in known)
+    return nodes
+
+def save_membership():
+    if not PERSISTENCE.get("enabled", False):
+        return
+    data_dir = PERSISTENCE.get("data_dir", "data")
+    os.makedirs(data_dir, exist_ok=True)
+    nodes = [{"name": name, "address": address} for name, address in zip(partitions.ring.names, partitions.addresses)]
+    with open(os.path.join(data_dir, "cluster.json.tmp"), "w") as f:
+        json.dump({"nodes": nodes}, f)
+    os.replace(os.path.join(data_dir, "cluster.json.tmp"), os.path.join(data_dir, "cluster.json"))
+
+#register with every peer, which hands over the users this node owns; peers that already know it do nothing.
+#accounts this node owns are created only afterwards (see Partitioning.begin_own_join)
+def join_cluster():
+    me = partitions.ring.names[partitions.index]
+    for index, name in enumerate(partitions.ring.names):
+        if index == partitions.index:
+            continue
+        try:
+            response = partitions.internal_stub(index).Join(
+                chat_pb2.JoinRequest(name=me, address=partitions.addresses[partitions.index]),
+                metadata=partitions.internal_metadata(), wait_for_ready=True, timeout=CLUSTER.get("join_timeout_s", 60))
+            logging.info("Joined node '%s', received %s users", name, response.handed_off)
+        except grpc.RpcError as e:
+            logging.warning("Could not join node '%s': %s", name, e.code().name)
+    partitions.finish_join(partitions.ring)
+
+#one node of a consistent-hash cluster (server_mode "cluster")
+def serve_cluster():
+    global partitions, next_message_id
+    nodes = load_membership()
+    names = [node["name"] for node in nodes]
+    partitions = Partitioning(
+        names.index(CLUSTER["self"]),
+        [node["address"] for node in nodes],
+        CLUSTER.get("secret", ""),
+        ring=HashRing(names, CLUSTER.get("virtual_nodes", 128)),
+        id_step=MAX_CLUSTER_NODES
+    )
+    next_message_id = message_ids()
+    save_membership()
+    partitions.begin_own_join()
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    # peers answer once this node's server is up (all calls wait for readiness)
+    threading.Thread(target=join_cluster, daemon=True).start()
     serve()
+
+#the data directory's partitions only fit the worker count they were written with
+def check_partition_layout(count):
+    if not PERSISTENCE.get("enabled", False):
+        return
+    data_dir = PERSISTENCE.get("data_dir", "data")
+    os.makedirs(data_dir, exist_ok=True)
+    layout_path = os.path.join(data_dir, "partitions.json")
+    if os.path.exists(layout_path):
+        with open(layout_path) as f:
+            written = json.load(f)["workers"]
+        if written != count:
+            raise SystemExit(f"{data_dir} holds data for {written} workers, not {count}; "
+                             "set \"workers\" back or start from an empty data directory")
+        return
+    with open(layout_path, "w") as f:
+        json.dump({"workers": count}, f)
+
+#supervisor of the multi-process mode: starts one worker per partition and restarts any that die
+def serve_multiprocess():
+    count = max(1, WORKERS)
+    check_thread_budget()
+    check_partition_layout(count)
+    # workers accept internal calls only from each other
+    env = dict(os.environ, CHAT_PARTITION_SECRET=secrets.token_hex(16))
+
+    def start(index):
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", str(index), str(count)], env=env)
+
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    workers = [start(i) for i in range(count)]
+    # profiling signals sent to the supervisor reach every worker
+    if hasattr(signal, "SIGUSR1"):
+        def forward(signum, frame):
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.send_signal(signum)
+        signal.signal(signal.SIGUSR1, forward)
+        signal.signal(signal.SIGUSR2, forward)
+    print(f"Supervisor started {count} workers on {HOST}:{PORT} (internal ports {WORKER_BASE_PORT}-{WORKER_BASE_PORT + count - 1})")
+    try:
+        while True:
+            time.sleep(1)
+            for i, worker in enumerate(workers):
+                if worker.poll() is not None:
+                    print(f"Worker {i} exited with {worker.returncode}, restarting")
+                    workers[i] = start(i)
+    except KeyboardInterrupt:
+        print("Shutting down workers")
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+# event-loop server: one process can hold many mostly-idle sessions without a thread each
+async def serve_async():
+    open_logging()
+    open_storage()
+    open_persistence()
+    open_replication()
+    open_retention()
+    open_metrics_http()
+    open_profiling()
+
+    interceptors = [AsyncMetricsInterceptor(metrics), AsyncRateLimitInterceptor(rate_limiter, sessions), AsyncAuthInterceptor(sessions)]
+    server = grpc.aio.server(interceptors=interceptors, options=SERVER_OPTIONS)
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncChatService(), server)
+    bind_address = f"{HOST}:{PORT}"
+    server.add_insecure_port(bind_address)
+    await server.start()
+    print(f"Server started on {bind_address} (asyncio)")
+    logging.info("Server listening on %s (asyncio)", bind_address)
+
+    try:
+        await server.wait_for_termination()
+    finally:
+        logging.info("Server shutting down.")
+        await server.stop(0)
+        close_profiling()
+        close_metrics_http()
+        close_retention()
+        close_persistence()
+        close_storage()
+        close_logging()
+
+#entryway into the main application, starting the server in the configured mode
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        serve_worker(int(sys.argv[2]), int(sys.argv[3]), os.environ["CHAT_PARTITION_SECRET"])
+    elif SERVER_MODE == "multiprocess":
+        serve_multiprocess()
+    elif SERVER_MODE == "cluster":
+        serve_cluster()
+    elif SERVER_MODE == "asyncio":
+        try:
+            asyncio.run(serve_async())
+        except KeyboardInterrupt:
+            print("Shutting down server")
+    else:
+        serve()
@@ -0,0 +1,871 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from inbox import InboxSignals, Message
+from persistence import new_user, dump_user, load_user, keep_sent
+from account_index import AccountIndex
+from message_index import words
+from groups import GroupStore, UnknownGroup, NotAMember, DEFAULT_MAX_HISTORY
+
+# ---------------------------
+# Storage backends behind ChatService.
+# The handlers reach accounts and messages only through these methods, so the
+# backend is a config.json choice ("storage": {"backend": ...}):
+#   "memory" - MemoryStorage: the lock-striped UserStore of Inbox records (see
+#              store.py, inbox.py), made durable by the write-ahead log
+#   "sqlite" - SQLiteStorage: one SQLite database in WAL mode. Messages live on
+#              disk and only SQLite's bounded page cache (plus the account name
+#              index) is held in memory, so the data can outgrow RAM
+# Mutating methods return the write-ahead log seq of their record (0 when
+# nothing was logged) for the caller to commit once it holds no lock; SQLite
+# commits its own transactions, so it always returns 0.
+# Message ids come from the server's allocator (`next_id`), called while the
+# recipient's messages are locked so ids increase in arrival order.
+# `watch(username)` returns what a Subscribe stream waits on: an InboxSignals
+# (`changed`, `listeners`, `closed`, `notify()`) that also has `unread_count`.
+# For the memory backend that is the user's Inbox itself.
+# Group channels (see groups.py) are kept by the same backend as the users:
+# a GroupStore next to users_db, or three more SQLite tables.
+# ---------------------------
+SQLITE_SYNCHRONOUS = ("OFF", "NORMAL", "FULL")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    read INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_by_inbox ON messages (recipient, read, id);
+CREATE INDEX IF NOT EXISTS messages_by_sender ON messages (recipient, sender, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_words USING fts5(
+    recipient, content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 0'
+);
+CREATE TRIGGER IF NOT EXISTS message_words_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO message_words (rowid, recipient, content) VALUES (new.id, new.recipient, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS message_words_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO message_words (message_words, rowid, recipient, content) VALUES ('delete', old.id, old.recipient, old.content);
+END;
+CREATE TABLE IF NOT EXISTS chat_groups (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    last_id INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS group_members (
+    username TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cursor INTEGER NOT NULL,
+    PRIMARY KEY (username, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS group_messages (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS group_messages_by_group ON group_messages (name, id);
+CREATE TABLE IF NOT EXISTS sent_messages (
+    id INTEGER PRIMARY KEY,
+    sender TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sent_messages_by_conversation ON sent_messages (sender, recipient, id);
+"""
+# larger than any message id: the open end of a search's id range
+NO_BEFORE_ID = 2 ** 63 - 1
+# one side of a conversation page from each table, each walking its (user, peer, id) index for at
+# most ?5 rows between the ids ?3 and ?4 (exclusive), merged; {order} is ASC or DESC
+SQLITE_CONVERSATION = (
+    "SELECT id, sender, content, timestamp FROM ("
+    "SELECT * FROM (SELECT id, sender, content, timestamp FROM messages WHERE recipient = ?1 AND sender = ?2"
+    " AND id > ?3 AND id < ?4 ORDER BY id {order} LIMIT ?5)"
+    " UNION ALL "
+    "SELECT * FROM (SELECT id, sender, content, timestamp FROM sent_messages WHERE sender = ?1 AND recipient = ?2"
+    " AND id > ?3 AND id < ?4 ORDER BY id {order} LIMIT ?5)"
+    ") ORDER BY id {order} LIMIT ?5")
+
+
+#an FTS5 query for messages to `username` holding all of `query_words`; each part is a quoted
+#string, so nothing the user typed is read as query syntax
+def fts_query(username, query_words):
+    def quoted(text):
+        return '"' + text.replace('"', '""') + '"'
+    parts = [f"content : {quoted(word)}" for word in sorted(query_words)]
+    # the recipient's name as a phrase narrows the match to their messages; the join checks it exactly
+    if words(username):
+        parts.append(f"recipient : {quoted(username)}")
+    return " AND ".join(parts)
+
+
+class UnknownUser(LookupError):
+    pass
+
+
+class UnknownSender(UnknownUser):
+    pass
+
+
+class UnknownRecipient(UnknownUser):
+    pass
+
+
+class MemoryStorage:
+    #`log_mutation` is the server's write-ahead log hook, called under the lock that ordered the change
+    def __init__(self, users, log_mutation, next_id, groups=None):
+        self.users = users
+        self.log_mutation = log_mutation
+        self.next_id = next_id
+        self.groups = GroupStore() if groups is None else groups
+
+    def __len__(self):
+        return len(self.users)
+
+    def usernames(self):
+        return self.users.keys()
+
+    def search(self, pattern, page_size, page_token):
+        return self.users.index.search(pattern, page_size, page_token)
+
+    def exists(self, username):
+        return username in self.users
+
+    #(created, seq); False when the name is taken
+    def create_account(self, username, password_hash):
+        with self.users.shard_lock(username):
+            if not self.users.add(username, new_user(password_hash)):
+                return False, 0
+            return True, self.log_mutation({"op": "create", "user": username, "password": password_hash})
+
+    #the stored password hash, None for an unknown user
+    def password(self, username):
+        user = self.users.get(username)
+        return None if user is None else user["password"]
+
+    def unread_count(self, username):
+        user = self.users.get(username)
+        return None if user is None else user["inbox"].unread_count
+
+    def watch(self, username):
+        user = self.users.get(username)
+        return None if user is None else user["inbox"]
+
+    #store one message, returns (message id, seq). With `check_sender` the sender
+    #must exist too; both shard locks (in shard order) keep either account from vanishing mid-send
+    def append(self, from_user, to_user, content, timestamp_ms, check_sender=False):
+        with self.users.locked(from_user, to_user) if check_sender else self.users.shard_lock(to_user):
+            if check_sender and from_user not in self.users:
+                raise UnknownSender(from_user)
+            recipient = self.users.get(to_user)
+            if recipient is None:
+                raise UnknownRecipient(to_user)
+            inbox = recipient["inbox"]
+            with inbox.changed:
+                message_id = self.next_id()
+                message = Message(message_id, from_user, content, timestamp_ms)
+                inbox.append(message)
+                record = {"op": "send", "id": message_id, "from": from_user, "to": to_user, "content": content, "timestamp": timestamp_ms}
+                seq = self.log_mutation(record)
+                # wakes only this recipient's Subscribe streams
+                inbox.notify()
+        # the sender's copy, once no lock is held (finding the sender takes their shard lock); replaying
+        # the record makes it too
+        keep_sent(self.users, record, message)
+        return message_id, seq
+
+    #keep the sender's copy of a message another worker stored for its recipient, returns the seq
+    def append_sent(self, from_user, to_user, message_id, content, timestamp_ms):
+        user = self.users.get(from_user)
+        if user is None:
+            return 0
+        inbox = user["inbox"]
+        with inbox.changed:
+            if inbox.closed:
+                return 0
+            inbox.add_sent(to_user, Message(message_id, from_user, content, timestamp_ms))
+            return self.log_mutation({"op": "sent", "user": from_user, "to": to_user, "id": message_id, "content": content, "timestamp": timestamp_ms})
+
+    #messages from one sender to several (to_user, content) recipients; returns
+    #(message id or None for an unknown recipient, per item) and the last seq
+    def append_batch(self, from_user, items, timestamp_ms):
+        message_ids = []
+        last_seq = 0
+        for to_user, content in items:
+            try:
+                message_id, seq = self.append(from_user, to_user, content, timestamp_ms)
+            except UnknownRecipient:
+                message_id, seq = None, 0
+            message_ids.append(message_id)
+            last_seq = max(last_seq, seq)
+        return message_ids, last_seq
+
+    #mark up to `count` oldest unread messages read (all if count <= 0); (messages, seq), messages None for an unknown user
+    def take_unread(self, username, count):
+        user = self.users.get(username)
+        if user is None:
+            return None, 0
+        inbox = user["inbox"]
+        with inbox.changed:
+            # the account was deleted after we looked it up
+            if inbox.closed:
+                return None, 0
+            selected = inbox.take_unread(count)
+            seq = self.log_mutation({"op": "read", "user": username, "count": len(selected)}) if selected else 0
+        return selected, seq
+
+    #the newest page of read messages below `before_id`, in arrival order, as (messages, before_id for
+    #the next older page or 0); None for an unknown user
+    def read_page(self, username, before_id, page_size):
+        user = self.users.get(username)
+        if user is None:
+            return None
+        inbox = user["inbox"]
+        with inbox.changed:
+            messages, more = inbox.read_page(before_id, page_size)
+        return messages, messages[0].id if more else 0
+
+    #a page of the user's messages matching a search (see MessageIndex.search), None for an unknown user
+    def search_messages(self, username, query_words, sender, since_ms, until_ms, before_id, page_size):
+        user = self.users.get(username)
+        if user is None:
+            return None
+        inbox = user["inbox"]
+        with inbox.changed:
+            return inbox.search_index().search(query_words, sender, since_ms, until_ms, before_id, page_size)
+
+    #a page of the conversation between the user and `peer` (see ConversationIndex.page), None for an unknown user
+    def conversation(self, username, peer, before_id, after_id, limit):
+        user = self.users.get(username)
+        if user is None:
+            return None
+        inbox = user["inbox"]
+        with inbox.changed:
+            return inbox.conversation_index().page(peer, before_id, after_id, limit)
+
+    #which of `ids` are still stored for the user (read or not)
+    def stored_ids(self, username, ids):
+        user = self.users.get(username)
+        if user is None:
+            return set()
+        inbox = user["inbox"]
+        with inbox.changed:
+            return {i for i in ids if i in inbox.read or i in inbox.unread_ids}
+
+    #delete by id, returns (ids actually deleted, seq); None for an unknown user
+    def delete_ids(self, username, ids):
+        user = self.users.get(username)
+        if user is None:
+            return None, 0
+        inbox = user["inbox"]
+        with inbox.changed:
+            if inbox.closed:
+                return None, 0
+            deleted = [i for i in dict.fromkeys(ids) if i in inbox.read or i in inbox.unread_ids or i in inbox.sent]
+            inbox.delete_ids(deleted)
+            seq = self.log_mutation({"op": "delete", "user": username, "ids": deleted}) if deleted else 0
+        return deleted, seq
+
+    #(done, seq); False for an unknown user
+    def delete_all(self, username):
+        user = self.users.get(username)
+        if user is None:
+            return False, 0
+        inbox = user["inbox"]
+        with inbox.changed:
+            if inbox.closed:
+                return False, 0
+            inbox.clear()
+            return True, self.log_mutation({"op": "delete_all", "user": username})
+
+    #(done, seq); False for an unknown user
+    def drop_account(self, username):
+        with self.users.shard_lock(username):
+            user = self.users.pop(username, None)
+            if user is None:
+                return False, 0
+            # closing under the inbox lock makes in-flight reads/deletes on this inbox fail cleanly
+            user["inbox"].close()
+            self.groups.forget_user(username)
+            return True, self.log_mutation({"op": "drop", "user": username})
+
+    #the user in dumped form (see persistence.dump_user), None for an unknown user
+    def export_user(self, username):
+        user = self.users.get(username)
+        if user is None:
+            return None
+        with user["inbox"].changed:
+            return dump_user(user)
+
+    #remove a user and return (dumped form, seq), for handing them to another node
+    def take_user(self, username):
+        with self.users.shard_lock(username):
+            user = self.users.pop(username, None)
+            if user is None:
+                return None, 0
+            inbox = user["inbox"]
+            with inbox.changed:
+                data = dump_user(user)
+            # ends this node's Subscribe streams for the user
+            inbox.close()
+            return data, self.log_mutation({"op": "drop", "user": username})
+
+    #store a whole dumped user (received from another node, or a failed handoff), returns the seq
+    def restore_user(self, username, data):
+        with self.users.shard_lock(username):
+            self.users[username] = load_user(data)
+            return self.log_mutation(dict(data, op="restore", user=username))
+
+    #read messages the retention policy would evict now
+    def expired(self, username, policy, now_ms):
+        user = self.users.get(username)
+        if user is None:
+            return []
+        inbox = user["inbox"]
+        with inbox.changed:
+            return [] if inbox.closed else policy.select(inbox, now_ms)
+
+    #remove evicted messages that are still read and stored, returns (ids evicted, seq)
+    def evict(self, username, ids):
+        user = self.users.get(username)
+        if user is None:
+            return [], 0
+        inbox = user["inbox"]
+        with inbox.changed:
+            evicted = [] if inbox.closed else [i for i in ids if i in inbox.read]
+            if not evicted:
+                return [], 0
+            inbox.delete_ids(evicted)
+            return evicted, self.log_mutation({"op": "evict", "user": username, "ids": evicted})
+
+    #the user's sent copies the retention policy would evict now
+    def expired_sent(self, username, policy, now_ms):
+        user = self.users.get(username)
+        if user is None:
+            return []
+        inbox = user["inbox"]
+        with inbox.changed:
+            return [] if inbox.closed else policy.select_sent(inbox, now_ms)
+
+    #drop evicted sent copies that are still stored, returns (ids evicted, seq)
+    def evict_sent(self, username, ids):
+        user = self.users.get(username)
+        if user is None:
+            return [], 0
+        inbox = user["inbox"]
+        with inbox.changed:
+            evicted = [] if inbox.closed else [i for i in ids if i in inbox.sent]
+            if not evicted:
+                return [], 0
+            inbox.delete_sent(evicted)
+            return evicted, self.log_mutation({"op": "evict_sent", "user": username, "ids": evicted})
+
+    #(users, stored messages, largest inbox)
+    def stats(self):
+        sizes = [len(user["inbox"]) for user in self.users.values()]
+        return len(sizes), sum(sizes), max(sizes, default=0)
+
+    #(created, seq); False when the name is taken. The shard lock keeps the owner from vanishing meanwhile
+    def create_group(self, name, owner):
+        with self.users.shard_lock(owner):
+            if owner not in self.users:
+                raise UnknownUser(owner)
+            return self.groups.create(name, owner, self.log_mutation)
+
+    #(joined, seq); False when already a member
+    def join_group(self, name, username):
+        with self.users.shard_lock(username):
+            if username not in self.users:
+                raise UnknownUser(username)
+            return self.groups.join(name, username, self.log_mutation)
+
+    #store one group message, returns (message id, seq); a member's account exists, so only membership is checked
+    def append_group(self, name, sender, content, timestamp_ms):
+        message, seq = self.groups.append(name, sender, content, timestamp_ms, self.next_id, self.log_mutation)
+        return message.id, seq
+
+    def groups_of(self, username):
+        return self.groups.groups_of(username)
+
+    def group_unread_count(self, username):
+        return self.groups.unread_count(username)
+
+    #see GroupStore.take_unread
+    def take_group_unread(self, username, count):
+        return self.groups.take_unread(username, count, self.log_mutation)
+
+    def close(self):
+        pass
+
+
+#what a Subscribe stream waits on for an SQLite user; new mail is counted in the database
+class SQLiteWatch(InboxSignals):
+    def __init__(self, storage, username):
+        super().__init__()
+        self.storage = storage
+        self.username = username
+
+    @property
+    def unread_count(self):
+        return self.storage.unread_count(self.username) or 0
+
+
+# ---------------------------
+# SQLite backend.
+# One writer connection, serialised by `write_lock`, runs every change as an
+# explicit BEGIN IMMEDIATE ... COMMIT transaction, and a batch send is a single
+# transaction. WAL journal mode lets each thread read on its own connection
+# while a write is in progress. Statements use fixed SQL text with ?
+# parameters, so sqlite3's per-connection statement cache keeps them
+# prepared. Unread mail is found through the (recipient, read, id) index,
+# which is also what orders an inbox by arrival.
+# SearchMessages reads the FTS5 table `message_words`, an inverted index over
+# the messages table that triggers keep in step with every insert and delete.
+# It indexes the recipient next to the content, so a search intersects the
+# word's postings with the user's own instead of scanning the inbox.
+# A sender's copies of their direct messages are rows of `sent_messages`;
+# ConversationHistory reads a page from it and from `messages` through their
+# (user, peer, id) indexes (see SQLITE_CONVERSATION).
+# ---------------------------
+class SQLiteStorage:
+    def __init__(self, path, next_id, synchronous="NORMAL", cache_kib=16384, group_history=DEFAULT_MAX_HISTORY):
+        if synchronous not in SQLITE_SYNCHRONOUS:
+            raise ValueError(f"synchronous must be one of {SQLITE_SYNCHRONOUS}, got '{synchronous}'")
+        self.path = path
+        self.next_id = next_id
+        self.synchronous = synchronous
+        self.cache_kib = cache_kib
+        self.group_history = group_history
+        self.write_lock = threading.Lock()
+        self.writer = self.connect()
+        indexed = self.writer.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_words'").fetchone()
+        self.writer.executescript(SQLITE_SCHEMA)
+        if not indexed:
+            # a database from before search: index the messages it already holds
+            self.writer.execute("INSERT INTO message_words (message_words) VALUES ('rebuild')")
+        self.local = threading.local()
+        self.readers = []
+        self.readers_lock = threading.Lock()
+        # Subscribe waiters by username, created on first subscribe; a leaf lock
+        self.watches = {}
+        self.watch_lock = threading.Lock()
+        self.index = AccountIndex()
+        self.index.load(row[0] for row in self.writer.execute("SELECT username FROM accounts"))
+
+    def connect(self):
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(f"PRAGMA synchronous={self.synchronous}")
+        # negative: a size in KiB rather than pages
+        db.execute(f"PRAGMA cache_size=-{int(self.cache_kib)}")
+        return db
+
+    #this thread's read connection
+    def reader(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = self.connect()
+            with self.readers_lock:
+                self.readers.append(db)
+        return db
+
+    #one write transaction on the writer connection, rolled back if the body raises
+    @contextmanager
+    def transaction(self):
+        with self.write_lock:
+            self.writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.writer
+            except BaseException:
+                self.writer.execute("ROLLBACK")
+                raise
+            self.writer.execute("COMMIT")
+
+    def has_account(self, db, username):
+        return db.execute("SELECT 1 FROM accounts WHERE username = ?", (username,)).fetchone() is not None
+
+    def __len__(self):
+        return self.reader().execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def usernames(self):
+        return [row[0] for row in self.reader().execute("SELECT username FROM accounts")]
+
+    def search(self, pattern, page_size, page_token):
+        return self.index.search(pattern, page_size, page_token)
+
+    def exists(self, username):
+        return self.has_account(self.reader(), username)
+
+    #highest stored message id, so the allocator resumes after it
+    def last_message_id(self):
+        return self.reader().execute(
+            "SELECT MAX((SELECT IFNULL(MAX(id), 0) FROM messages), (SELECT IFNULL(MAX(id), 0) FROM group_messages),"
+            " (SELECT IFNULL(MAX(id), 0) FROM sent_messages))").fetchone()[0]
+
+    def create_account(self, username, password_hash):
+        with self.transaction() as db:
+            if not db.execute("INSERT OR IGNORE INTO accounts (username, password) VALUES (?, ?)", (username, password_hash)).rowcount:
+                return False, 0
+            self.index.add(username)
+        return True, 0
+
+    def password(self, username):
+        row = self.reader().execute("SELECT password FROM accounts WHERE username = ?", (username,)).fetchone()
+        return None if row is None else row[0]
+
+    def unread_count(self, username):
+        row = self.reader().execute(
+            "SELECT (SELECT COUNT(*) FROM messages WHERE recipient = username AND read = 0) FROM accounts WHERE username = ?",
+            (username,)).fetchone()
+        return None if row is None else row[0]
+
+    def watch(self, username):
+        with self.watch_lock:
+            watch = self.watches.get(username)
+            if watch is None:
+                watch = self.watches[username] = SQLiteWatch(self, username)
+        # checked after registering: drop_account deletes the row before it closes the watch
+        if not self.exists(username):
+            with self.watch_lock:
+                if self.watches.get(username) is watch:
+                    del self.watches[username]
+            return None
+        return watch
+
+    #wake the user's Subscribe streams, after the transaction that stored their mail committed
+    def notify(self, username):
+        watch = self.watches.get(username)
+        if watch is not None:
+            with watch.changed:
+                watch.notify()
+
+    def close_watch(self, username):
+        with self.watch_lock:
+            watch = self.watches.pop(username, None)
+        if watch is not None:
+            watch.close()
+
+    def insert_message(self, db, message_id, to_user, from_user, content, timestamp_ms, read=0):
+        db.execute("INSERT INTO messages (id, recipient, sender, content, timestamp, read) VALUES (?, ?, ?, ?, ?, ?)",
+                   (message_id, to_user, from_user, content, timestamp_ms, read))
+
+    #the sender's copy of a direct message; a message to oneself is kept once
+    def insert_sent(self, db, message_id, from_user, to_user, content, timestamp_ms):
+        if from_user != to_user:
+            db.execute("INSERT OR IGNORE INTO sent_messages (id, sender, recipient, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                       (message_id, from_user, to_user, content, timestamp_ms))
+
+    def append(self, from_user, to_user, content, timestamp_ms, check_sender=False):
+        with self.transaction() as db:
+            sender_here = self.has_account(db, from_user)
+            if check_sender and not sender_here:
+                raise UnknownSender(from_user)
+            if not self.has_account(db, to_user):
+                raise UnknownRecipient(to_user)
+            message_id = self.next_id()
+            self.insert_message(db, message_id, to_user, from_user, content, timestamp_ms)
+            if sender_here:
+                self.insert_sent(db, message_id, from_user, to_user, content, timestamp_ms)
+        self.notify(to_user)
+        return message_id, 0
+
+    def append_batch(self, from_user, items, timestamp_ms):
+        message_ids = []
+        with self.transaction() as db:
+            sender_here = self.has_account(db, from_user)
+            for to_user, content in items:
+                if not self.has_account(db, to_user):
+                    message_ids.append(None)
+                    continue
+                message_id = self.next_id()
+                self.insert_message(db, message_id, to_user, from_user, content, timestamp_ms)
+                if sender_here:
+                    self.insert_sent(db, message_id, from_user, to_user, content, timestamp_ms)
+                message_ids.append(message_id)
+        for to_user in {to_user for (to_user, _), message_id in zip(items, message_ids) if message_id is not None}:
+            self.notify(to_user)
+        return message_ids, 0
+
+    def append_sent(self, from_user, to_user, message_id, content, timestamp_ms):
+        with self.transaction() as db:
+            if self.has_account(db, from_user):
+                self.insert_sent(db, message_id, from_user, to_user, content, timestamp_ms)
+        return 0
+
+    def take_unread(self, username, count):
+        with self.transaction() as db:
+            if not self.has_account(db, username):
+                return None, 0
+            rows = db.execute(
+                "SELECT id, sender, content, timestamp FROM messages WHERE recipient = ? AND read = 0 ORDER BY id LIMIT ?",
+                (username, count if count > 0 else -1)).fetchall()
+            if rows:
+                db.execute("UPDATE messages SET read = 1 WHERE recipient = ? AND read = 0 AND id <= ?", (username, rows[-1][0]))
+        return [Message(*row) for row in rows], 0
+
+    #walks the (recipient, read, id) index down from before_id; one row past the page tells whether more are left
+    def read_page(self, username, before_id, page_size):
+        db = self.reader()
+        if not self.has_account(db, username):
+            return None
+        rows = db.execute(
+            "SELECT id, sender, content, timestamp FROM messages WHERE recipient = ? AND read = 1 AND id < ? ORDER BY id DESC LIMIT ?",
+            (username, before_id or NO_BEFORE_ID, page_size + 1 if page_size > 0 else -1)).fetchall()
+        more = 0 < page_size < len(rows)
+        messages = [Message(*row) for row in reversed(rows[:page_size] if more else rows)]
+        return messages, messages[0].id if more else 0
+
+    def search_messages(self, username, query_words, sender, since_ms, until_ms, before_id, page_size):
+        db = self.reader()
+        if not self.has_account(db, username):
+            return None
+        limit = page_size + 1 if page_size else -1
+        window = (since_ms, until_ms, until_ms, before_id or NO_BEFORE_ID, limit)
+        if query_words:
+            rows = db.execute(
+                "SELECT m.id, m.sender, m.content, m.timestamp FROM message_words JOIN messages m ON m.id = message_words.rowid"
+                " WHERE message_words MATCH ? AND m.recipient = ? AND (? = '' OR m.sender = ?)"
+                " AND m.timestamp >= ? AND (? = 0 OR m.timestamp < ?) AND message_words.rowid < ?"
+                " ORDER BY message_words.rowid DESC LIMIT ?",
+                (fts_query(username, query_words), username, sender, sender) + window)
+        elif sender:
+            rows = db.execute(
+                "SELECT id, sender, content, timestamp FROM messages WHERE recipient = ? AND sender = ?"
+                " AND timestamp >= ? AND (? = 0 OR timestamp < ?) AND id < ? ORDER BY id DESC LIMIT ?",
+                (username, sender) + window)
+        else:
+            rows = db.execute(
+                "SELECT id, sender, content, timestamp FROM messages WHERE recipient = ?"
+                " AND timestamp >= ? AND (? = 0 OR timestamp < ?) AND id < ? ORDER BY id DESC LIMIT ?",
+                (username,) + window)
+        found = [Message(*row) for row in rows]
+        if page_size and len(found) > page_size:
+            del found[page_size:]
+            return found, found[-1].id
+        return found, 0
+
+    #rows of the conversation strictly between the ids `low` and `high`, at most `limit` (-1 for all)
+    #from whichever end `order` starts at
+    def conversation_rows(self, db, username, peer, low, high, order, limit):
+        return db.execute(SQLITE_CONVERSATION.format(order=order), (username, peer, low, high, limit)).fetchall()
+
+    def conversation(self, username, peer, before_id, after_id, limit):
+        db = self.reader()
+        if not self.has_account(db, username):
+            return None
+        high = before_id or NO_BEFORE_ID
+        # one row past the page tells whether the conversation goes on in the direction read
+        fetch = limit + 1 if limit > 0 else -1
+        if after_id:
+            rows = self.conversation_rows(db, username, peer, after_id, high, "ASC", fetch)
+        else:
+            rows = self.conversation_rows(db, username, peer, 0, high, "DESC", fetch)[::-1]
+        more = 0 < limit < len(rows)
+        if more:
+            rows = rows[:limit] if after_id else rows[-limit:]
+        newer = bool(before_id) and bool(self.conversation_rows(db, username, peer, before_id - 1, NO_BEFORE_ID, "ASC", 1))
+        if after_id:
+            has_older = bool(self.conversation_rows(db, username, peer, 0, after_id + 1, "ASC", 1))
+            has_newer = more or newer
+        else:
+            has_older, has_newer = more, newer
+        return [Message(*row) for row in rows], has_older, has_newer
+
+    def stored_ids(self, username, ids):
+        db = self.reader()
+        return {i for i in ids if db.execute("SELECT 1 FROM messages WHERE id = ? AND recipient = ?", (i, username)).fetchone()}
+
+    def delete_ids(self, username, ids):
+        deleted = []
+        with self.transaction() as db:
+            if not self.has_account(db, username):
+                return None, 0
+            for message_id in dict.fromkeys(ids):
+                if (db.execute("DELETE FROM messages WHERE id = ? AND recipient = ?", (message_id, username)).rowcount
+                        or db.execute("DELETE FROM sent_messages WHERE id = ? AND sender = ?", (message_id, username)).rowcount):
+                    deleted.append(message_id)
+        return deleted, 0
+
+    def delete_all(self, username):
+        with self.transaction() as db:
+            if not self.has_account(db, username):
+                return False, 0
+            db.execute("DELETE FROM messages WHERE recipient = ?", (username,))
+            db.execute("DELETE FROM sent_messages WHERE sender = ?", (username,))
+        return True, 0
+
+    def drop_account(self, username):
+        with self.transaction() as db:
+            if not db.execute("DELETE FROM accounts WHERE username = ?", (username,)).rowcount:
+                return False, 0
+            db.execute("DELETE FROM messages WHERE recipient = ?", (username,))
+            db.execute("DELETE FROM sent_messages WHERE sender = ?", (username,))
+            db.execute("DELETE FROM group_members WHERE username = ?", (username,))
+            self.index.remove(username)
+        self.close_watch(username)
+        return True, 0
+
+    def dump(self, db, username):
+        row = db.execute("SELECT password FROM accounts WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        data = {"password": row[0], "read": [], "unread": []}
+        rows = db.execute("SELECT id, sender, content, timestamp, read FROM messages WHERE recipient = ? ORDER BY id", (username,))
+        for message_id, sender, content, timestamp, read in rows:
+            data["read" if read else "unread"].append({"id": message_id, "from": sender, "content": content, "timestamp": timestamp})
+        rows = db.execute("SELECT id, recipient, content, timestamp FROM sent_messages WHERE sender = ? ORDER BY id", (username,))
+        data["sent"] = [{"id": message_id, "from": username, "to": recipient, "content": content, "timestamp": timestamp}
+                        for message_id, recipient, content, timestamp in rows]
+        return data
+
+    def export_user(self, username):
+        with self.transaction() as db:
+            return self.dump(db, username)
+
+    def take_user(self, username):
+        with self.transaction() as db:
+            data = self.dump(db, username)
+            if data is None:
+                return None, 0
+            db.execute("DELETE FROM accounts WHERE username = ?", (username,))
+            db.execute("DELETE FROM messages WHERE recipient = ?", (username,))
+            db.execute("DELETE FROM sent_messages WHERE sender = ?", (username,))
+            self.index.remove(username)
+        self.close_watch(username)
+        return data, 0
+
+    def restore_user(self, username, data):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO accounts (username, password) VALUES (?, ?)", (username, data["password"]))
+            db.execute("DELETE FROM messages WHERE recipient = ?", (username,))
+            for read, key in ((1, "read"), (0, "unread")):
+                for m in data[key]:
+                    self.insert_message(db, m["id"], username, m["from"], m["content"], m["timestamp"], read)
+            db.execute("DELETE FROM sent_messages WHERE sender = ?", (username,))
+            for m in data.get("sent", ()):
+                self.insert_sent(db, m["id"], username, m["to"], m["content"], m["timestamp"])
+            self.index.add(username)
+        self.notify(username)
+        return 0
+
+    def expired(self, username, policy, now_ms):
+        db = self.reader()
+        size = db.execute("SELECT COUNT(*) FROM messages WHERE recipient = ?", (username,)).fetchone()[0]
+        rows = db.execute("SELECT id, sender, content, timestamp FROM messages WHERE recipient = ? AND read = 1 ORDER BY id", (username,))
+        try:
+            # the policy stops at the first message it keeps, so only that much of the history is fetched
+            return policy.pick((Message(*row) for row in rows), size, now_ms)
+        finally:
+            rows.close()
+
+    def evict(self, username, ids):
+        evicted = []
+        with self.transaction() as db:
+            for message_id in ids:
+                if db.execute("DELETE FROM messages WHERE id = ? AND recipient = ? AND read = 1", (message_id, username)).rowcount:
+                    evicted.append(message_id)
+        return evicted, 0
+
+    def expired_sent(self, username, policy, now_ms):
+        db = self.reader()
+        size = db.execute("SELECT COUNT(*) FROM sent_messages WHERE sender = ?", (username,)).fetchone()[0]
+        rows = db.execute("SELECT id, sender, content, timestamp FROM sent_messages WHERE sender = ? ORDER BY id", (username,))
+        try:
+            return policy.pick((Message(*row) for row in rows), size, now_ms)
+        finally:
+            rows.close()
+
+    def evict_sent(self, username, ids):
+        evicted = []
+        with self.transaction() as db:
+            for message_id in ids:
+                if db.execute("DELETE FROM sent_messages WHERE id = ? AND sender = ?", (message_id, username)).rowcount:
+                    evicted.append(message_id)
+        return evicted, 0
+
+    def stats(self):
+        db = self.reader()
+        users = db.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+        stored = db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        largest = db.execute("SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM messages GROUP BY recipient)").fetchone()[0]
+        return users, stored, largest or 0
+
+    def create_group(self, name, owner):
+        with self.transaction() as db:
+            if not self.has_account(db, owner):
+                raise UnknownUser(owner)
+            if not db.execute("INSERT OR IGNORE INTO chat_groups (name, owner) VALUES (?, ?)", (name, owner)).rowcount:
+                return False, 0
+            db.execute("INSERT INTO group_members (username, name, cursor) VALUES (?, ?, 0)", (owner, name))
+        return True, 0
+
+    def join_group(self, name, username):
+        with self.transaction() as db:
+            if not self.has_account(db, username):
+                raise UnknownUser(username)
+            row = db.execute("SELECT last_id FROM chat_groups WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise UnknownGroup(name)
+            joined = db.execute("INSERT OR IGNORE INTO group_members (username, name, cursor) VALUES (?, ?, ?)",
+                                (username, name, row[0])).rowcount
+        return bool(joined), 0
+
+    def append_group(self, name, sender, content, timestamp_ms):
+        with self.transaction() as db:
+            if db.execute("SELECT 1 FROM group_members WHERE username = ? AND name = ?", (sender, name)).fetchone() is None:
+                if db.execute("SELECT 1 FROM chat_groups WHERE name = ?", (name,)).fetchone() is None:
+                    raise UnknownGroup(name)
+                raise NotAMember(sender)
+            message_id = self.next_id()
+            db.execute("INSERT INTO group_messages (id, name, sender, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                       (message_id, name, sender, content, timestamp_ms))
+            db.execute("UPDATE chat_groups SET last_id = ? WHERE name = ?", (message_id, name))
+            if self.group_history:
+                db.execute("DELETE FROM group_messages WHERE name = ? AND id <= "
+                           "(SELECT id FROM group_messages WHERE name = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                           (name, name, self.group_history))
+        return message_id, 0
+
+    def groups_of(self, username):
+        return [row[0] for row in self.reader().execute(
+            "SELECT name FROM group_members WHERE username = ? ORDER BY name", (username,))]
+
+    def group_unread_count(self, username):
+        return self.reader().execute(
+            "SELECT COUNT(*) FROM group_members m JOIN group_messages g ON g.name = m.name AND g.id > m.cursor"
+            " WHERE m.username = ?", (username,)).fetchone()[0]
+
+    def take_group_unread(self, username, count):
+        # most wake-ups find no group mail; that is settled without taking the write lock
+        if not self.reader().execute(
+                "SELECT 1 FROM group_members m JOIN group_messages g ON g.name = m.name AND g.id > m.cursor"
+                " WHERE m.username = ? LIMIT 1", (username,)).fetchone():
+            return [], 0
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT g.name, g.id, g.sender, g.content, g.timestamp FROM group_members m"
+                " JOIN group_messages g ON g.name = m.name AND g.id > m.cursor WHERE m.username = ? ORDER BY g.id LIMIT ?",
+                (username, count if count > 0 else -1)).fetchall()
+            cursors = {}
+            for row in rows:
+                cursors[row[0]] = row[1]
+            for name, cursor in cursors.items():
+                db.execute("UPDATE group_members SET cursor = ? WHERE username = ? AND name = ?", (cursor, username, name))
+        return [(row[0], Message(*row[1:])) for row in rows], 0
+
+    def close(self):
+        with self.readers_lock:
+            for db in self.readers:
+                db.close()
+            self.readers = []
+        with self.write_lock:
+            self.writer.close()
@@ -0,0 +1,117 @@
+import threading
+import zlib
+from contextlib import ExitStack, contextmanager
+
+from account_index import AccountIndex
+
+# ---------------------------
+# Concurrency-safe user table.
+# Users are spread over lock-striped shards keyed by a hash of the username, so
+# lookups and account changes for unrelated users almost never touch the same
+# lock. A shard lock only guards membership (which users exist); each user's
+# messages are guarded by their own inbox lock (Inbox.changed).
+#
+# Lock order, to stay deadlock-free:
+#   1. shard locks, in ascending shard index (use `locked(*usernames)`)
+#   2. inbox locks, at most one at a time
+# Never take a shard lock while holding an inbox lock.
+# `index` (a sorted AccountIndex for ListAccounts) is updated under the shard
+# lock; its own lock is a leaf and never held while taking another.
+# ---------------------------
+DEFAULT_SHARDS = 64
+
+
+class UserStore:
+    def __init__(self, shards=DEFAULT_SHARDS):
+        self.shards = [{} for _ in range(shards)]
+        self.locks = [threading.RLock() for _ in range(shards)]
+        self.index = AccountIndex()
+
+    #stable across processes (unlike hash()), so shard layout is reproducible
+    def shard_index(self, username):
+        return zlib.crc32(username.encode()) % len(self.shards)
+
+    def shard_lock(self, username):
+        return self.locks[self.shard_index(username)]
+
+    #hold the shard locks of several users at once, acquired in a fixed order
+    @contextmanager
+    def locked(self, *usernames):
+        indices = sorted({self.shard_index(u) for u in usernames})
+        with ExitStack() as stack:
+            for i in indices:
+                stack.enter_context(self.locks[i])
+            yield
+
+    def get(self, username, default=None):
+        i = self.shard_index(username)
+        with self.locks[i]:
+            return self.shards[i].get(username, default)
+
+    def __getitem__(self, username):
+        user = self.get(username)
+        if user is None:
+            raise KeyError(username)
+        return user
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __setitem__(self, username, user):
+        i = self.shard_index(username)
+        with self.locks[i]:
+            self.shards[i][username] = user
+            self.index.add(username)
+
+    #insert only if the name is free, returns whether it was inserted
+    def add(self, username, user):
+        i = self.shard_index(username)
+        with self.locks[i]:
+            if username in self.shards[i]:
+                return False
+            self.shards[i][username] = user
+            self.index.add(username)
+            return True
+
+    def pop(self, username, *default):
+        i = self.shard_index(username)
+        with self.locks[i]:
+            if username in self.shards[i]:
+                self.index.remove(username)
+            return self.shards[i].pop(username, *default)
+
+    def __delitem__(self, username):
+        self.pop(username)
+
+    #snapshot of the usernames, one shard at a time
+    def keys(self):
+        names = []
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                names.extend(shard)
+        return names
+
+    def items(self):
+        pairs = []
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                pairs.extend(shard.items())
+        return pairs
+
+    def values(self):
+        return [user for _, user in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    #empties every shard at once (all shard locks, in order)
+    def clear(self):
+        with ExitStack() as stack:
+            for lock in self.locks:
+                stack.enter_context(lock)
+            for shard in self.shards:
+                shard.clear()
+            self.index.clear()
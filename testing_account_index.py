@@ -0,0 +1,84 @@
+import unittest
+
+import time
+
+from account_index import AccountIndex, compile_pattern, glob_match, SCAN_CHUNK
+
+NAMES = ["alice", "Alex", "albert", "bob", "Bobby", "carol", "a.b", "axb"]
+
+
+class TestAccountIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = AccountIndex()
+        for name in NAMES:
+            self.index.add(name)
+
+    def search(self, pattern):
+        return self.index.search(pattern)[0]
+
+    #plain text is still a case-insensitive substring match, results come back sorted
+    def test_plain_text_is_substring(self):
+        self.assertEqual(self.search("al"), ["albert", "Alex", "alice"])
+        self.assertEqual(self.search("OB"), ["bob", "Bobby"])
+        self.assertEqual(self.search(""), sorted(NAMES, key=str.lower))
+
+    def test_wildcards_match_whole_name(self):
+        self.assertEqual(self.search("b*"), ["bob", "Bobby"])
+        self.assertEqual(self.search("bo?"), ["bob"])
+        self.assertEqual(self.search("*e*t"), ["albert"])
+        self.assertEqual(self.search("a*x"), ["Alex"])
+
+    #regex syntax has no special meaning, so hostile patterns are just literal text
+    def test_regex_characters_are_literal(self):
+        self.assertEqual(self.search("a.b"), ["a.b"])
+        self.assertEqual(self.search("(a+)+$"), [])
+
+    #many stars cost no more than one: matching never backtracks past the last "*"
+    def test_wildcards_do_not_backtrack(self):
+        self.index.add("a" * 200)
+        started = time.perf_counter()
+        self.assertEqual(self.search("*a*a*a*a*a*a*a*a*b"), [])
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertTrue(glob_match("*a?c*", "xxabcabc"))
+        self.assertFalse(glob_match("a*c", "abcd"))
+        self.assertTrue(glob_match("**", ""))
+
+    #a search longer than one chunk resumes where the last chunk ended
+    def test_search_across_chunks(self):
+        index = AccountIndex()
+        index.load(f"user{i:05}" for i in range(SCAN_CHUNK * 2 + 10))
+        names, token = index.search("user*9", page_size=150)
+        self.assertEqual((len(names), token), (150, "user01499"))
+        rest, token = index.search("user*9", page_token=token)
+        self.assertEqual(names + rest, [f"user{i:05}" for i in range(9, SCAN_CHUNK * 2 + 10, 10)])
+        self.assertEqual(token, "")
+
+    #walking the pages returns every match exactly once, in order
+    def test_pagination(self):
+        pages = []
+        token = ""
+        while True:
+            names, token = self.index.search("*", page_size=3, page_token=token)
+            pages.append(names)
+            if not token:
+                break
+        self.assertEqual(pages[0], ["a.b", "albert", "Alex"])
+        self.assertEqual([n for page in pages for n in page], sorted(NAMES, key=str.lower))
+
+    def test_remove_and_duplicates(self):
+        self.index.add("bob")
+        self.index.remove("Bobby")
+        self.index.remove("nobody")
+        self.assertEqual(self.search("b*"), ["bob"])
+
+    #repeated patterns are served from the compiled-pattern cache
+    def test_compiled_patterns_are_cached(self):
+        compile_pattern.cache_clear()
+        self.search("al*x")
+        self.search("al*x")
+        self.assertEqual(compile_pattern.cache_info().hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import asyncio
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from auth import (AsyncAuthInterceptor, AuthInterceptor, SessionCache, check_password, make_password_hash,
+                  token_from_metadata)
+from log_pipeline import RPC_LOGGER
+from server import AsyncChatService, ChatService, sessions, users_db
+
+# cheap scrypt cost for tests
+TEST_N = 2 ** 10
+
+
+def bearer(token):
+    return (("authorization", f"Bearer {token}"),)
+
+
+class TestPasswords(unittest.TestCase):
+
+    def test_hash_round_trip(self):
+        stored = make_password_hash("secret", n=TEST_N)
+        self.assertTrue(stored.startswith("scrypt$"))
+        self.assertTrue(check_password(stored, "secret"))
+        self.assertFalse(check_password(stored, "wrong"))
+        # salted: the same password never hashes the same twice
+        self.assertNotEqual(stored, make_password_hash("secret", n=TEST_N))
+
+    #stores written before server-side hashing hold the client's digest
+    def test_legacy_plain_digest(self):
+        self.assertTrue(check_password("abc123", "abc123"))
+        self.assertFalse(check_password("abc123", "abc124"))
+
+
+class TestSessionCache(unittest.TestCase):
+
+    def test_issue_lookup_revoke(self):
+        cache = SessionCache(ttl_s=60)
+        token = cache.issue("alice")
+        other = cache.issue("alice")
+        self.assertNotEqual(token, other)
+        self.assertEqual(cache.lookup(token), "alice")
+        self.assertIsNone(cache.lookup("made-up"))
+        self.assertIsNone(cache.lookup(None))
+        cache.revoke(token)
+        self.assertIsNone(cache.lookup(token))
+        cache.revoke_user("alice")
+        self.assertIsNone(cache.lookup(other))
+
+    def test_expiry(self):
+        cache = SessionCache(ttl_s=0.01)
+        token = cache.issue("alice")
+        time.sleep(0.02)
+        self.assertIsNone(cache.lookup(token))
+        self.assertEqual(len(cache), 0)
+
+    #the cache never grows past max_sessions: new sessions are refused while all are live, expired ones make room
+    def test_bounded(self):
+        cache = SessionCache(ttl_s=60, max_sessions=3)
+        tokens = [cache.issue(f"user{i}") for i in range(5)]
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(tokens[3:], [None, None])
+        self.assertEqual([cache.lookup(t) for t in tokens[:3]], ["user0", "user1", "user2"])
+        cache = SessionCache(ttl_s=0.05, max_sessions=2)
+        old = cache.issue("user0")
+        time.sleep(0.03)
+        live = cache.issue("user1")
+        self.assertIsNone(cache.issue("user2"))
+        time.sleep(0.03)
+        self.assertIsNotNone(cache.issue("user2"))
+        self.assertIsNone(cache.lookup(old))
+        self.assertEqual(cache.lookup(live), "user1")
+
+    def test_token_from_metadata(self):
+        self.assertEqual(token_from_metadata((("x", "y"), ("authorization", "Bearer abc"))), "abc")
+        self.assertIsNone(token_from_metadata((("authorization", "Basic abc"),)))
+        self.assertIsNone(token_from_metadata(None))
+
+
+class TestAuthInterceptor(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        sessions.sessions.clear()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), interceptors=[AuthInterceptor(sessions)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.channel = grpc.insecure_channel(f"localhost:{port}")
+        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+        for name in ("alice", "bob"):
+            self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(0)
+
+    def login(self, name):
+        response = self.stub.Login(chat_pb2.LoginRequest(username=name, password="pw"))
+        self.assertTrue(response.success)
+        return response.session_token
+
+    def test_calls_need_a_session(self):
+        self.assertTrue(users_db["alice"]["password"].startswith("scrypt$"))
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.stub.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="hi"))
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.UNAUTHENTICATED)
+        token = self.login("alice")
+        response = self.stub.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="hi"), metadata=bearer(token))
+        self.assertTrue(response.success)
+
+    #a session only acts for its own user
+    def test_no_impersonation(self):
+        token = self.login("alice")
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.stub.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username="bob"), metadata=bearer(token))
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+        requests = iter([chat_pb2.SendMessageRequest(sender="alice", to="bob", content="1"),
+                         chat_pb2.SendMessageRequest(sender="bob", to="alice", content="2")])
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.stub.SendMessageStream(requests, metadata=bearer(token))
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+
+    def test_logout_and_delete_end_sessions(self):
+        token = self.login("alice")
+        # the log names the session's user, whatever the request says
+        with self.assertLogs(RPC_LOGGER) as logs:
+            self.assertTrue(self.stub.Logout(chat_pb2.LogoutRequest(), metadata=bearer(token)).success)
+        self.assertIn("User logged out: alice", logs.output[-1])
+        with self.assertRaises(grpc.RpcError):
+            self.stub.ListMessages(chat_pb2.ListMessagesRequest(username="alice"), metadata=bearer(token))
+        token = self.login("bob")
+        self.assertTrue(self.stub.DeleteAccount(chat_pb2.DeleteAccountRequest(username="bob"), metadata=bearer(token)).success)
+        self.assertIsNone(sessions.lookup(token))
+
+    #a full session cache refuses the login rather than ending someone else's session
+    def test_login_refused_when_full(self):
+        token = self.login("alice")
+        max_sessions, sessions.max_sessions = sessions.max_sessions, 1
+        try:
+            response = self.stub.Login(chat_pb2.LoginRequest(username="bob", password="pw"))
+        finally:
+            sessions.max_sessions = max_sessions
+        self.assertFalse(response.success)
+        self.assertEqual(response.session_token, "")
+        self.assertEqual(sessions.lookup(token), "alice")
+
+    def test_wrong_password_gets_no_token(self):
+        response = self.stub.Login(chat_pb2.LoginRequest(username="alice", password="nope"))
+        self.assertFalse(response.success)
+        self.assertEqual(response.session_token, "")
+
+
+class TestAsyncAuthInterceptor(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        sessions.sessions.clear()
+
+    def test_async_server_checks_sessions(self):
+        async def scenario():
+            server = grpc.aio.server(interceptors=[AsyncAuthInterceptor(sessions)])
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncChatService(), server)
+            port = server.add_insecure_port("localhost:0")
+            await server.start()
+            try:
+                async with grpc.aio.insecure_channel(f"localhost:{port}") as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    for name in ("alice", "bob"):
+                        await stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+                    codes = []
+                    try:
+                        await stub.ListMessages(chat_pb2.ListMessagesRequest(username="alice"))
+                    except grpc.aio.AioRpcError as e:
+                        codes.append(e.code())
+                    login = await stub.Login(chat_pb2.LoginRequest(username="alice", password="pw"))
+                    try:
+                        await stub.ListMessages(chat_pb2.ListMessagesRequest(username="bob"), metadata=bearer(login.session_token))
+                    except grpc.aio.AioRpcError as e:
+                        codes.append(e.code())
+                    sent = await stub.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="hi"),
+                                                  metadata=bearer(login.session_token))
+                    return codes, sent
+            finally:
+                await server.stop(0)
+
+        codes, sent = asyncio.run(scenario())
+        self.assertEqual(codes, [grpc.StatusCode.UNAUTHENTICATED, grpc.StatusCode.PERMISSION_DENIED])
+        self.assertTrue(sent.success)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,87 @@
+import os
+import shutil
+import tempfile
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 import re
 import datetime
+import threading
+import itertools
+import asyncio
+import grpc
 
 # Importing generated classes during application run 
 import chat_pb2
 import chat_pb2_grpc
 
 # importing server code 
-from server import ChatService, users_db, hash_password
+import server
+from server import ChatService, AsyncChatService, users_db
+from chat_client import hash_password
+from storage import SQLiteStorage
+from dedup import DedupCache
+
+T0 = 1735732800000  # 2025-01-01 12:00 UTC in epoch milliseconds
+MINUTE = 60000
+
+#storing a user in the current storage backend, `read` messages already read and `unread` ones queued;
+#messages get ids 1, 2, 3, ... in that order
+def make_user(username, password, read=(), unread=()):
+    ids = itertools.count(1)
+    data = {
+        "password": password,
+        "read": [dict(m, id=next(ids)) for m in read],
+        "unread": [dict(m, id=next(ids)) for m in unread]
+    }
+    server.storage.restore_user(username, data)
+    server.next_message_id.advance(next(ids) - 1)
+
+#a user as the backend stores them: {"password", "read", "unread", "sent"} with message dicts, None if unknown
+def stored(username):
+    return server.storage.export_user(username)
+
+#mixed in ahead of a test class: runs the whole class against a fresh SQLite database instead of users_db
+class SQLiteBackend:
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sqlite_storage = SQLiteStorage(os.path.join(directory, "chat.db"), lambda: server.next_message_id())
+        self.addCleanup(sqlite_storage.close)
+        storage_patch = patch.object(server, "storage", sqlite_storage)
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+        super().setUp()
+
+#stand-in for a streaming RPC context that the test can cancel
+class FakeStreamContext:
+    def __init__(self):
+        self.active = True
+        self.callbacks = []
+
+    def is_active(self):
+        return self.active
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return True
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def cancel(self):
+        self.active = False
+        for callback in self.callbacks:
+            callback()
 
 class TestChatService(unittest.TestCase):
 
     #cleaning the database before each test
     def setUp(self):
         users_db.clear()
+        server.groups.clear()
         self.service = ChatService()
         self.mock_context = MagicMock()
 
@@ -27,11 +94,11 @@ class TestChatService(unittest.TestCase):
         response = self.service.CreateAccount(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertIn("created successfully", response.message.lower())
-        self.assertIn("alice", users_db)
+        self.assertTrue(server.storage.exists("alice"))
 
     #testing if duplicate accounts with the same username are not created
     def test_create_account_already_taken(self):
-        users_db["bob"] = {"password": "somehashed", "messages": []}
+        make_user("bob", "somehashed")
         request = chat_pb2.CreateAccountRequest(
             username="bob",
             password=hash_password("secret123")
@@ -49,7 +116,7 @@ class TestChatService(unittest.TestCase):
 
     #verifying that given correct credentials login is successful
     def test_login_success(self):
-        users_db["charlie"] = {"password": hash_password("p@ss"), "messages": []}
+        make_user("charlie", hash_password("p@ss"))
         request = chat_pb2.LoginRequest(username="charlie", password=hash_password("p@ss"))
         response = self.service.Login(request, self.mock_context)
         self.assertTrue(response.success)
@@ -58,7 +125,7 @@ class TestChatService(unittest.TestCase):
 
     #checking failure on incorrect password
     def test_login_incorrect_password(self):
-        users_db["charlie"] = {"password": hash_password("p@ss"), "messages": []}
+        make_user("charlie", hash_password("p@ss"))
         request = chat_pb2.LoginRequest(username="charlie", password=hash_password("wrong"))
         response = self.service.Login(request, self.mock_context)
         self.assertFalse(response.success)
@@ -66,25 +133,84 @@ class TestChatService(unittest.TestCase):
 
     #checks the users retrieved are as expected
     def test_list_accounts(self):
-        users_db["alice"] = {"password": "pw1", "messages": []}
-        users_db["alex"] = {"password": "pw2", "messages": []}
-        users_db["bob"] = {"password": "pw3", "messages": []}
+        make_user("alice", "pw1")
+        make_user("alex", "pw2")
+        make_user("bob", "pw3")
 
         request = chat_pb2.ListAccountsRequest(username="", pattern="al")
         response = self.service.ListAccounts(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertEqual(sorted(response.accounts), ["alex", "alice"])
 
+    #pages of a listing chain together through next_page_token, overlong patterns are refused
+    def test_list_accounts_paged(self):
+        for name in ("al1", "al2", "al3", "bob"):
+            make_user(name, "pw")
+        request = chat_pb2.ListAccountsRequest(pattern="al*", page_size=2)
+        first = self.service.ListAccounts(request, self.mock_context)
+        self.assertEqual(list(first.accounts), ["al1", "al2"])
+        request = chat_pb2.ListAccountsRequest(pattern="al*", page_size=2, page_token=first.next_page_token)
+        second = self.service.ListAccounts(request, self.mock_context)
+        self.assertEqual(list(second.accounts), ["al3"])
+        self.assertEqual(second.next_page_token, "")
+        response = self.service.ListAccounts(chat_pb2.ListAccountsRequest(pattern="*" * 1000), self.mock_context)
+        self.assertFalse(response.success)
+
     #checking if message is sent successfully
     def test_send_message_success(self):
-        users_db["alice"] = {"password": "pw", "messages": []}
-        users_db["bob"] = {"password": "pw", "messages": []}
+        make_user("alice", "pw")
+        make_user("bob", "pw")
         request = chat_pb2.SendMessageRequest(sender="alice", to="bob", content="Hello Bob!")
         response = self.service.SendMessage(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertIn("message sent successfully", response.message.lower())
-        self.assertEqual(len(users_db["bob"]["messages"]), 1)
-        self.assertEqual(users_db["bob"]["messages"][0]["from"], "alice")
+        unread = stored("bob")["unread"]
+        self.assertEqual(len(unread), 1)
+        self.assertEqual(unread[0]["from"], "alice")
+
+    #a batch reports one result per item, in order, and delivers the good ones
+    def test_send_message_batch(self):
+        for name in ("alice", "bob", "carol"):
+            make_user(name, "pw")
+        request = chat_pb2.SendMessageBatchRequest(sender="alice", items=[
+            chat_pb2.BatchItem(to="bob", content="one"),
+            chat_pb2.BatchItem(to="nobody", content="two"),
+            chat_pb2.BatchItem(to="carol", content="three"),
+            chat_pb2.BatchItem(to="", content="four")
+        ])
+        response = self.service.SendMessageBatch(request, self.mock_context)
+        self.assertTrue(response.success)
+        self.assertEqual(response.sent_count, 2)
+        self.assertEqual([r.success for r in response.results], [True, False, True, False])
+        self.assertIn("does not exist", response.results[1].message.lower())
+        bob = stored("bob")["unread"]
+        carol = stored("carol")["unread"]
+        self.assertEqual(bob[0]["content"], "one")
+        self.assertEqual(bob[0]["id"], response.results[0].message_id)
+        self.assertLess(bob[0]["id"], carol[0]["id"])
+        self.assertEqual(bob[0]["timestamp"], carol[0]["timestamp"])
+
+    #a repeated request_id returns the first result without delivering again
+    def test_send_message_request_id_deduplicates(self):
+        make_user("alice", "pw")
+        make_user("bob", "pw")
+        request = chat_pb2.SendMessageRequest(sender="alice", to="bob", content="once", request_id="r-1")
+        with patch.object(server, "sent_requests", DedupCache()):
+            first = self.service.SendMessage(request, self.mock_context)
+            retry = self.service.SendMessage(request, self.mock_context)
+            other = self.service.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="twice", request_id="r-2"), self.mock_context)
+        self.assertTrue(first.success)
+        self.assertEqual(retry.message_id, first.message_id)
+        self.assertNotEqual(other.message_id, first.message_id)
+        self.assertEqual([m["content"] for m in stored("bob")["unread"]], ["once", "twice"])
+
+    def test_send_message_batch_unknown_sender(self):
+        make_user("bob", "pw")
+        request = chat_pb2.SendMessageBatchRequest(sender="ghost", items=[chat_pb2.BatchItem(to="bob", content="hi")] * 2)
+        response = self.service.SendMessageBatch(request, self.mock_context)
+        self.assertFalse(response.success)
+        self.assertEqual(len(response.results), 2)
+        self.assertEqual(stored("bob")["unread"], [])
 
     #if sender or receiver is missing, message sending should fail
     def test_send_message_missing_fields(self):
@@ -95,7 +221,7 @@ class TestChatService(unittest.TestCase):
 
     #if a user does not exist in the database, message sending should fail
     def test_send_message_unknown_sender(self):
-        users_db["bob"] = {"password": "pw", "messages": []}
+        make_user("bob", "pw")
         request = chat_pb2.SendMessageRequest(sender="alice", to="bob", content="Hello?")
         response = self.service.SendMessage(request, self.mock_context)
         self.assertFalse(response.success)
@@ -103,90 +229,293 @@ class TestChatService(unittest.TestCase):
 
     #checks if a specified number of messages can be read
     def test_read_new_messages(self):
-        users_db["alice"] = {
-            "password": "pw",
-            "messages": [
-                {"from": "bob", "content": "Hello", "read": False, "timestamp": "01/01 12:00"},
-                {"from": "carol", "content": "Hi", "read": False, "timestamp": "01/01 12:05"}
-            ]
-        }
+        make_user("alice", "pw", unread=[
+            {"from": "bob", "content": "Hello", "timestamp": T0 + 0 * MINUTE},
+            {"from": "carol", "content": "Hi", "timestamp": T0 + 5 * MINUTE}
+        ])
         request = chat_pb2.ReadNewMessagesRequest(username="alice", count=1)
         response = self.service.ReadNewMessages(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertEqual(len(response.messages), 1)
-        self.assertTrue(users_db["alice"]["messages"][0]["read"])
-        self.assertFalse(users_db["alice"]["messages"][1]["read"])
+        self.assertEqual(response.messages[0].content, "Hello")
+        self.assertEqual(response.messages[0].sender, "bob")
+        self.assertEqual(response.messages[0].timestamp_ms, T0)
+        alice = stored("alice")
+        self.assertEqual([m["content"] for m in alice["read"]], ["Hello"])
+        self.assertEqual([m["content"] for m in alice["unread"]], ["Hi"])
+        self.assertEqual(server.storage.unread_count("alice"), 1)
 
     #checks if all messages can be read
     def test_read_new_messages_all(self):
-        users_db["alice"] = {
-            "password": "pw",
-            "messages": [
-                {"from": "bob", "content": "Hello", "read": False, "timestamp": "01/01 12:00"},
-                {"from": "carol", "content": "Hi", "read": False, "timestamp": "01/01 12:05"}
-            ]
-        }
+        make_user("alice", "pw", unread=[
+            {"from": "bob", "content": "Hello", "timestamp": T0 + 0 * MINUTE},
+            {"from": "carol", "content": "Hi", "timestamp": T0 + 5 * MINUTE}
+        ])
         request = chat_pb2.ReadNewMessagesRequest(username="alice", count=0)  # 0 = read all
         response = self.service.ReadNewMessages(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertEqual(len(response.messages), 2)
-        self.assertTrue(users_db["alice"]["messages"][0]["read"])
-        self.assertTrue(users_db["alice"]["messages"][1]["read"])
+        self.assertEqual(len(stored("alice")["read"]), 2)
+        self.assertEqual([m.id for m in response.messages], [1, 2])
+        self.assertEqual(server.storage.unread_count("alice"), 0)
 
     #checks if messages can be deleted
     def test_delete_messages(self):
-        users_db["alice"] = {
-            "password": "pw",
-            "messages": [
-                {"from": "bob", "content": "M1", "read": True, "timestamp": "01/01 12:00"},
-                {"from": "carol", "content": "M2", "read": True, "timestamp": "01/01 12:05"}
-            ]
-        }
-        request = chat_pb2.DeleteMessagesRequest(username="alice", message_ids=[1])
+        make_user("alice", "pw", read=[
+            {"from": "bob", "content": "M1", "timestamp": T0 + 0 * MINUTE},
+            {"from": "carol", "content": "M2", "timestamp": T0 + 5 * MINUTE}
+        ])
+        request = chat_pb2.DeleteMessagesRequest(username="alice", message_ids=[1])  # id of M1
         response = self.service.DeleteMessages(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertIn("deleted 1 messages", response.message.lower())
-        self.assertEqual(len(users_db["alice"]["messages"]), 1)
-        self.assertEqual(users_db["alice"]["messages"][0]["content"], "M2")
+        self.assertEqual([m["content"] for m in stored("alice")["read"]], ["M2"])
+        self.assertEqual(stored("alice")["unread"], [])
 
     #checks if all messages can be deleted
     def test_delete_all_messages(self):
-        users_db["alice"] = {
-            "password": "pw",
-            "messages": [
-                {"from": "bob", "content": "M1", "read": True, "timestamp": "01/01 12:00"},
-                {"from": "carol", "content": "M2", "read": True, "timestamp": "01/01 12:05"}
-            ]
-        }
-        request = chat_pb2.DeleteMessagesRequest(username="alice", message_ids=[-1])  # -1 => delete all
+        make_user("alice", "pw", read=[
+            {"from": "bob", "content": "M1", "timestamp": T0 + 0 * MINUTE},
+            {"from": "carol", "content": "M2", "timestamp": T0 + 5 * MINUTE}
+        ])
+        request = chat_pb2.DeleteMessagesRequest(username="alice", delete_all=True)
         response = self.service.DeleteMessages(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertIn("all messages deleted", response.message.lower())
-        self.assertEqual(len(users_db["alice"]["messages"]), 0)
+        self.assertEqual(stored("alice"), {"password": "pw", "read": [], "unread": [], "sent": []})
 
     #checks if account can be deleted
     def test_delete_account(self):
-        users_db["alice"] = {"password": "pw", "messages": []}
+        make_user("alice", "pw")
         request = chat_pb2.DeleteAccountRequest(username="alice")
         response = self.service.DeleteAccount(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertIn("account 'alice' deleted", response.message.lower())
-        self.assertNotIn("alice", users_db)
+        self.assertFalse(server.storage.exists("alice"))
+        self.assertIsNone(stored("alice"))
 
     #checks if read messages can be listed
     def test_list_messages(self):
-        users_db["alice"] = {
-            "password": "pw",
-            "messages": [
-                {"from": "bob", "content": "M1", "read": True, "timestamp": "01/01 12:00"},
-                {"from": "carol", "content": "M2", "read": False, "timestamp": "01/01 12:05"}
-            ]
-        }
+        make_user("alice", 
+            "pw",
+            read=[{"from": "bob", "content": "M1", "timestamp": T0 + 0 * MINUTE}],
+            unread=[{"from": "carol", "content": "M2", "timestamp": T0 + 5 * MINUTE}]
+        )
         request = chat_pb2.ListMessagesRequest(username="alice")
         response = self.service.ListMessages(request, self.mock_context)
         self.assertTrue(response.success)
         self.assertEqual(len(response.messages), 1)
-        self.assertIn("m1", response.messages[0].lower())
+        self.assertEqual(response.messages[0].content, "M1")
+        self.assertEqual(response.messages[0].id, 1)
+
+    #login reports the unread counter without touching the read history
+    def test_login_unread_count(self):
+        make_user("dave", 
+            hash_password("pw"),
+            read=[{"from": "bob", "content": "old", "timestamp": T0 + 0 * MINUTE}],
+            unread=[{"from": "bob", "content": "new", "timestamp": T0 + 5 * MINUTE}] * 3
+        )
+        request = chat_pb2.LoginRequest(username="dave", password=hash_password("pw"))
+        response = self.service.Login(request, self.mock_context)
+        self.assertTrue(response.success)
+        self.assertEqual(response.unread_count, 3)
+
+    #ids can point at read or still-unread messages; unknown and repeated ids are ignored
+    def test_delete_messages_read_and_unread_ids(self):
+        make_user("alice", 
+            "pw",
+            read=[{"from": "bob", "content": "M1", "timestamp": T0 + 0 * MINUTE}],
+            unread=[
+                {"from": "carol", "content": "M2", "timestamp": T0 + 5 * MINUTE},
+                {"from": "carol", "content": "M3", "timestamp": T0 + 6 * MINUTE}
+            ]
+        )
+        request = chat_pb2.DeleteMessagesRequest(username="alice", message_ids=[1, 3, 3, 9])
+        response = self.service.DeleteMessages(request, self.mock_context)
+        self.assertIn("deleted 2 messages", response.message.lower())
+        alice = stored("alice")
+        self.assertEqual(alice["read"], [])
+        self.assertEqual([m["content"] for m in alice["unread"]], ["M2"])
+        self.assertEqual(server.storage.unread_count("alice"), 1)
+
+    def search(self, query="", **fields):
+        response = self.service.SearchMessages(chat_pb2.SearchMessagesRequest(username="alice", query=query, **fields),
+                                               self.mock_context)
+        self.assertTrue(response.success)
+        return [m.id for m in response.messages], response.next_before_id
+
+    #search matches whole words in any case, newest first, and pages with before_id
+    def test_search_messages(self):
+        make_user("alice", "pw",
+            read=[
+                {"from": "bob", "content": "Lunch at noon?", "timestamp": T0 + 0 * MINUTE},
+                {"from": "carol", "content": "lunch was great", "timestamp": T0 + 5 * MINUTE},
+                {"from": "bob", "content": "Meeting moved", "timestamp": T0 + 6 * MINUTE}
+            ],
+            unread=[{"from": "bob", "content": "lunch, tomorrow?", "timestamp": T0 + 9 * MINUTE}]
+        )
+        make_user("bob", "pw")
+        self.assertEqual(self.search("LUNCH"), ([4, 2, 1], 0))
+        self.assertEqual(self.search("lunch noon"), ([1], 0))
+        self.assertEqual(self.search("lunch", sender="bob"), ([4, 1], 0))
+        self.assertEqual(self.search(sender="bob", since_ms=T0 + 1 * MINUTE, until_ms=T0 + 9 * MINUTE), ([3], 0))
+        self.assertEqual(self.search("lunch", page_size=2), ([4, 2], 2))
+        self.assertEqual(self.search("lunch", page_size=2, before_id=2), ([1], 0))
+        self.assertEqual(self.search("lun"), ([], 0))
+        # searching leaves unread mail unread
+        self.assertEqual(server.storage.unread_count("alice"), 1)
+
+    #new and deleted mail show up in the next search
+    def test_search_follows_sends_and_deletes(self):
+        make_user("alice", "pw", read=[{"from": "bob", "content": "old lunch", "timestamp": T0}])
+        make_user("bob", "pw")
+        self.assertEqual(self.search("lunch"), ([1], 0))
+        sent = self.service.SendMessage(chat_pb2.SendMessageRequest(sender="bob", to="alice", content="new lunch"), self.mock_context)
+        self.assertEqual(self.search("lunch"), ([sent.message_id, 1], 0))
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="alice", message_ids=[1]), self.mock_context)
+        self.assertEqual(self.search("lunch"), ([sent.message_id], 0))
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="alice", delete_all=True), self.mock_context)
+        self.assertEqual(self.search("lunch"), ([], 0))
+
+    def test_search_messages_rejects_bad_requests(self):
+        make_user("alice", "pw")
+        for request in (chat_pb2.SearchMessagesRequest(username="nobody", query="x"),
+                        chat_pb2.SearchMessagesRequest(username="alice", query=" ".join(f"w{i}" for i in range(9))),
+                        chat_pb2.SearchMessagesRequest(username="alice", query="x" * 257)):
+            self.assertFalse(self.service.SearchMessages(request, self.mock_context).success)
+
+    def conversation(self, peer, username="alice", **fields):
+        response = self.service.ConversationHistory(
+            chat_pb2.ConversationHistoryRequest(username=username, peer=peer, **fields), self.mock_context)
+        self.assertTrue(response.success)
+        return [(m.sender, m.content) for m in response.messages], response.has_older, response.has_newer
+
+    #both sides of a conversation, oldest first, paged from either end with the cursors
+    def test_conversation_history(self):
+        make_user("alice", "pw", read=[{"from": "bob", "content": "hi alice", "timestamp": T0}],
+                  unread=[{"from": "carol", "content": "not bob", "timestamp": T0 + MINUTE}])
+        make_user("bob", "pw")
+        make_user("carol", "pw")
+        send = lambda sender, to, content: self.service.SendMessage(
+            chat_pb2.SendMessageRequest(sender=sender, to=to, content=content), self.mock_context).message_id
+        ids = [1, send("alice", "bob", "hi bob"), send("bob", "alice", "lunch?"), send("alice", "bob", "sure")]
+        send("alice", "carol", "hi carol")
+        send("alice", "alice", "note to self")
+
+        self.assertEqual(self.conversation("bob"), (
+            [("bob", "hi alice"), ("alice", "hi bob"), ("bob", "lunch?"), ("alice", "sure")], False, False))
+        self.assertEqual(self.conversation("alice", username="bob"), (
+            [("alice", "hi bob"), ("bob", "lunch?"), ("alice", "sure")], False, False))
+        self.assertEqual(self.conversation("bob", limit=2), ([("bob", "lunch?"), ("alice", "sure")], True, False))
+        self.assertEqual(self.conversation("bob", limit=2, before_id=ids[2]), ([("bob", "hi alice"), ("alice", "hi bob")], False, True))
+        self.assertEqual(self.conversation("bob", limit=2, after_id=ids[0]), ([("alice", "hi bob"), ("bob", "lunch?")], True, True))
+        self.assertEqual(self.conversation("bob", after_id=ids[1], before_id=ids[3]), ([("bob", "lunch?")], True, True))
+        self.assertEqual(self.conversation("alice"), ([("alice", "note to self")], False, False))
+        self.assertEqual(self.conversation("nobody"), ([], False, False))
+        # reading a conversation leaves unread mail unread
+        self.assertEqual(server.storage.unread_count("bob"), 2)
+
+    #deleting either copy of a message removes it from that user's side only
+    def test_conversation_follows_deletes(self):
+        make_user("alice", "pw")
+        make_user("bob", "pw")
+        first = self.service.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="one"), self.mock_context)
+        self.service.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="two"), self.mock_context)
+        self.assertEqual(len(self.conversation("bob")[0]), 2)
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="alice", message_ids=[first.message_id]), self.mock_context)
+        self.assertEqual(self.conversation("bob"), ([("alice", "two")], False, False))
+        self.assertEqual(len(self.conversation("alice", username="bob")[0]), 2)
+        self.assertEqual([(m["to"], m["content"]) for m in stored("alice")["sent"]], [("bob", "two")])
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="alice", delete_all=True), self.mock_context)
+        self.assertEqual(self.conversation("bob"), ([], False, False))
+        self.assertEqual(len(self.conversation("alice", username="bob")[0]), 2)
+
+    def test_conversation_history_rejects_bad_requests(self):
+        make_user("alice", "pw")
+        for request in (chat_pb2.ConversationHistoryRequest(username="nobody", peer="alice"),
+                        chat_pb2.ConversationHistoryRequest(username="alice")):
+            self.assertFalse(self.service.ConversationHistory(request, self.mock_context).success)
+
+    def group_call(self, method, **fields):
+        request = {"CreateGroup": chat_pb2.CreateGroupRequest, "JoinGroup": chat_pb2.JoinGroupRequest,
+                   "SendGroupMessage": chat_pb2.SendGroupMessageRequest}[method](**fields)
+        return getattr(self.service, method)(request, self.mock_context)
+
+    def read_new(self, username, count=0):
+        response = self.service.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username=username, count=count), self.mock_context)
+        return [(m.group, m.sender, m.content) for m in response.messages]
+
+    #a group message reaches every member once, the sender too, and only members who joined before it
+    def test_group_messages(self):
+        for name in ("alice", "bob", "carol"):
+            make_user(name, "pw")
+        self.assertTrue(self.group_call("CreateGroup", username="alice", group="team").success)
+        self.assertFalse(self.group_call("CreateGroup", username="bob", group="team").success)
+        self.assertTrue(self.group_call("JoinGroup", username="bob", group="team").success)
+        self.assertTrue(self.group_call("JoinGroup", username="bob", group="team").success)
+        sent = self.group_call("SendGroupMessage", sender="alice", group="team", content="hello team")
+        self.assertTrue(sent.success)
+        self.assertTrue(self.group_call("JoinGroup", username="carol", group="team").success)
+        self.group_call("SendGroupMessage", sender="bob", group="team", content="welcome carol")
+        self.service.SendMessage(chat_pb2.SendMessageRequest(sender="carol", to="bob", content="thanks"), self.mock_context)
+
+        login = self.service.Login(chat_pb2.LoginRequest(username="bob", password="pw"), self.mock_context)
+        self.assertEqual(login.unread_count, 3)
+        # direct mail first, then group mail oldest first; `count` spans both
+        self.assertEqual(self.read_new("bob", 2), [("", "carol", "thanks"), ("team", "alice", "hello team")])
+        self.assertEqual(self.read_new("bob"), [("team", "bob", "welcome carol")])
+        self.assertEqual(self.read_new("bob"), [])
+        self.assertEqual(self.read_new("carol"), [("team", "bob", "welcome carol")])
+        self.assertEqual([m[2] for m in self.read_new("alice")], ["hello team", "welcome carol"])
+
+    def test_group_messages_rejects_bad_requests(self):
+        make_user("alice", "pw")
+        make_user("bob", "pw")
+        self.group_call("CreateGroup", username="alice", group="team")
+        for method, fields in (("CreateGroup", {"username": "nobody", "group": "x"}),
+                               ("CreateGroup", {"username": "alice", "group": "g" * 65}),
+                               ("JoinGroup", {"username": "alice", "group": "nope"}),
+                               ("JoinGroup", {"username": "nobody", "group": "team"}),
+                               ("SendGroupMessage", {"sender": "bob", "group": "team", "content": "hi"}),
+                               ("SendGroupMessage", {"sender": "alice", "group": "nope", "content": "hi"})):
+            self.assertFalse(self.group_call(method, **fields).success, (method, fields))
+
+    #a repeated request_id is stored once; a deleted member stops getting the group's mail
+    def test_group_send_dedup_and_account_deletion(self):
+        make_user("alice", "pw")
+        make_user("bob", "pw")
+        self.group_call("CreateGroup", username="alice", group="team")
+        self.group_call("JoinGroup", username="bob", group="team")
+        with patch.object(server, "sent_requests", DedupCache()):
+            first = self.group_call("SendGroupMessage", sender="alice", group="team", content="once", request_id="r-1")
+            again = self.group_call("SendGroupMessage", sender="alice", group="team", content="once", request_id="r-1")
+        self.assertEqual(again.message_id, first.message_id)
+        self.assertEqual(self.read_new("bob"), [("team", "alice", "once")])
+        self.service.DeleteAccount(chat_pb2.DeleteAccountRequest(username="bob"), self.mock_context)
+        make_user("bob", "pw")
+        self.group_call("SendGroupMessage", sender="alice", group="team", content="after")
+        self.assertEqual(self.read_new("bob"), [])
+        self.assertFalse(self.group_call("SendGroupMessage", sender="bob", group="team", content="x").success)
+
+    #read messages come a page at a time, newest page first, each page oldest first
+    def test_list_messages_pages(self):
+        make_user("alice", "pw", read=[{"from": "bob", "content": f"m{i}", "timestamp": T0} for i in range(5)],
+                  unread=[{"from": "bob", "content": "new", "timestamp": T0}])
+        pages = []
+        before_id = 0
+        while True:
+            request = chat_pb2.ListMessagesRequest(username="alice", before_id=before_id, page_size=2)
+            response = self.service.ListMessages(request, self.mock_context)
+            pages.append([m.content for m in response.messages])
+            before_id = response.next_before_id
+            if not before_id:
+                break
+        self.assertEqual(pages, [["m3", "m4"], ["m1", "m2"], ["m0"]])
+        # without a page_size a request gets at most LIST_PAGE_SIZE messages
+        with patch.object(server, "LIST_PAGE_SIZE", 3):
+            response = self.service.ListMessages(chat_pb2.ListMessagesRequest(username="alice"), self.mock_context)
+        self.assertEqual([m.content for m in response.messages], ["m2", "m3", "m4"])
+        self.assertEqual(response.next_before_id, response.messages[0].id)
 
     #checks if messages can be listed for an unknown user
     def test_list_messages_unknown_user(self):
@@ -195,5 +524,256 @@ class TestChatService(unittest.TestCase):
         self.assertFalse(response.success)
         self.assertEqual(len(response.messages), 0)
 
+
+class TestSubscribe(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        server.groups.clear()
+        self.service = ChatService()
+        make_user("alice", "pw")
+        make_user("bob", "pw")
+
+    #runs next() on the stream in a background thread and returns a holder for the result
+    def next_in_thread(self, stream):
+        result = {}
+        def run():
+            result["value"] = next(stream, None)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, result
+
+    #pending unread mail is pushed as soon as the stream opens, and marked read
+    def test_subscribe_drains_existing_unread(self):
+        make_user("bob", "pw", unread=[{"from": "alice", "content": "early", "timestamp": T0 + 0 * MINUTE}])
+        stream = self.service.Subscribe(chat_pb2.SubscribeRequest(username="bob"), FakeStreamContext())
+        self.assertEqual(next(stream).message.content, "early")
+        self.assertEqual(server.storage.unread_count("bob"), 0)
+        self.assertEqual(len(stored("bob")["read"]), 1)
+
+    #SendMessage wakes the recipient's waiting stream
+    def test_send_message_wakes_subscriber(self):
+        stream = self.service.Subscribe(chat_pb2.SubscribeRequest(username="bob"), FakeStreamContext())
+        thread, result = self.next_in_thread(stream)
+        self.service.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="ping"), MagicMock())
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result["value"].message.content, "ping")
+        self.assertEqual(result["value"].message.sender, "alice")
+
+    #cancelling the call or deleting the account ends the stream
+    def test_stream_ends_on_cancel_and_account_deletion(self):
+        context = FakeStreamContext()
+        stream = self.service.Subscribe(chat_pb2.SubscribeRequest(username="bob"), context)
+        thread, result = self.next_in_thread(stream)
+        context.cancel()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(result["value"])
+
+        stream = self.service.Subscribe(chat_pb2.SubscribeRequest(username="alice"), FakeStreamContext())
+        thread, result = self.next_in_thread(stream)
+        self.service.DeleteAccount(chat_pb2.DeleteAccountRequest(username="alice"), MagicMock())
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(result["value"])
+
+    #a group send wakes the streams of online members, who each get the one stored message
+    def test_group_message_wakes_subscribers(self):
+        self.service.CreateGroup(chat_pb2.CreateGroupRequest(username="alice", group="team"), MagicMock())
+        self.service.JoinGroup(chat_pb2.JoinGroupRequest(username="bob", group="team"), MagicMock())
+        context = FakeStreamContext()
+        stream = self.service.Subscribe(chat_pb2.SubscribeRequest(username="bob"), context)
+        thread, result = self.next_in_thread(stream)
+        self.service.SendGroupMessage(chat_pb2.SendGroupMessageRequest(sender="alice", group="team", content="standup"), MagicMock())
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual((result["value"].message.group, result["value"].message.content), ("team", "standup"))
+        self.assertEqual(server.storage.group_unread_count("bob"), 0)
+        self.assertEqual(server.storage.group_unread_count("alice"), 1)
+        context.cancel()
+        self.assertEqual(list(stream), [])
+        self.assertNotIn("bob", server.group_fanout.users)
+
+    #unknown users get NOT_FOUND and an empty stream
+    def test_subscribe_unknown_user(self):
+        context = MagicMock()
+        stream = self.service.Subscribe(chat_pb2.SubscribeRequest(username="nobody"), context)
+        self.assertEqual(list(stream), [])
+        context.set_code.assert_called_once()
+
+
+class TestStreamedSends(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        server.groups.clear()
+        self.service = ChatService()
+        for name in ("alice", "bob"):
+            make_user(name, "pw")
+
+    def stream_requests(self):
+        return [
+            chat_pb2.SendMessageRequest(sender="alice", to="bob", content="s1"),
+            chat_pb2.SendMessageRequest(sender="ghost", to="bob", content="s2"),
+            chat_pb2.SendMessageRequest(sender="bob", to="alice", content="s3"),
+            chat_pb2.SendMessageRequest(sender="alice", to="nobody", content="s4")
+        ]
+
+    def test_send_message_stream(self):
+        response = self.service.SendMessageStream(iter(self.stream_requests()), MagicMock())
+        self.assertEqual((response.sent_count, response.failed_count), (2, 2))
+        self.assertEqual([m["content"] for m in stored("bob")["unread"]], ["s1"])
+        self.assertEqual([m["content"] for m in stored("alice")["unread"]], ["s3"])
+
+    #a retried stream does not deliver the messages that already went through
+    def test_send_message_stream_request_ids(self):
+        requests = [chat_pb2.SendMessageRequest(sender="alice", to="bob", content=f"s{i}", request_id=f"r{i}") for i in range(3)]
+        with patch.object(server, "sent_requests", DedupCache()):
+            self.service.SendMessageStream(iter(requests[:2]), MagicMock())
+            response = self.service.SendMessageStream(iter(requests), MagicMock())
+        self.assertEqual(response.sent_count, 3)
+        self.assertEqual([m["content"] for m in stored("bob")["unread"]], ["s0", "s1", "s2"])
+
+    def test_async_send_message_stream(self):
+        async def requests():
+            for request in self.stream_requests():
+                yield request
+        response = asyncio.run(AsyncChatService().SendMessageStream(requests(), MagicMock()))
+        self.assertEqual((response.sent_count, response.failed_count), (2, 2))
+
+    #a whole batch is committed to the write-ahead log once, at its last record
+    def test_batch_commits_log_once(self):
+        wal = MagicMock()
+        wal.append.side_effect = itertools.count(1)
+        request = chat_pb2.SendMessageBatchRequest(sender="alice", items=[chat_pb2.BatchItem(to="bob", content=str(i)) for i in range(5)])
+        with patch.object(server, "wal", wal):
+            self.service.SendMessageBatch(request, MagicMock())
+            self.service.SendMessageStream(iter([chat_pb2.SendMessageRequest(sender="alice", to="bob", content="x")] * 3), MagicMock())
+        self.assertEqual(wal.append.call_count, 8)
+        self.assertEqual([c.args for c in wal.commit.call_args_list], [(5,), (8,)])
+
+#calls AsyncChatService handlers with the same signature as ChatService, one event loop per call
+class AsyncServiceAdapter:
+    def __init__(self):
+        self.service = AsyncChatService()
+
+    def __getattr__(self, name):
+        handler = getattr(self.service, name)
+        return lambda request, context: asyncio.run(handler(request, context))
+
+#the whole TestChatService suite again, against the asyncio handlers
+class TestAsyncChatService(TestChatService):
+
+    def setUp(self):
+        super().setUp()
+        self.service = AsyncServiceAdapter()
+
+
+class TestAsyncServer(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        server.groups.clear()
+
+    #a real grpc.aio server: unary calls plus a pushed message on an async Subscribe stream
+    def test_async_server_round_trip(self):
+        async def scenario():
+            server = grpc.aio.server()
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncChatService(), server)
+            port = server.add_insecure_port("localhost:0")
+            await server.start()
+            try:
+                async with grpc.aio.insecure_channel(f"localhost:{port}") as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    for name in ("alice", "bob"):
+                        response = await stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+                        self.assertTrue(response.success)
+                    stream = stub.Subscribe(chat_pb2.SubscribeRequest(username="bob"))
+                    first = asyncio.ensure_future(stream.read())
+                    await asyncio.sleep(0.1)
+                    response = await stub.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="async hello"))
+                    self.assertTrue(response.success)
+                    pushed = await asyncio.wait_for(first, timeout=5)
+                    stream.cancel()
+                    login = await stub.Login(chat_pb2.LoginRequest(username="bob", password="pw"))
+                    return pushed, login
+            finally:
+                await server.stop(0)
+
+        pushed, login = asyncio.run(scenario())
+        self.assertEqual(pushed.message.content, "async hello")
+        self.assertEqual(login.unread_count, 0)
+        self.assertEqual(len(stored("bob")["read"]), 1)
+
+    #deleting the account ends an async stream and drops its listener
+    def test_async_subscribe_ends_on_account_deletion(self):
+        make_user("bob", "pw")
+        watch = server.storage.watch("bob")
+
+        async def scenario():
+            stream = AsyncChatService().Subscribe(chat_pb2.SubscribeRequest(username="bob"), MagicMock())
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(watch.listeners), 1)
+            ChatService().DeleteAccount(chat_pb2.DeleteAccountRequest(username="bob"), MagicMock())
+            with self.assertRaises(StopAsyncIteration):
+                await asyncio.wait_for(pending, timeout=5)
+
+        asyncio.run(scenario())
+        self.assertEqual(len(watch.listeners), 0)
+
+#the suites above again, against the SQLite backend
+class TestSQLiteChatService(SQLiteBackend, TestChatService):
+    pass
+
+
+class TestSQLiteAsyncChatService(SQLiteBackend, TestAsyncChatService):
+    pass
+
+
+class TestSQLiteSubscribe(SQLiteBackend, TestSubscribe):
+    pass
+
+
+class TestSQLiteStreamedSends(SQLiteBackend, TestStreamedSends):
+
+    #SQLite commits its own transactions; nothing goes to the write-ahead log
+    def test_batch_commits_log_once(self):
+        wal = MagicMock()
+        request = chat_pb2.SendMessageBatchRequest(sender="alice", items=[chat_pb2.BatchItem(to="bob", content=str(i)) for i in range(5)])
+        with patch.object(server, "wal", wal):
+            self.service.SendMessageBatch(request, MagicMock())
+        wal.append.assert_not_called()
+        self.assertEqual(len(stored("bob")["unread"]), 5)
+
+
+class TestSQLiteAsyncServer(SQLiteBackend, TestAsyncServer):
+
+    #SQLite calls wait on the database file, so the async handlers and streams make them off the loop
+    def test_storage_calls_leave_the_loop(self):
+        make_user("bob", "pw", unread=[{"from": "alice", "content": f"m{i}", "timestamp": T0} for i in range(2)])
+        threads = []
+        take_unread = server.storage.take_unread
+
+        def recorded(*args):
+            threads.append(threading.get_ident())
+            return take_unread(*args)
+
+        async def scenario():
+            service = AsyncChatService()
+            await service.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username="bob", count=1), MagicMock())
+            stream = service.Subscribe(chat_pb2.SubscribeRequest(username="bob"), MagicMock())
+            pushed = await stream.__anext__()
+            await stream.aclose()
+            return threading.get_ident(), pushed
+
+        with patch.object(server.storage, "take_unread", recorded):
+            loop_thread, pushed = asyncio.run(scenario())
+        self.assertEqual(pushed.message.content, "m1")
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,125 @@
+import socket
+import threading
+import unittest
+from concurrent import futures
+
+import grpc
+
+import chat_pb2_grpc
+from auth import AuthInterceptor
+from chat_client import CallbackQueue, ChatClient
+from server import ChatService, sent_requests, sessions, users_db
+
+
+class TestChatClient(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        sessions.sessions.clear()
+        sent_requests.entries.clear()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), interceptors=[AuthInterceptor(sessions)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.target = f"localhost:{port}"
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop(0)
+
+    def client(self, name=None, **kwargs):
+        client = ChatClient(self.target, **kwargs)
+        self.clients.append(client)
+        if name:
+            self.assertTrue(client.create_account(name, "pw").result(timeout=10).success)
+            self.assertTrue(client.login(name, "pw").result(timeout=10).success)
+        return client
+
+    def test_login_keeps_the_session(self):
+        alice = self.client("alice")
+        self.assertEqual(alice.username, "alice")
+        self.assertTrue(alice.session_token)
+        self.assertEqual(sessions.lookup(alice.session_token), "alice")
+        alice.logout().result(timeout=10)
+        self.assertIsNone(alice.username)
+        self.assertIsNone(alice.session_token)
+
+    #calls return at once; many may be in flight on the one channel
+    def test_futures_share_one_channel(self):
+        alice = self.client("alice")
+        bob = self.client("bob")
+        sends = [alice.send_message("bob", f"hello {i}") for i in range(20)]
+        self.assertTrue(all(f.result(timeout=10).success for f in sends))
+        response = bob.read_new_messages().result(timeout=10)
+        self.assertEqual(sorted(m.content for m in response.messages), sorted(f"hello {i}" for i in range(20)))
+        batch = alice.send_batch([("bob", "x"), ("nobody", "y")]).result(timeout=10)
+        self.assertEqual([r.success for r in batch.results], [True, False])
+
+    #sends carry a request id; repeating it (a retry) delivers once
+    def test_send_retry_is_deduplicated(self):
+        alice = self.client("alice")
+        bob = self.client("bob")
+        first = alice.send_message("bob", "once", request_id="retry-1").result(timeout=10)
+        again = alice.send_message("bob", "once", request_id="retry-1").result(timeout=10)
+        self.assertEqual(first.message_id, again.message_id)
+        self.assertTrue(alice.send_message("bob", "fresh id").result(timeout=10).success)
+        response = bob.read_new_messages().result(timeout=10)
+        self.assertEqual([m.content for m in response.messages], ["once", "fresh id"])
+
+    #results reach the owner of the CallbackQueue only when it runs them
+    def test_callbacks_go_through_dispatch(self):
+        queue = CallbackQueue()
+        alice = self.client("alice", dispatch=queue.post)
+        seen = []
+        done = threading.Event()
+        future = alice.on_done(alice.list_accounts(), lambda response: seen.append(list(response.accounts)))
+        future.add_done_callback(lambda _: done.set())
+        self.assertTrue(done.wait(10))
+        self.assertEqual(seen, [])
+        queue.run_pending()
+        self.assertEqual(seen, [["alice"]])
+
+    def test_errors_reach_on_error(self):
+        client = self.client()
+        errors = []
+        done = threading.Event()
+        # no session: the interceptor refuses the call
+        client.on_done(client.list_messages(), lambda response: None, lambda e: (errors.append(e.code()), done.set()))
+        self.assertTrue(done.wait(10))
+        self.assertEqual(errors, [grpc.StatusCode.UNAUTHENTICATED])
+
+    #a peer that accepts the connection but never answers: the call ends at its deadline
+    def test_deadline(self):
+        with socket.socket() as silent:
+            silent.bind(("localhost", 0))
+            silent.listen()
+            client = ChatClient(f"localhost:{silent.getsockname()[1]}", deadline_s=0.2)
+            self.clients.append(client)
+            with self.assertRaises(grpc.RpcError) as caught:
+                client.get_stats().result(timeout=10)
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.DEADLINE_EXCEEDED)
+
+    def test_subscription_delivers(self):
+        alice = self.client("alice")
+        bob = self.client("bob")
+        received = []
+        arrived = threading.Event()
+
+        def on_message(message):
+            received.append(message.content)
+            arrived.set()
+        subscription = bob.subscribe(on_message)
+        try:
+            self.assertTrue(alice.send_message("bob", "pushed").result(timeout=10).success)
+            self.assertTrue(arrived.wait(10))
+            self.assertEqual(received, ["pushed"])
+        finally:
+            subscription.cancel()
+        subscription.thread.join(5)
+        self.assertFalse(subscription.thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
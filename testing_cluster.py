@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from partition import HashRing
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bearer(token):
+    return (("authorization", f"Bearer {token}"),)
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_balanced(self):
+        ring = HashRing(["n1", "n2", "n3"])
+        counts = Counter(ring.owner(f"user{i}") for i in range(9000))
+        self.assertEqual(set(counts), {0, 1, 2})
+        self.assertGreater(min(counts.values()), 2000)
+
+    #a joining node takes about its fair share, and only from the others: nobody moves between old nodes
+    def test_join_moves_only_to_new_node(self):
+        ring = HashRing(["n1", "n2", "n3"])
+        grown = ring.with_node("n4")
+        keys = [f"user{i}" for i in range(9000)]
+        moved = [k for k in keys if ring.owner(k) != grown.owner(k)]
+        self.assertTrue(all(grown.owner(k) == 3 for k in moved))
+        self.assertGreater(len(moved), 9000 * 0.15)
+        self.assertLess(len(moved), 9000 * 0.35)
+        self.assertEqual(ring.names, ["n1", "n2", "n3"])
+
+
+#real nodes on local ports; a third node joins a running two-node cluster
+class TestClusterJoin(unittest.TestCase):
+
+    def setUp(self):
+        self.workdirs = []
+        self.processes = []
+        self.channels = []
+        self.nodes = [{"name": f"n{i}", "address": f"127.0.0.1:{free_port()}"} for i in (1, 2, 3)]
+
+    def tearDown(self):
+        for channel in self.channels:
+            channel.close()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait(timeout=15)
+        for workdir in self.workdirs:
+            shutil.rmtree(workdir)
+
+    def start_node(self, index, known):
+        workdir = tempfile.mkdtemp()
+        self.workdirs.append(workdir)
+        with open(os.path.join(REPO_ROOT, "config.json")) as f:
+            config = json.load(f)
+        node = self.nodes[index]
+        config.update({"server_host": "127.0.0.1", "server_port": int(node["address"].rsplit(":", 1)[1]), "server_mode": "cluster"})
+        config["cluster"] = {"self": node["name"], "nodes": self.nodes[:known], "virtual_nodes": 64, "secret": "test-secret"}
+        config["auth"] = {"scrypt_n": 1024}
+        config["persistence"] = {"enabled": False}
+        config["rate_limits"] = {}
+        config["logging"] = {"level": "WARNING"}
+        with open(os.path.join(workdir, "config.json"), "w") as f:
+            json.dump(config, f)
+        self.processes.append(subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "server.py")], cwd=workdir,
+                                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        channel = grpc.insecure_channel(node["address"])
+        self.channels.append(channel)
+        return chat_pb2_grpc.ChatServiceStub(channel)
+
+    def test_join_hands_off_users(self):
+        n1 = self.start_node(0, known=2)
+        n2 = self.start_node(1, known=2)
+        names = [f"cu{i}" for i in range(30)]
+        tokens = {}
+        for i, name in enumerate(names):
+            stub = (n1, n2)[i % 2]
+            self.assertTrue(stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), wait_for_ready=True, timeout=20).success)
+            tokens[name] = stub.Login(chat_pb2.LoginRequest(username=name, password="pw")).session_token
+        for name in names:
+            response = n1.SendMessage(chat_pb2.SendMessageRequest(sender=names[0], to=name, content=f"hello {name}"), metadata=bearer(tokens[names[0]]))
+            self.assertTrue(response.success, response.message)
+        before = sum(n.GetStats(chat_pb2.GetStatsRequest()).users for n in (n1, n2))
+        self.assertEqual(before, len(names))
+
+        n3 = self.start_node(2, known=3)
+        expected = HashRing([n["name"] for n in self.nodes], 64)
+        moving = sum(1 for name in names if expected.owner(name) == 2)
+        self.assertTrue(0 < moving < len(names))
+        # both peers hand their share to n3
+        deadline = time.time() + 30
+        while n3.GetStats(chat_pb2.GetStatsRequest(), wait_for_ready=True, timeout=20).users < moving and time.time() < deadline:
+            time.sleep(0.1)
+        counts = [n.GetStats(chat_pb2.GetStatsRequest()).users for n in (n1, n2, n3)]
+        self.assertEqual(counts[2], moving)
+        self.assertEqual(sum(counts), len(names))
+
+        # every user keeps their session and inbox, whichever node is asked
+        for i, name in enumerate(names):
+            stub = (n1, n2, n3)[i % 3]
+            read = stub.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username=name), metadata=bearer(tokens[name]))
+            self.assertEqual([m.content for m in read.messages], [f"hello {name}"])
+        moved = next(name for name in names if expected.owner(name) == 2)
+        sent = n1.SendMessage(chat_pb2.SendMessageRequest(sender=names[0], to=moved, content="after join"), metadata=bearer(tokens[names[0]]))
+        self.assertTrue(sent.success)
+        first_id = n3.ListMessages(chat_pb2.ListMessagesRequest(username=moved), metadata=bearer(tokens[moved])).messages[0].id
+        self.assertGreater(sent.message_id, first_id)
+
+    #accounts created on any node while a handoff runs end up on their owner, once
+    def test_create_during_join(self):
+        n1 = self.start_node(0, known=2)
+        n2 = self.start_node(1, known=2)
+        existing = [f"old{i}" for i in range(120)]
+        for i, name in enumerate(existing):
+            stub = (n1, n2)[i % 2]
+            self.assertTrue(stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), wait_for_ready=True, timeout=20).success)
+
+        n3 = self.start_node(2, known=3)
+        stubs = (n1, n2, n3)
+        names = [f"new{i}" for i in range(60)]
+
+        def create(i):
+            return stubs[i % 3].CreateAccount(chat_pb2.CreateAccountRequest(username=names[i], password="pw"), wait_for_ready=True, timeout=30)
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            results = list(pool.map(create, range(len(names))))
+        self.assertTrue(all(r.success for r in results), [r.message for r in results if not r.success])
+
+        expected = HashRing([n["name"] for n in self.nodes], 64)
+        owned = sum(1 for name in existing + names if expected.owner(name) == 2)
+        deadline = time.time() + 30
+        while n3.GetStats(chat_pb2.GetStatsRequest(), timeout=20).users < owned and time.time() < deadline:
+            time.sleep(0.1)
+        counts = [n.GetStats(chat_pb2.GetStatsRequest()).users for n in stubs]
+        self.assertEqual(counts[2], owned)
+        self.assertEqual(sum(counts), len(existing) + len(names))
+        for i, name in enumerate(names):
+            stub = stubs[(i + 1) % 3]
+            self.assertTrue(stub.Login(chat_pb2.LoginRequest(username=name, password="pw")).success)
+            self.assertFalse(stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw")).success)
+
+
+if __name__ == "__main__":
+    unittest.main()
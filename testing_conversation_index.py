@@ -0,0 +1,57 @@
+import unittest
+
+from inbox import Inbox, Message
+from conversation_index import ConversationIndex
+
+T0 = 1735732800000
+
+
+class TestConversationIndex(unittest.TestCase):
+
+    def page_ids(self, index, peer, **cursors):
+        messages, has_older, has_newer = index.page(peer, **cursors)
+        return [m.id for m in messages], has_older, has_newer
+
+    #received and sent messages interleave by id, and pages are cut from either end
+    def test_page(self):
+        index = ConversationIndex([Message(1, "bob", "hi", T0), Message(4, "bob", "lunch?", T0), Message(5, "carol", "x", T0)],
+                                  [("bob", Message(2, "alice", "hi bob", T0)), ("bob", Message(7, "alice", "sure", T0))])
+        self.assertEqual(self.page_ids(index, "bob"), ([1, 2, 4, 7], False, False))
+        self.assertEqual(self.page_ids(index, "bob", limit=3), ([2, 4, 7], True, False))
+        self.assertEqual(self.page_ids(index, "bob", before_id=4, limit=3), ([1, 2], False, True))
+        self.assertEqual(self.page_ids(index, "bob", after_id=1, limit=2), ([2, 4], True, True))
+        self.assertEqual(self.page_ids(index, "bob", after_id=2, before_id=7), ([4], True, True))
+        self.assertEqual(self.page_ids(index, "bob", after_id=7), ([], True, False))
+        self.assertEqual(self.page_ids(index, "carol"), ([5], False, False))
+        self.assertEqual(self.page_ids(index, "dave"), ([], False, False))
+
+    #a removed message leaves no ids behind, and peers with no messages left are dropped
+    def test_remove(self):
+        index = ConversationIndex([Message(1, "bob", "hi", T0)], [("carol", Message(2, "alice", "hi", T0))])
+        index.remove(2)
+        index.remove(9)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(set(index.conversations), {"bob"})
+
+    #the inbox builds its index on first use and keeps it in step with sends, receives and deletes
+    def test_inbox_keeps_index(self):
+        inbox = Inbox()
+        inbox.append(Message(1, "bob", "hi", T0))
+        inbox.add_sent("bob", Message(2, "alice", "hi bob", T0))
+        self.assertIsNone(inbox.conversations)
+        index = inbox.conversation_index()
+        self.assertEqual(self.page_ids(index, "bob"), ([1, 2], False, False))
+        inbox.take_unread(0)
+        inbox.append(Message(3, "bob", "lunch?", T0))
+        inbox.add_sent("bob", Message(4, "alice", "sure", T0))
+        self.assertEqual(inbox.delete_ids([2, 3]), 2)
+        self.assertEqual(self.page_ids(index, "bob"), ([1, 4], False, False))
+        # sent copies are not mail
+        self.assertEqual(len(inbox), 1)
+        inbox.clear()
+        self.assertIsNone(inbox.conversations)
+        self.assertEqual(inbox.sent, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+
+from dedup import DedupCache
+
+
+class TestDedupCache(unittest.TestCase):
+
+    def test_repeat_returns_first_response(self):
+        cache = DedupCache()
+        calls = []
+        first = cache.run(("alice", "r1"), lambda: calls.append(1) or "sent")
+        again = cache.run(("alice", "r1"), lambda: calls.append(2) or "sent again")
+        other = cache.run(("bob", "r1"), lambda: calls.append(3) or "bob's")
+        self.assertEqual((first, again, other), ("sent", "sent", "bob's"))
+        self.assertEqual(calls, [1, 3])
+        self.assertEqual(cache.hits, 1)
+
+    #a repeat arriving while the first call runs waits for it instead of running too
+    def test_concurrent_repeats_run_once(self):
+        cache = DedupCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "sent"
+        results = []
+        first = threading.Thread(target=lambda: results.append(cache.run("k", slow)))
+        first.start()
+        self.assertTrue(started.wait(5))
+        second = threading.Thread(target=lambda: results.append(cache.run("k", slow)))
+        second.start()
+        time.sleep(0.05)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, ["sent", "sent"])
+        self.assertEqual(calls, [1])
+
+    #a call that raises is forgotten, so its retry runs
+    def test_failed_call_is_not_cached(self):
+        cache = DedupCache()
+
+        def fail():
+            raise RuntimeError("unavailable")
+        with self.assertRaises(RuntimeError):
+            cache.run("k", fail)
+        self.assertEqual(cache.run("k", lambda: "sent"), "sent")
+
+    def test_expiry_and_capacity(self):
+        cache = DedupCache(ttl_s=0, max_entries=2)
+        cache.run("k", lambda: "first")
+        time.sleep(0.01)
+        self.assertEqual(cache.run("k", lambda: "second"), "second")
+        cache = DedupCache(ttl_s=60, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.run(key, lambda: key)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.run("a", lambda: "a again"), "a again")
+        self.assertEqual(cache.run("c", lambda: "c again"), "c")
+
+
+    #a running call is never evicted, and does not keep expired entries behind it alive
+    def test_running_call_survives_eviction(self):
+        cache = DedupCache(ttl_s=0.05, max_entries=3)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "sent"
+        first = threading.Thread(target=cache.run, args=("slow", slow))
+        first.start()
+        self.assertTrue(started.wait(5))
+        cache.run("a", lambda: "a")
+        cache.run("b", lambda: "b")
+        time.sleep(0.1)
+        cache.run("c", lambda: "c")
+        self.assertEqual(set(cache.running), {"slow"})
+        self.assertEqual(list(cache.entries), ["c"])
+        for key in ("d", "e", "f"):
+            cache.run(key, lambda: key)
+        self.assertIn("slow", cache.running)
+        self.assertLessEqual(len(cache), 3)
+        repeat = threading.Thread(target=cache.run, args=("slow", slow))
+        repeat.start()
+        release.set()
+        first.join(5)
+        repeat.join(5)
+        self.assertEqual(calls, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+from groups import GroupFanout, GroupStore, NotAMember, UnknownGroup
+from inbox import InboxSignals
+
+T0 = 1735732800000
+
+
+class TestGroupStore(unittest.TestCase):
+
+    def setUp(self):
+        self.ids = iter(range(1, 1000))
+        self.records = []
+        self.groups = GroupStore(max_history=10)
+
+    def log(self, record):
+        self.records.append(record)
+        return len(self.records)
+
+    def send(self, name, sender, content):
+        return self.groups.append(name, sender, content, T0, lambda: next(self.ids), self.log)[0]
+
+    #a message is stored once; each member only has a cursor, and a new member starts at the end
+    def test_cursors(self):
+        self.assertEqual(self.groups.create("team", "alice", self.log), (True, 1))
+        self.assertEqual(self.groups.create("team", "bob", self.log), (False, 0))
+        self.send("team", "alice", "before bob")
+        self.groups.join("team", "bob", self.log)
+        message = self.send("team", "alice", "hello")
+        self.assertIs(self.groups.groups["team"].messages[-1], message)
+        self.assertEqual(self.groups.unread_count("alice"), 2)
+        self.assertEqual(self.groups.unread_count("bob"), 1)
+        taken, seq = self.groups.take_unread("bob", 0, self.log)
+        self.assertEqual(taken, [("team", message)])
+        self.assertEqual(self.records[seq - 1], {"op": "group_read", "user": "bob", "cursors": {"team": 2}})
+        self.assertEqual(self.groups.take_unread("bob", 0, self.log), ([], 0))
+        with self.assertRaises(UnknownGroup):
+            self.groups.join("nope", "bob", self.log)
+        with self.assertRaises(NotAMember):
+            self.send("team", "carol", "hi")
+
+    #unread mail from several groups comes oldest first, and `count` stops partway
+    def test_take_across_groups(self):
+        for name in ("a", "b"):
+            self.groups.create(name, "alice", self.log)
+        for name in ("b", "a", "b"):
+            self.send(name, "alice", name)
+        taken, _ = self.groups.take_unread("alice", 2, self.log)
+        self.assertEqual([(name, m.id) for name, m in taken], [("b", 1), ("a", 2)])
+        self.assertEqual([(name, m.id) for name, m in self.groups.take_unread("alice", 0, self.log)[0]], [("b", 3)])
+
+    #history is capped; a member who fell behind gets what is left
+    def test_history_cap(self):
+        self.groups.create("team", "alice", self.log)
+        for i in range(25):
+            self.send("team", "alice", str(i))
+        self.assertLessEqual(len(self.groups.groups["team"].messages), 10)
+        taken, _ = self.groups.take_unread("alice", 0, self.log)
+        self.assertEqual(taken[-1][1].content, "24")
+
+    def test_forget_user_and_dump(self):
+        self.groups.create("team", "alice", self.log)
+        self.groups.join("team", "bob", self.log)
+        self.send("team", "bob", "hi")
+        self.groups.forget_user("bob")
+        self.assertEqual(self.groups.groups_of("bob"), [])
+        copy = GroupStore()
+        copy.load(self.groups.dump())
+        self.assertEqual(copy.dump(), self.groups.dump())
+        self.assertEqual(copy.groups_of("alice"), ["team"])
+        self.assertEqual(copy.last_message_id(), 1)
+
+
+class TestGroupFanout(unittest.TestCase):
+
+    #a send wakes the online members only, and a stream that closes stops being woken
+    def test_notify_online_members(self):
+        fanout = GroupFanout()
+        alice, bob = InboxSignals(), InboxSignals()
+        woken = []
+        alice.listeners.add(lambda: woken.append("alice"))
+        bob.listeners.add(lambda: woken.append("bob"))
+        fanout.subscribe("alice", alice)
+        fanout.joined("team", "alice")
+        fanout.joined("team", "carol")
+        fanout.notify("team")
+        self.assertEqual(woken, ["alice"])
+        self.assertTrue(alice.group_mail)
+        fanout.unsubscribe("alice", alice)
+        fanout.notify("team")
+        self.assertEqual(woken, ["alice"])
+        self.assertEqual(fanout.online, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import glob
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+from log_pipeline import NonBlockingQueueHandler, SamplingFilter, rpc_log, start_logging
+
+
+class TestLogPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.root = logging.getLogger()
+        self.saved = (self.root.handlers[:], self.root.level, rpc_log.filters[:])
+
+    def tearDown(self):
+        handlers, level, filters = self.saved
+        self.root.handlers[:] = handlers
+        self.root.setLevel(level)
+        rpc_log.filters[:] = filters
+        shutil.rmtree(self.log_dir)
+
+    def read_log(self):
+        [path] = glob.glob(os.path.join(self.log_dir, "chat_server_*.log"))
+        with open(path) as f:
+            return f.read()
+
+    #records reach the file through the background listener, formatted there
+    def test_records_are_written_by_listener(self):
+        listener = start_logging({"level": "INFO"}, log_dir=self.log_dir)
+        rpc_log.info("Message from '%s' to '%s' sent", "alice", "bob")
+        rpc_log.debug("not at this level")
+        listener.stop()
+        contents = self.read_log()
+        self.assertIn("Chat Server started.", contents)
+        self.assertIn("[INFO] Message from 'alice' to 'bob' sent", contents)
+        self.assertNotIn("not at this level", contents)
+
+    #sampling drops low-level per-RPC lines but never warnings
+    def test_sampling(self):
+        listener = start_logging({"level": "INFO", "rpc_sample_rate": 0.0}, log_dir=self.log_dir)
+        rpc_log.info("sampled away")
+        rpc_log.warning("always kept")
+        listener.stop()
+        contents = self.read_log()
+        self.assertNotIn("sampled away", contents)
+        self.assertIn("always kept", contents)
+        self.assertTrue(SamplingFilter(1.0).filter(logging.makeLogRecord({"levelno": logging.INFO})))
+
+    #the request thread neither formats records nor waits when the queue is full
+    def test_handler_is_lazy_and_never_blocks(self):
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        record = logging.makeLogRecord({"msg": "%s sent", "args": ("alice",), "levelno": logging.INFO})
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(handler.dropped, 1)
+        queued = handler.queue.get_nowait()
+        self.assertEqual((queued.msg, queued.args), ("%s sent", ("alice",)))
+
+
+if __name__ == '__main__':
+    unittest.main()
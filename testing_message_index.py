@@ -0,0 +1,66 @@
+import unittest
+
+from inbox import Inbox, Message
+from message_index import MessageIndex, words
+
+T0 = 1735732800000
+
+
+class TestMessageIndex(unittest.TestCase):
+
+    def test_words(self):
+        self.assertEqual(words("Lunch at NOON? lunch_time, café 42"), {"lunch", "at", "noon", "time", "café", "42"})
+        self.assertEqual(words("?!"), set())
+
+    #ids arriving out of order still come back newest first
+    def test_search_order(self):
+        index = MessageIndex([Message(5, "bob", "lunch", T0), Message(2, "bob", "lunch", T0), Message(9, "carol", "lunch", T0)])
+        self.assertEqual([m.id for m in index.search({"lunch"})[0]], [9, 5, 2])
+        self.assertEqual([m.id for m in index.search({"lunch"}, before_id=9)[0]], [5, 2])
+        self.assertEqual(index.search({"lunch"}, sender="dave"), ([], 0))
+        self.assertEqual(index.search({"lunch", "dinner"}), ([], 0))
+
+    #a date range stops the walk at its older end and starts it at its newer one
+    def test_search_dates(self):
+        day = 86400000
+        index = MessageIndex([Message(i, "bob", "lunch", T0 + i * day) for i in range(1, 11)])
+        self.assertEqual([m.id for m in index.search({"lunch"}, since_ms=T0 + 4 * day, until_ms=T0 + 8 * day)[0]], [7, 6, 5, 4])
+        self.assertEqual(index.search({"lunch"}, since_ms=T0 + 4 * day, until_ms=T0 + 8 * day, before_id=6, page_size=1),
+                         ([index.messages[5]], 5))
+        self.assertEqual([m.id for m in index.search({"lunch"}, until_ms=T0 + 3 * day)[0]], [2, 1])
+        self.assertEqual(index.search({"lunch"}, since_ms=T0 + 11 * day), ([], 0))
+
+    #timestamps need not rise with ids (shared batch timestamps, remote clocks): the range is checked per message
+    def test_search_dates_out_of_order(self):
+        stamps = {1: T0 + 5, 2: T0 + 1, 3: T0 + 9, 4: T0 + 3, 5: T0 + 7, 6: T0 + 2}
+        index = MessageIndex([Message(i, "bob", "lunch", stamp) for i, stamp in stamps.items()])
+        self.assertEqual([m.id for m in index.search({"lunch"}, since_ms=T0 + 3, until_ms=T0 + 8)[0]], [5, 4, 1])
+        self.assertEqual([m.id for m in index.search({"lunch"}, until_ms=T0 + 3)[0]], [6, 2])
+        self.assertEqual(index.search({"lunch"}, since_ms=T0 + 3, page_size=2), ([index.messages[5], index.messages[4]], 4))
+
+    #a removed message leaves no ids behind, and words and senders with no messages left are dropped
+    def test_remove(self):
+        index = MessageIndex([Message(1, "bob", "lunch today", T0), Message(2, "carol", "lunch", T0)])
+        index.remove(1)
+        index.remove(7)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(set(index.postings), {"lunch"})
+        self.assertEqual(set(index.senders), {"carol"})
+        self.assertEqual(index.ids, [2])
+
+    #the inbox builds its index on the first search and keeps it in step afterwards
+    def test_inbox_keeps_index(self):
+        inbox = Inbox()
+        inbox.append(Message(1, "bob", "lunch", T0))
+        self.assertIsNone(inbox.index)
+        index = inbox.search_index()
+        inbox.append(Message(2, "bob", "lunch again", T0))
+        inbox.take_unread(1)
+        inbox.delete_ids([1])
+        self.assertEqual([m.id for m in index.search({"lunch"})[0]], [2])
+        inbox.clear()
+        self.assertEqual(inbox.search_index().search({"lunch"}), ([], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+import urllib.request
+from concurrent import futures
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from metrics import BUCKETS, AsyncMetricsInterceptor, Metrics, MetricsInterceptor, MethodStats
+from server import AsyncChatService, ChatService, metrics, users_db
+
+
+class TestMethodStats(unittest.TestCase):
+
+    #percentiles report the upper bound of the bucket they fall in
+    def test_percentile(self):
+        stats = MethodStats()
+        for _ in range(90):
+            stats.observe(0.00004, False)
+        for _ in range(10):
+            stats.observe(0.003, True)
+        self.assertEqual(stats.count, 100)
+        self.assertEqual(stats.errors, 10)
+        self.assertEqual(stats.percentile(50), BUCKETS[0])
+        self.assertGreaterEqual(stats.percentile(99), 0.003)
+        self.assertLess(stats.percentile(99), 0.007)
+        self.assertEqual(MethodStats().percentile(99), 0.0)
+
+    def test_prometheus_text(self):
+        m = Metrics()
+        m.method("Login").observe(0.001, False)
+        m.gauge("users", lambda: 3)
+        text = m.prometheus_text()
+        self.assertIn('chat_rpc_requests_total{method="Login"} 1', text)
+        self.assertIn('chat_rpc_latency_seconds_bucket{method="Login",le="+Inf"} 1', text)
+        self.assertIn("chat_users 3", text)
+        self.assertIn("chat_in_flight 0", text)
+
+    def test_http_endpoint(self):
+        m = Metrics()
+        m.method("Login").observe(0.001, False)
+        httpd = m.start_http(0)
+        try:
+            port = httpd.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+                body = response.read().decode()
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        self.assertIn('chat_rpc_requests_total{method="Login"} 1', body)
+
+
+class TestMetricsInterceptor(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        metrics.methods.clear()
+
+    #every call through the interceptor is counted and GetStats reports it
+    def test_threaded_server_records_calls(self):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), interceptors=[MetricsInterceptor(metrics)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), server)
+        port = server.add_insecure_port("localhost:0")
+        server.start()
+        try:
+            with grpc.insecure_channel(f"localhost:{port}") as channel:
+                stub = chat_pb2_grpc.ChatServiceStub(channel)
+                stub.CreateAccount(chat_pb2.CreateAccountRequest(username="alice", password="pw"))
+                stub.CreateAccount(chat_pb2.CreateAccountRequest(username="bob", password="pw"))
+                for _ in range(3):
+                    stub.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="hi"))
+                stats = stub.GetStats(chat_pb2.GetStatsRequest())
+        finally:
+            server.stop(0)
+
+        by_name = {m.method: m for m in stats.methods}
+        self.assertEqual(by_name["CreateAccount"].count, 2)
+        self.assertEqual(by_name["SendMessage"].count, 3)
+        self.assertEqual(by_name["SendMessage"].errors, 0)
+        self.assertGreater(by_name["SendMessage"].p99_ms, 0)
+        self.assertEqual(stats.users, 2)
+        self.assertEqual(stats.stored_messages, 3)
+        self.assertEqual(stats.max_inbox_size, 3)
+        # GetStats itself is in flight while it reads the gauges
+        self.assertEqual(stats.in_flight, 1)
+        self.assertEqual(metrics.in_flight, 0)
+
+    def test_async_server_records_calls(self):
+        async def scenario():
+            server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor(metrics)])
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncChatService(), server)
+            port = server.add_insecure_port("localhost:0")
+            await server.start()
+            try:
+                async with grpc.aio.insecure_channel(f"localhost:{port}") as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    await stub.CreateAccount(chat_pb2.CreateAccountRequest(username="alice", password="pw"))
+                    await stub.Login(chat_pb2.LoginRequest(username="alice", password="pw"))
+                    return await stub.GetStats(chat_pb2.GetStatsRequest())
+            finally:
+                await server.stop(0)
+
+        stats = asyncio.run(scenario())
+        by_name = {m.method: m for m in stats.methods}
+        self.assertEqual(by_name["Login"].count, 1)
+        self.assertEqual(stats.users, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from unittest.mock import MagicMock
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+import server
+from chat_client import ChatClient, redirect_target
+from partition import PEER_HEADER, SECRET_HEADER, Partitioning, forwarded_metadata, merge_pages, partition_of
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bearer(token):
+    return (("authorization", f"Bearer {token}"),)
+
+
+class TestPartitioning(unittest.TestCase):
+
+    def tearDown(self):
+        server.partitions = None
+
+    #stable across processes and spread evenly
+    def test_partition_of(self):
+        self.assertEqual(partition_of("alice", 4), partition_of("alice", 4))
+        counts = Counter(partition_of(f"user{i}", 4) for i in range(4000))
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertGreater(min(counts.values()), 800)
+
+    #each worker hands out its own residue class of ids, resuming after a recovered id
+    def test_message_ids_per_worker(self):
+        seen = set()
+        for index in range(3):
+            server.partitions = Partitioning(index, ["a", "b", "c"], "secret")
+            next_id = server.message_ids(after=10)
+            ids = [next_id() for _ in range(5)]
+            self.assertTrue(all(i > 10 for i in ids))
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len({i % 3 for i in ids}), 1)
+            seen.update(ids)
+        self.assertEqual(len(seen), 15)
+
+    def test_merge_pages(self):
+        pages = [["alice", "Carol"], ["bob", "dave"], []]
+        self.assertEqual(merge_pages(pages, 3), (["alice", "bob", "Carol"], "Carol"))
+        self.assertEqual(merge_pages(pages, 0), (["alice", "bob", "Carol", "dave"], ""))
+
+
+    #a forwarded call carries the client's address; only a call with the secret can claim one
+    def test_forwarded_calls_keep_the_client_peer(self):
+        partitions = Partitioning(0, ["a", "b"], "secret")
+        client = MagicMock()
+        client.peer.return_value = "ipv4:10.0.0.7:5000"
+        client.invocation_metadata.return_value = (("authorization", "Bearer t"), (PEER_HEADER, "ipv4:6.6.6.6:1"))
+        metadata = forwarded_metadata(client, partitions)
+        self.assertEqual(metadata, (("authorization", "Bearer t"), (SECRET_HEADER, "secret"), (PEER_HEADER, "ipv4:10.0.0.7:5000")))
+        self.assertEqual(partitions.client_peer(client), "ipv4:10.0.0.7:5000")
+        owner = MagicMock()
+        owner.peer.return_value = "ipv4:127.0.0.1:6000"
+        owner.invocation_metadata.return_value = metadata
+        self.assertEqual(partitions.client_peer(owner), "ipv4:10.0.0.7:5000")
+
+
+#a real supervisor with two worker processes on local ports
+class TestMultiprocessServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        port = free_port()
+        worker_base_port = free_port()
+        with open(os.path.join(REPO_ROOT, "config.json")) as f:
+            config = json.load(f)
+        config.update({
+            "server_host": "127.0.0.1", "server_port": port, "server_mode": "multiprocess",
+            "workers": 2, "worker_base_port": worker_base_port,
+        })
+        config["auth"] = {"scrypt_n": 1024}
+        config["persistence"] = {"enabled": False}
+        config["rate_limits"] = {}
+        config["logging"] = {"level": "WARNING"}
+        with open(os.path.join(cls.workdir, "config.json"), "w") as f:
+            json.dump(config, f)
+        cls.process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "server.py")], cwd=cls.workdir,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.target = f"127.0.0.1:{port}"
+        cls.worker_addresses = [f"127.0.0.1:{worker_base_port + i}" for i in range(2)]
+        cls.channel = grpc.insecure_channel(cls.target)
+        cls.stub = chat_pb2_grpc.ChatServiceStub(cls.channel)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.channel.close()
+        cls.process.terminate()
+        cls.process.wait(timeout=15)
+        shutil.rmtree(cls.workdir)
+
+    def test_cross_partition_traffic(self):
+        # names spread over both workers
+        names = [f"mp{i}" for i in range(8)]
+        self.assertEqual({partition_of(n, 2) for n in names}, {0, 1})
+        tokens = {}
+        for name in names:
+            created = self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), wait_for_ready=True, timeout=20)
+            self.assertTrue(created.success)
+            tokens[name] = self.stub.Login(chat_pb2.LoginRequest(username=name, password="pw"), wait_for_ready=True).session_token
+
+        duplicate = self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username="mp0", password="pw"))
+        self.assertFalse(duplicate.success)
+
+        sender = names[0]
+        for name in names[1:]:
+            response = self.stub.SendMessage(chat_pb2.SendMessageRequest(sender=sender, to=name, content=f"to {name}"),
+                                             metadata=bearer(tokens[sender]))
+            self.assertTrue(response.success, response.message)
+        batch = self.stub.SendMessageBatch(chat_pb2.SendMessageBatchRequest(
+            sender=sender, items=[chat_pb2.BatchItem(to=name, content="batch") for name in names[1:]] + [chat_pb2.BatchItem(to="ghost", content="x")]),
+            metadata=bearer(tokens[sender]))
+        self.assertEqual(batch.sent_count, len(names) - 1)
+        self.assertFalse(batch.results[-1].success)
+
+        ids = set()
+        for name in names[1:]:
+            read = self.stub.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username=name), metadata=bearer(tokens[name]))
+            self.assertEqual([m.content for m in read.messages], [f"to {name}", "batch"])
+            ids.update(m.id for m in read.messages)
+        self.assertEqual(len(ids), 2 * (len(names) - 1))
+
+        # the sender keeps its copies of what it sent, whichever worker stored the recipient's
+        for name in names[1:]:
+            conversation = self.stub.ConversationHistory(chat_pb2.ConversationHistoryRequest(username=sender, peer=name),
+                                                         metadata=bearer(tokens[sender]))
+            self.assertEqual([(m.sender, m.content) for m in conversation.messages], [(sender, f"to {name}"), (sender, "batch")])
+
+        # a session from one worker is honoured whichever worker the call reaches, and only for its user
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.stub.ListMessages(chat_pb2.ListMessagesRequest(username=names[1]), metadata=bearer(tokens[sender]))
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+
+        # push delivery works for users on either worker: a stream reaching the other worker is sent to the owner
+        for name in (names[1], next(n for n in names if partition_of(n, 2) != partition_of(names[1], 2) and n != sender)):
+            client = ChatClient(self.target)
+            client.username, client.session_token = name, tokens[name]
+            pushed = queue.Queue()
+            subscription = client.subscribe(pushed.put)
+            self.stub.SendMessage(chat_pb2.SendMessageRequest(sender=sender, to=name, content="pushed"), metadata=bearer(tokens[sender]))
+            self.assertEqual(pushed.get(timeout=10).content, "pushed")
+            subscription.cancel()
+            client.close()
+        redirected = None
+        for name in names:
+            stream = self.stub.Subscribe(chat_pb2.SubscribeRequest(username=name), metadata=bearer(tokens[name]))
+            try:
+                self.stub.SendMessage(chat_pb2.SendMessageRequest(sender=sender, to=name, content="direct"), metadata=bearer(tokens[sender]))
+                next(stream)
+            except grpc.RpcError as e:
+                redirected = e
+                break
+            finally:
+                stream.cancel()
+        self.assertEqual(redirected.code(), grpc.StatusCode.FAILED_PRECONDITION)
+        self.assertIn(redirect_target(redirected, self.target), self.worker_addresses)
+
+        first = self.stub.ListAccounts(chat_pb2.ListAccountsRequest(username=sender, pattern="mp*", page_size=5), metadata=bearer(tokens[sender]))
+        rest = self.stub.ListAccounts(chat_pb2.ListAccountsRequest(username=sender, pattern="mp*", page_size=5, page_token=first.next_page_token),
+                                      metadata=bearer(tokens[sender]))
+        self.assertEqual(list(first.accounts) + list(rest.accounts), sorted(names))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import chat_pb2
+
+import server
+from server import ChatService, users_db
+from persistence import WriteAheadLog, dump_users
+from inbox import Message
+from groups import GroupStore
+
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    #every test gets a fresh data directory and an empty users_db with logging switched on
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        users_db.clear()
+        server.groups.clear()
+        self.service = ChatService()
+        self.context = MagicMock()
+        server.wal = self.open_wal()
+
+    def tearDown(self):
+        if server.wal is not None:
+            server.wal.close()
+            server.wal = None
+        users_db.clear()
+        server.groups.clear()
+        shutil.rmtree(self.data_dir)
+
+    def open_wal(self, db=None, fsync="always", groups=None):
+        wal = WriteAheadLog(self.data_dir, fsync=fsync, fsync_interval_ms=1, snapshot_interval_s=3600)
+        wal.recover({} if db is None else db, groups)
+        wal.start()
+        return wal
+
+    #restart: close the log and rebuild a fresh users dict from disk
+    def restart(self):
+        server.wal.close()
+        recovered = {}
+        server.wal = self.open_wal(recovered)
+        return recovered
+
+    #runs the usual account/message lifecycle through the handlers
+    def run_workload(self):
+        for name in ("alice", "bob", "carol"):
+            self.service.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), self.context)
+        for i in range(5):
+            self.service.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content=f"m{i}"), self.context)
+        self.service.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username="bob", count=3), self.context)
+        read = self.service.ListMessages(chat_pb2.ListMessagesRequest(username="bob"), self.context).messages
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="bob", message_ids=[read[1].id]), self.context)
+        self.service.SendMessage(chat_pb2.SendMessageRequest(sender="bob", to="carol", content="bye"), self.context)
+        self.service.DeleteAccount(chat_pb2.DeleteAccountRequest(username="carol"), self.context)
+
+    #replaying the log reproduces the exact users_db state
+    def test_replay_log_tail(self):
+        self.run_workload()
+        expected = dump_users(users_db)
+        recovered = self.restart()
+        self.assertEqual(dump_users(recovered), expected)
+        self.assertEqual(recovered["bob"]["inbox"].unread_count, 2)
+        self.assertEqual([m.content for m in recovered["bob"]["inbox"].read_messages()], ["m0", "m2"])
+
+    #recovered messages are compact records sharing one copy of each sender name
+    def test_recovered_messages_share_sender(self):
+        self.run_workload()
+        messages = list(self.restart()["bob"]["inbox"])
+        self.assertTrue(all(isinstance(m, Message) for m in messages))
+        self.assertEqual(len({id(m.sender) for m in messages}), 1)
+
+    #message ids keep increasing across restarts, even after the newest message is deleted
+    def test_message_ids_resume_after_restart(self):
+        self.run_workload()
+        last_id = server.next_message_id() - 1
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="bob", delete_all=True), self.context)
+        server.wal.compact()
+        self.restart()
+        self.assertEqual(server.wal.last_message_id, last_id)
+
+    #a user handed over by another cluster node is logged whole and replays with its message ids
+    def test_restore_record(self):
+        message = {"id": 900, "from": "alice", "content": "moved", "timestamp": 1}
+        server.wal.commit(server.wal.append({"op": "restore", "user": "dave", "password": "h", "read": [message], "unread": []}))
+        recovered = self.restart()
+        self.assertEqual([m.to_dict() for m in recovered["dave"]["inbox"].read_messages()], [message])
+        self.assertEqual(server.wal.last_message_id, 900)
+
+    #senders' copies come back from the log and from a snapshot, copies of remote deliveries ("sent") too
+    def test_sent_copies_survive_restart(self):
+        self.run_workload()
+        server.wal.commit(server.wal.append({"op": "sent", "user": "bob", "to": "zed", "id": 901, "content": "far", "timestamp": 1}))
+        recovered = self.restart()
+        self.assertEqual([m.content for _, m in recovered["alice"]["inbox"].sent.values()], [f"m{i}" for i in range(5)])
+        server.wal.compact()
+        recovered = self.restart()
+        messages, _, _ = recovered["bob"]["inbox"].conversation_index().page("zed")
+        self.assertEqual([(m.id, m.sender, m.content) for m in messages], [(901, "bob", "far")])
+        # the account of the peer is gone, bob's side of the conversation stays
+        self.assertEqual([m.content for m in recovered["bob"]["inbox"].conversation_index().page("carol")[0]], ["bye"])
+        self.assertEqual(server.wal.last_message_id, 901)
+
+    #compaction folds closed segments into a snapshot and deletes them
+    def test_compaction_then_recover(self):
+        self.run_workload()
+        server.wal.compact()
+        self.assertTrue(os.path.exists(os.path.join(self.data_dir, "snapshot.json")))
+        self.assertEqual(server.wal.segments(), [server.wal.segment])
+
+        self.service.SendMessage(chat_pb2.SendMessageRequest(sender="bob", to="alice", content="after snapshot"), self.context)
+        expected = dump_users(users_db)
+        recovered = self.restart()
+        self.assertEqual(dump_users(recovered), expected)
+
+    #groups, their messages and every member's cursor come back from the log and from a snapshot
+    def test_groups_survive_restart(self):
+        self.run_workload()
+        self.service.CreateGroup(chat_pb2.CreateGroupRequest(username="alice", group="team"), self.context)
+        self.service.JoinGroup(chat_pb2.JoinGroupRequest(username="bob", group="team"), self.context)
+        for i in range(3):
+            self.service.SendGroupMessage(chat_pb2.SendGroupMessageRequest(sender="alice", group="team", content=f"g{i}"), self.context)
+        self.service.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username="bob"), self.context)
+        expected = server.groups.dump()
+        for compact in (False, True):
+            if compact:
+                server.wal.compact()
+            server.wal.close()
+            recovered = GroupStore()
+            server.wal = self.open_wal({}, groups=recovered)
+            self.assertEqual(recovered.dump(), expected)
+            self.assertEqual(recovered.unread_count("bob"), 0)
+            self.assertEqual(recovered.unread_count("alice"), 3)
+            self.assertEqual(server.wal.last_message_id, max(m["id"] for m in expected["team"]["messages"]))
+
+    #a half-written last record (crash mid-write) is dropped, everything before it survives
+    def test_torn_tail_is_ignored(self):
+        self.run_workload()
+        expected = dump_users(users_db)
+        server.wal.close()
+        with open(server.wal.segment_path(server.wal.segment), "a") as f:
+            f.write('{"op":"send","from":"alice"')
+        recovered = {}
+        server.wal = self.open_wal(recovered)
+        self.assertEqual(dump_users(recovered), expected)
+
+    #batched and unsynced policies lose nothing on a clean shutdown
+    def test_batch_and_off_policies(self):
+        for policy in ("batch", "off"):
+            server.wal.close()
+            shutil.rmtree(self.data_dir)
+            users_db.clear()
+            server.wal = self.open_wal(fsync=policy)
+            self.run_workload()
+            expected = dump_users(users_db)
+            self.assertEqual(dump_users(self.restart()), expected)
+
+    def test_unknown_policy_rejected(self):
+        with self.assertRaises(ValueError):
+            WriteAheadLog(self.data_dir, fsync="sometimes")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import unittest
+
+import chat_pb2
+from profiling import Profiler, handler_codes, handler_stack
+from server import AsyncChatService, ChatService
+
+
+#a servicer whose SendMessage blocks until released, so a sample finds it mid-call
+class BlockingService:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def SendMessage(self, request, context):
+        return self.wait_for_storage()
+
+    def wait_for_storage(self):
+        self.release.wait(10)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        self.service = BlockingService()
+        self.handlers = handler_codes(["SendMessage", "Login"], BlockingService)
+        call = threading.Thread(target=self.service.SendMessage, args=(None, None))
+        call.start()
+        self.addCleanup(call.join)
+        # an idle thread that is not in a handler
+        idle = threading.Thread(target=self.service.release.wait, args=(10,))
+        idle.start()
+        self.addCleanup(idle.join)
+        self.addCleanup(self.service.release.set)
+
+    #every RPC of both servicers is known by its handler's code
+    def test_handler_codes(self):
+        methods = chat_pb2.DESCRIPTOR.services_by_name["ChatService"].methods_by_name
+        handlers = handler_codes(methods, ChatService, AsyncChatService)
+        self.assertEqual(handlers[ChatService.SendMessage.__code__], "SendMessage")
+        self.assertEqual(handlers[AsyncChatService.Subscribe.__code__], "Subscribe")
+        self.assertEqual(set(handlers.values()), set(methods))
+
+    #a sample keeps only threads inside a handler, from the handler frame down, tagged with the method
+    def test_sample(self):
+        profiler = Profiler(self.handlers, log_dir=self.log_dir)
+        profiler.sample()
+        self.assertEqual(len(profiler.samples), 1)
+        (method, stack), = profiler.samples
+        self.assertEqual(method, "SendMessage")
+        self.assertEqual([code.co_name for code in stack[:2]], ["SendMessage", "wait_for_storage"])
+        self.assertEqual(handler_stack(None, self.handlers), (None, ()))
+
+    #a window writes collapsed stacks and a pstats file that pstats can read
+    def test_window_writes_output(self):
+        profiler = Profiler(self.handlers, log_dir=self.log_dir, name="test", interval_ms=1, duration_s=0.2)
+        self.assertTrue(profiler.start())
+        self.assertFalse(profiler.start())
+        profiler.thread.join()
+        self.assertFalse(profiler.running)
+        collapsed, stats_path = profiler.written
+        self.assertEqual(os.path.dirname(collapsed), self.log_dir)
+        with open(collapsed) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith("SendMessage;testing_profiling.py:SendMessage;") for line in lines))
+        stats = pstats.Stats(stats_path).stats
+        handler = ("<rpc>", 0, "SendMessage")
+        wait = next(key for key in stats if key[2] == "wait_for_storage")
+        samples = sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+        self.assertEqual(stats[handler][1], samples)
+        self.assertAlmostEqual(stats[wait][3], samples * 0.001)
+
+    #stopping early still writes what was sampled
+    def test_stop(self):
+        profiler = Profiler(self.handlers, log_dir=self.log_dir, interval_ms=1, duration_s=60)
+        profiler.start()
+        profiler.stop()
+        self.assertFalse(profiler.running)
+        self.assertTrue(os.path.exists(profiler.written[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
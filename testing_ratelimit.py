@@ -0,0 +1,273 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent import futures
+from unittest.mock import patch
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from auth import AuthInterceptor
+from chat_client import ChatClient, retry_after_s
+from ratelimit import AsyncRateLimitInterceptor, RateLimiter, RateLimitInterceptor
+import server
+from server import AsyncChatService, ChatService, sessions, storage, users_db
+
+
+def bearer(token):
+    return (("authorization", f"Bearer {token}"),)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    #a bucket starts full, drains one token per call and refills at `rate`
+    def test_token_bucket(self):
+        limiter = RateLimiter({"SendMessage": {"rate": 2, "burst": 3}})
+        self.assertEqual([limiter.acquire("alice", "SendMessage", now=10.0) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(limiter.acquire("alice", "SendMessage", now=10.0), 500)
+        self.assertEqual(limiter.acquire("alice", "SendMessage", now=10.25), 250)
+        self.assertEqual(limiter.acquire("alice", "SendMessage", now=10.5), 0)
+        # callers and methods have their own buckets; unlisted methods are never limited
+        self.assertEqual(limiter.acquire("bob", "SendMessage", now=10.5), 0)
+        self.assertEqual(limiter.acquire("alice", "ListMessages", now=10.5), 0)
+        self.assertEqual(limiter.rate_limited, 2)
+        # a long pause refills to the burst, not beyond
+        self.assertEqual([limiter.acquire("alice", "SendMessage", now=100.0) for _ in range(4)], [0, 0, 0, 500])
+
+    #the bucket table is an LRU: it stays at max_buckets and drops the least recently seen caller
+    def test_bounded(self):
+        limiter = RateLimiter({"Login": {"rate": 1, "burst": 1}}, max_buckets=2)
+        limiter.acquire("a", "Login", now=0.0)
+        limiter.acquire("b", "Login", now=0.0)
+        self.assertGreater(limiter.acquire("a", "Login", now=0.0), 0)
+        limiter.acquire("c", "Login", now=0.0)
+        self.assertEqual(len(limiter.buckets), 2)
+        self.assertEqual([caller for caller, _ in limiter.buckets], ["a", "c"])
+        # "b" was dropped, so it starts again with a full bucket
+        self.assertEqual(limiter.acquire("b", "Login", now=0.0), 0)
+
+    def test_concurrency_cap(self):
+        limiter = RateLimiter(max_concurrent=2)
+        self.assertTrue(limiter.enabled)
+        self.assertEqual([limiter.enter(), limiter.enter(), limiter.enter()], [True, True, False])
+        limiter.leave()
+        self.assertTrue(limiter.enter())
+        self.assertEqual(limiter.over_capacity, 1)
+        self.assertFalse(RateLimiter({"Login": {"rate": 0}}).enabled)
+
+    #the thread-pool server refuses a cap it could never reach with its workers
+    def test_cap_below_workers(self):
+        with patch.object(server, "rate_limiter", RateLimiter(max_concurrent=server.MAX_WORKERS)):
+            with self.assertRaises(SystemExit):
+                server.check_thread_budget()
+        with patch.object(server, "rate_limiter", RateLimiter(max_concurrent=server.MAX_WORKERS - 1)):
+            server.check_thread_budget()
+        # open streams hold workers as well
+        with patch.object(server, "rate_limiter", RateLimiter(max_concurrent=server.MAX_WORKERS - 2, max_streams=2)):
+            with self.assertRaises(SystemExit):
+                server.check_thread_budget()
+
+    def test_stream_cap(self):
+        limiter = RateLimiter(max_streams=1)
+        self.assertTrue(limiter.enabled)
+        self.assertEqual([limiter.enter_stream(), limiter.enter_stream()], [True, False])
+        limiter.leave_stream()
+        self.assertTrue(limiter.enter_stream())
+        self.assertEqual(limiter.over_capacity, 1)
+
+
+class TestRateLimitInterceptor(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        sessions.sessions.clear()
+        self.limiter = RateLimiter({"SendMessage": {"rate": 0.001, "burst": 2},
+                                    "CreateAccount": {"rate": 0.001, "burst": 3}}, max_concurrent=1)
+        interceptors = [RateLimitInterceptor(self.limiter, sessions), AuthInterceptor(sessions)]
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), interceptors=interceptors)
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.channel = grpc.insecure_channel(f"localhost:{port}")
+        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+        for name in ("alice", "bob"):
+            self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+        self.tokens = {name: self.stub.Login(chat_pb2.LoginRequest(username=name, password="pw")).session_token
+                       for name in ("alice", "bob")}
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(0)
+
+    def send(self, sender):
+        return self.stub.SendMessage(chat_pb2.SendMessageRequest(sender=sender, to="bob", content="hi"),
+                                     metadata=bearer(self.tokens[sender]))
+
+    #over its burst a user gets RESOURCE_EXHAUSTED with a retry-after hint; other users are unaffected
+    def test_per_user_limit(self):
+        self.assertTrue(self.send("alice").success)
+        self.assertTrue(self.send("alice").success)
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.send("alice")
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+        self.assertGreater(retry_after_s(caught.exception), 1)
+        self.assertIn("retry after", caught.exception.details())
+        self.assertTrue(self.send("bob").success)
+        self.assertEqual(self.limiter.rate_limited, 1)
+
+    #calls without a session are charged to the client's address
+    def test_sessionless_calls_share_the_peer_bucket(self):
+        self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username="carol", password="pw"))
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username="dave", password="pw"))
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+        self.assertNotIn("dave", users_db)
+
+    #a call over the concurrency cap is turned away at once rather than queued
+    def test_busy(self):
+        started = threading.Event()
+        release = threading.Event()
+        original = storage.search
+
+        def slow(*args):
+            started.set()
+            release.wait(5)
+            return original(*args)
+
+        storage.search = slow
+        try:
+            pending = self.stub.ListAccounts.future(chat_pb2.ListAccountsRequest(pattern=""), metadata=bearer(self.tokens["alice"]))
+            self.assertTrue(started.wait(5))
+            with self.assertRaises(grpc.RpcError) as caught:
+                self.stub.ListAccounts(chat_pb2.ListAccountsRequest(pattern=""), metadata=bearer(self.tokens["bob"]))
+            release.set()
+            self.assertEqual(list(pending.result().accounts), ["alice", "bob"])
+        finally:
+            del storage.search
+            release.set()
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+        self.assertEqual(retry_after_s(caught.exception), 0.05)
+        self.assertEqual(self.limiter.running, 0)
+
+
+#open Subscribe streams never take every worker of the thread pool
+class TestStreamCap(unittest.TestCase):
+    WORKERS = 4
+
+    def setUp(self):
+        users_db.clear()
+        sessions.sessions.clear()
+        self.limiter = RateLimiter(max_streams=2)
+        interceptors = [RateLimitInterceptor(self.limiter, sessions), AuthInterceptor(sessions)]
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.WORKERS), interceptors=interceptors)
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.target = f"localhost:{port}"
+        self.channel = grpc.insecure_channel(self.target)
+        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+        self.stub.CreateAccount(chat_pb2.CreateAccountRequest(username="alice", password="pw"))
+        self.token = self.stub.Login(chat_pb2.LoginRequest(username="alice", password="pw")).session_token
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(0)
+
+    def subscribe(self):
+        return self.stub.Subscribe(chat_pb2.SubscribeRequest(username="alice"), metadata=bearer(self.token))
+
+    def test_unary_calls_get_a_worker(self):
+        streams = [self.subscribe(), self.subscribe()]
+        try:
+            deadline = time.time() + 5
+            while self.limiter.streams < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            # the streams over the cap end at once
+            for _ in range(self.WORKERS - 2):
+                stream = self.subscribe()
+                streams.append(stream)
+                with self.assertRaises(grpc.RpcError) as caught:
+                    next(stream)
+                self.assertEqual(caught.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+            self.assertEqual(self.limiter.streams, 2)
+            response = self.stub.ListAccounts(chat_pb2.ListAccountsRequest(pattern=""), metadata=bearer(self.token), timeout=5)
+            self.assertEqual(list(response.accounts), ["alice"])
+        finally:
+            for stream in streams:
+                stream.cancel()
+
+    def wait_for_streams(self, count):
+        deadline = time.time() + 5
+        while self.limiter.streams != count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.limiter.streams, count)
+
+    #a client subscription turned away by the cap keeps retrying, and gets in once a stream closes
+    def test_client_waits_for_a_stream(self):
+        streams = [self.subscribe(), self.subscribe()]
+        client = ChatClient(self.target)
+        subscription = None
+        try:
+            self.wait_for_streams(2)
+            self.assertTrue(client.create_account("bob", "pw").result(timeout=10).success)
+            self.assertTrue(client.login("bob", "pw").result(timeout=10).success)
+            received = []
+            arrived = threading.Event()
+            ended = []
+
+            def on_message(message):
+                received.append(message.content)
+                arrived.set()
+            subscription = client.subscribe(on_message, ended.append)
+            time.sleep(0.3)
+            self.assertTrue(subscription.thread.is_alive())
+            streams.pop().cancel()
+            self.wait_for_streams(2)
+            sent = self.stub.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="room now"),
+                                         metadata=bearer(self.token))
+            self.assertTrue(sent.success)
+            self.assertTrue(arrived.wait(10))
+            self.assertEqual((received, ended), (["room now"], []))
+        finally:
+            if subscription is not None:
+                subscription.cancel()
+            for stream in streams:
+                stream.cancel()
+            client.close()
+
+
+class TestAsyncRateLimitInterceptor(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        sessions.sessions.clear()
+
+    def test_async_server_limits_calls(self):
+        limiter = RateLimiter({"CreateAccount": {"rate": 0.001, "burst": 1}})
+
+        async def scenario():
+            server = grpc.aio.server(interceptors=[AsyncRateLimitInterceptor(limiter, sessions)])
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncChatService(), server)
+            port = server.add_insecure_port("localhost:0")
+            await server.start()
+            try:
+                async with grpc.aio.insecure_channel(f"localhost:{port}") as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    created = await stub.CreateAccount(chat_pb2.CreateAccountRequest(username="alice", password="pw"))
+                    try:
+                        await stub.CreateAccount(chat_pb2.CreateAccountRequest(username="bob", password="pw"))
+                    except grpc.aio.AioRpcError as e:
+                        return created, e
+            finally:
+                await server.stop(0)
+
+        created, error = asyncio.run(scenario())
+        self.assertTrue(created.success)
+        self.assertEqual(error.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+        self.assertGreater(retry_after_s(error), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent import futures
+from unittest.mock import MagicMock, patch
+
+import grpc
+
+import chat_pb2
+import chat_pb2_grpc
+from groups import GroupStore
+from persistence import CATCH_UP_PREFIX, WriteAheadLog, dump_users
+from replication import MAX_CATCH_UPS, SECRET_HEADER, Replica, ReplicationFeed, ReplicationService, apply_replicated
+from server import MessageIds
+from storage import MemoryStorage
+from store import UserStore
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+T0 = 1735732800000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class TestReplicationFeed(unittest.TestCase):
+
+    def test_after(self):
+        feed = ReplicationFeed(backlog=10)
+        feed.publish(1, [f"r{i}\n" for i in range(1, 4)])
+        self.assertEqual(feed.after(0, 2, 0), (["r1", "r2"], 3))
+        self.assertEqual(feed.after(3, 2, 0), ([], 3))
+        self.assertTrue(feed.holds(3))
+        self.assertFalse(feed.holds(4))
+
+    #old records are trimmed a tenth at a time past the backlog; a follower needing them must catch up
+    def test_trim(self):
+        feed = ReplicationFeed(backlog=10)
+        for seq in range(1, 13):
+            feed.publish(seq, [f"r{seq}\n"])
+        self.assertEqual(feed.after(11, 5, 0), (["r12"], 12))
+        self.assertIsNone(feed.after(1, 5, 0)[0])
+        self.assertFalse(feed.holds(1))
+        feed.followers["stream"] = 9
+        self.assertEqual(feed.max_lag(), 3)
+
+
+#a primary (WAL + MemoryStorage + ReplicationService) and followers, all in this process
+class TestReplication(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.users, self.groups = UserStore(), GroupStore()
+        self.wal = WriteAheadLog(self.data_dir, fsync="off", fsync_interval_ms=1, snapshot_interval_s=3600)
+        self.wal.recover(self.users, self.groups)
+        self.feed = ReplicationFeed(backlog=20)
+        self.wal.feed = self.feed
+        self.wal.start()
+        self.addCleanup(self.wal.close)
+        self.storage = MemoryStorage(self.users, self.wal.append, MessageIds(), self.groups)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationService(self.wal, self.feed, "secret", heartbeat_ms=20), self.server)
+        self.address = f"127.0.0.1:{self.server.add_insecure_port('127.0.0.1:0')}"
+        self.server.start()
+        self.addCleanup(self.server.stop, 0)
+
+    def follow(self, users=None, groups=None, epoch="", applied_seq=0):
+        replica = Replica(self.address, "secret", "test", users or UserStore(), groups or GroupStore(), retry_s=0.05)
+        replica.epoch, replica.applied_seq = epoch, applied_seq
+        replica.start()
+        self.addCleanup(replica.stop)
+        return replica
+
+    #wait until the follower has applied everything logged so far, then compare it with the primary
+    def assert_level(self, replica):
+        wait_for(lambda: self.wal.durable_seq == self.wal.appended_seq)
+        wait_for(lambda: replica.synced and replica.applied_seq == self.wal.durable_seq)
+        self.assertEqual(dump_users(replica.users), dump_users(self.users))
+        self.assertEqual(replica.groups.dump(), self.groups.dump())
+        self.assertGreaterEqual(replica.staleness_ms(), 0)
+
+    def workload(self, tag):
+        for name in ("alice", "bob", "carol"):
+            self.storage.create_account(f"{name}{tag}", "hash")
+        for i in range(4):
+            self.storage.append(f"alice{tag}", f"bob{tag}", f"m{i}", T0)
+        self.storage.take_unread(f"bob{tag}", 2)
+        self.storage.delete_ids(f"bob{tag}", [self.storage.export_user(f"bob{tag}")["read"][0]["id"]])
+        self.storage.create_group(f"team{tag}", f"alice{tag}")
+        self.storage.join_group(f"team{tag}", f"bob{tag}")
+        self.storage.append_group(f"team{tag}", f"alice{tag}", "standup", T0)
+        self.storage.take_group_unread(f"bob{tag}", 0)
+        self.storage.drop_account(f"carol{tag}")
+
+    #a new follower loads the snapshot and the segments after it, then follows live records
+    def test_catch_up_then_live(self):
+        self.workload("1")
+        self.wal.compact()
+        self.workload("2")
+        replica = self.follow()
+        self.assert_level(replica)
+        self.assertEqual(replica.resets, 1)
+        self.workload("3")
+        self.assert_level(replica)
+        self.assertEqual(replica.resets, 1)
+        self.assertEqual(replica.lag(), 0)
+
+    #a follower that reconnects resumes where it stopped if the primary still holds the records,
+    #and catches up from disk again if it fell further behind than the backlog
+    def test_resume_and_fall_behind(self):
+        first = self.follow()
+        self.workload("1")
+        self.assert_level(first)
+        first.stop()
+        self.storage.append("alice1", "bob1", "while away", T0)
+        resumed = self.follow(first.users, first.groups, first.epoch, first.applied_seq)
+        self.assert_level(resumed)
+        self.assertEqual(resumed.resets, 0)
+        resumed.stop()
+        for i in range(30):
+            self.storage.append("alice1", "bob1", f"away {i}", T0)
+        behind = self.follow(resumed.users, resumed.groups, resumed.epoch, resumed.applied_seq)
+        self.assert_level(behind)
+        self.assertEqual(behind.resets, 1)
+
+    #a catch-up streams from files linked aside, so compaction can run (and delete segments) meanwhile
+    def test_catch_up_does_not_hold_compaction(self):
+        self.workload("1")
+        with self.wal.catch_up() as (seq, lines):
+            self.workload("2")
+            compaction = threading.Thread(target=self.wal.compact)
+            compaction.start()
+            compaction.join(5)
+            self.assertFalse(compaction.is_alive())
+            users, groups = UserStore(), GroupStore()
+            for line in lines:
+                apply_replicated(users, groups, json.loads(line))
+        self.assertEqual(set(users), {"alice1", "bob1"})
+        self.assertEqual([name for name in os.listdir(self.data_dir) if name.startswith(CATCH_UP_PREFIX)], [])
+
+    #a follower that keeps falling behind the backlog is dropped rather than caught up forever
+    def test_gives_up_after_repeated_catch_ups(self):
+        self.workload("1")
+        service = ReplicationService(self.wal, self.feed, "secret")
+        context = MagicMock()
+        context.invocation_metadata.return_value = ((SECRET_HEADER, "secret"),)
+        context.abort.side_effect = grpc.RpcError()
+        batches = []
+        with patch.object(self.feed, "after", return_value=(None, 0)):
+            with self.assertRaises(grpc.RpcError):
+                for batch in service.Follow(chat_pb2.FollowRequest(name="slow"), context):
+                    batches.append(batch)
+        self.assertEqual(sum(1 for batch in batches if batch.reset), MAX_CATCH_UPS)
+        self.assertEqual(context.abort.call_args.args[0], grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+    def test_secret_required(self):
+        with grpc.insecure_channel(self.address) as channel:
+            stream = chat_pb2_grpc.ReplicationServiceStub(channel).Follow(chat_pb2.FollowRequest(name="x"), metadata=((SECRET_HEADER, "nope"),))
+            with self.assertRaises(grpc.RpcError) as caught:
+                next(stream)
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+
+    #reads are refused until the first catch-up, and once the follower has not matched the primary for too long
+    def test_read_error(self):
+        replica = Replica(self.address, "secret", "test", UserStore(), GroupStore(), max_staleness_ms=100)
+        self.addCleanup(replica.channel.close)
+        self.assertIn("catching up", replica.read_error())
+        replica.receive(chat_pb2.ReplicationBatch(reset=True, synced=True, seq=3, primary_seq=3, epoch="e"))
+        self.assertIsNone(replica.read_error())
+        replica.caught_up_at -= 1
+        self.assertIn("ago", replica.read_error())
+
+
+#a primary and a follower as separate server processes on local ports
+class TestFollowerProcess(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdirs = []
+        cls.processes = []
+        ports = free_port(), free_port()
+        base = {"server_host": "127.0.0.1", "auth": {"scrypt_n": 1024}, "rate_limits": {}, "logging": {"level": "WARNING"}}
+        primary = dict(base, server_port=ports[0], persistence={"enabled": True, "data_dir": "data", "fsync": "batch"},
+                       replication={"role": "primary", "secret": "s3cret", "heartbeat_ms": 50})
+        follower = dict(base, server_port=ports[1], persistence={"enabled": False},
+                        replication={"role": "follower", "secret": "s3cret", "primary": f"127.0.0.1:{ports[0]}", "max_staleness_ms": 2000})
+        for overrides in (primary, follower):
+            workdir = tempfile.mkdtemp()
+            with open(os.path.join(REPO_ROOT, "config.json")) as f:
+                config = json.load(f)
+            config.update(overrides)
+            with open(os.path.join(workdir, "config.json"), "w") as f:
+                json.dump(config, f)
+            cls.workdirs.append(workdir)
+            cls.processes.append(subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "server.py")], cwd=workdir,
+                                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        cls.channels = [grpc.insecure_channel(f"127.0.0.1:{port}") for port in ports]
+        cls.primary, cls.follower = (chat_pb2_grpc.ChatServiceStub(channel) for channel in cls.channels)
+
+    @classmethod
+    def tearDownClass(cls):
+        for channel in cls.channels:
+            channel.close()
+        for process in reversed(cls.processes):
+            process.terminate()
+            process.wait(timeout=15)
+        for workdir in cls.workdirs:
+            shutil.rmtree(workdir)
+
+    #call the follower until it has caught up far enough to answer
+    def on_follower(self, method, request, metadata=None, ready=lambda response: True):
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                response = getattr(self.follower, method)(request, metadata=metadata, wait_for_ready=True, timeout=20)
+                if ready(response) or time.monotonic() > deadline:
+                    return response
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNAVAILABLE or time.monotonic() > deadline:
+                    raise
+            time.sleep(0.05)
+
+    def test_follower_serves_reads(self):
+        for name in ("alice", "bob"):
+            created = self.primary.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), wait_for_ready=True, timeout=20)
+            self.assertTrue(created.success)
+        token = self.primary.Login(chat_pb2.LoginRequest(username="alice", password="pw")).session_token
+        self.primary.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content="replicated"),
+                                 metadata=(("authorization", f"Bearer {token}"),))
+
+        login = self.on_follower("Login", chat_pb2.LoginRequest(username="bob", password="pw"),
+                                 ready=lambda response: response.unread_count == 1)
+        self.assertTrue(login.success)
+        bearer = (("authorization", f"Bearer {login.session_token}"),)
+        accounts = self.on_follower("ListAccounts", chat_pb2.ListAccountsRequest(username="bob"), bearer)
+        self.assertEqual(list(accounts.accounts), ["alice", "bob"])
+        # the sender's copy is replicated with the message
+        alice = self.on_follower("Login", chat_pb2.LoginRequest(username="alice", password="pw"))
+        conversation = self.on_follower("ConversationHistory", chat_pb2.ConversationHistoryRequest(username="alice", peer="bob"),
+                                        (("authorization", f"Bearer {alice.session_token}"),))
+        self.assertEqual([(m.sender, m.content) for m in conversation.messages], [("alice", "replicated")])
+        with self.assertRaises(grpc.RpcError) as caught:
+            self.follower.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username="bob"), metadata=bearer)
+        self.assertEqual(caught.exception.code(), grpc.StatusCode.FAILED_PRECONDITION)
+
+        stats = self.follower.GetStats(chat_pb2.GetStatsRequest())
+        self.assertEqual(stats.replication_lag_records, 0)
+        self.assertGreaterEqual(stats.replication_staleness_ms, 0)
+        self.assertEqual(self.primary.GetStats(chat_pb2.GetStatsRequest()).replication_followers, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import chat_pb2
+
+import server
+from server import ChatService, users_db
+from inbox import Inbox, Message
+from persistence import WriteAheadLog, dump_users
+from retention import MessageArchive, RetentionPolicy, RetentionSweeper
+
+T0 = 1735732800000
+DAY = 86400 * 1000
+
+
+def inbox_with(read_timestamps, unread=0):
+    inbox = Inbox()
+    for i, timestamp in enumerate(read_timestamps, start=1):
+        inbox.append(Message(i, "bob", f"m{i}", timestamp))
+    inbox.take_unread(0)
+    for i in range(len(read_timestamps) + 1, len(read_timestamps) + 1 + unread):
+        inbox.append(Message(i, "bob", f"m{i}", T0))
+    return inbox
+
+
+class TestRetentionPolicy(unittest.TestCase):
+
+    def test_ttl_evicts_old_read_messages_only(self):
+        inbox = inbox_with([T0, T0 + DAY, T0 + 5 * DAY], unread=2)
+        victims = RetentionPolicy(read_ttl_s=2 * 86400).select(inbox, T0 + 5 * DAY)
+        self.assertEqual([m.id for m in victims], [1, 2])
+
+    #over the cap, the oldest read messages go until the inbox is at 90% of it
+    def test_cap_trims_below_the_limit(self):
+        inbox = inbox_with([T0] * 15, unread=5)
+        victims = RetentionPolicy(max_messages=10).select(inbox, T0)
+        self.assertEqual([m.id for m in victims], list(range(1, 12)))
+        self.assertEqual(RetentionPolicy(max_messages=20).select(inbox, T0), [])
+
+    #sent copies expire like read mail, and over the cap only the sent copies are trimmed
+    def test_sent_copies(self):
+        inbox = inbox_with([T0])
+        for i in range(10, 20):
+            inbox.add_sent("carol", Message(i, "alice", f"s{i}", T0 + (i - 10) * DAY))
+        policy = RetentionPolicy(read_ttl_s=2 * 86400, max_messages=8)
+        self.assertEqual([m.id for m in policy.select_sent(inbox, T0 + 6 * DAY)], [10, 11, 12, 13])
+        self.assertEqual([m.id for m in RetentionPolicy(max_messages=8).select_sent(inbox, T0)], [10, 11, 12])
+        self.assertEqual(RetentionPolicy(max_messages=8).select(inbox, T0), [])
+        self.assertEqual(inbox.delete_sent([10, 11, 99]), 2)
+        self.assertEqual(len(inbox.sent), 8)
+        self.assertEqual(len(inbox.read), 1)
+
+    def test_unread_is_never_evicted(self):
+        inbox = inbox_with([T0], unread=10)
+        victims = RetentionPolicy(read_ttl_s=1, max_messages=2).select(inbox, T0 + DAY)
+        self.assertEqual([m.id for m in victims], [1])
+
+
+class TestMessageArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = MessageArchive(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def messages(self, first, last):
+        return [Message(i, "alice", f"m{i}", T0 + i) for i in range(first, last + 1)]
+
+    def test_pages_newest_first(self):
+        for first in (1, 11, 21):
+            self.archive.append("bob", self.messages(first, first + 9))
+        page, before = self.archive.page("bob", limit=10)
+        self.assertEqual([m.id for m in page], list(range(21, 31)))
+        self.assertEqual(before, 21)
+        page, before = self.archive.page("bob", before, limit=15)
+        self.assertEqual([m.id for m in page], list(range(1, 21)))
+        self.assertEqual(before, 0)
+        self.assertEqual(page[0].content, "m1")
+
+    def test_delete_and_drop(self):
+        self.archive.append("bob", self.messages(1, 5))
+        self.archive.append("bob", self.messages(6, 6))
+        self.assertEqual(self.archive.delete_ids("bob", [2, 6, 99]), 2)
+        self.assertEqual([m.id for m in self.archive.take_all("bob")], [1, 3, 4, 5])
+        self.archive.drop("bob")
+        self.assertFalse(self.archive.has("bob"))
+        self.assertEqual(self.archive.page("bob"), ([], 0))
+
+
+class TestRetentionSweeper(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        users_db.clear()
+        self.service = ChatService()
+        self.context = MagicMock()
+        server.wal = self.open_wal()
+        server.archive = MessageArchive(self.data_dir + "/archive")
+        self.sweeper = RetentionSweeper(server.storage, RetentionPolicy(max_messages=4), server.archive,
+                                        server.commit_mutation, pause_s=0)
+        for name in ("alice", "bob"):
+            self.service.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), self.context)
+        for i in range(10):
+            self.service.SendMessage(chat_pb2.SendMessageRequest(sender="alice", to="bob", content=f"m{i}"), self.context)
+        self.service.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username="bob", count=8), self.context)
+
+    def tearDown(self):
+        server.wal.close()
+        server.wal = None
+        server.archive = None
+        users_db.clear()
+        shutil.rmtree(self.data_dir)
+
+    def open_wal(self, db=None):
+        wal = WriteAheadLog(self.data_dir, fsync="always", fsync_interval_ms=1, snapshot_interval_s=3600)
+        wal.recover({} if db is None else db)
+        wal.start()
+        return wal
+
+    def list_messages(self, **kwargs):
+        return self.service.ListMessages(chat_pb2.ListMessagesRequest(username="bob", **kwargs), self.context)
+
+    #8 read + 2 unread over a cap of 4: the 7 oldest read messages move to the archive.
+    #alice's 10 sent copies have a cap of their own, and 7 of them are dropped
+    def test_sweep_archives_and_pages_back(self):
+        self.assertEqual(self.sweeper.sweep(), 14)
+        self.assertEqual(len(users_db["bob"]["inbox"]), 3)
+        self.assertEqual([m.content for _, m in users_db["alice"]["inbox"].sent.values()], ["m7", "m8", "m9"])
+        listed = self.list_messages()
+        self.assertEqual([m.content for m in listed.messages], ["m7"])
+        self.assertTrue(listed.has_archived)
+        archived = self.list_messages(archived=True, page_size=5)
+        self.assertEqual([m.content for m in archived.messages], [f"m{i}" for i in range(7)])
+        self.assertEqual(self.sweeper.sweep(), 0)
+
+    #deleting by id reaches archived messages too; delete_all empties the archive
+    def test_delete_reaches_the_archive(self):
+        self.sweeper.sweep()
+        first = self.list_messages(archived=True).messages[0]
+        response = self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="bob", message_ids=[first.id]), self.context)
+        self.assertIn("Deleted 1", response.message)
+        self.assertEqual(len(self.list_messages(archived=True).messages), 6)
+        self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username="bob", delete_all=True), self.context)
+        self.assertFalse(server.archive.has("bob"))
+
+    #evictions are logged, so a restart does not bring evicted messages back into memory
+    def test_eviction_survives_restart(self):
+        self.sweeper.sweep()
+        expected = dump_users(users_db)
+        server.wal.close()
+        recovered = {}
+        server.wal = self.open_wal(recovered)
+        self.assertEqual(dump_users(recovered), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
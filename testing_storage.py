@@ -0,0 +1,135 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from retention import RetentionPolicy, RetentionSweeper
+from server import MessageIds
+from storage import SQLiteStorage, UnknownRecipient, UnknownSender
+
+T0 = 1735732800000
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "chat.db")
+        self.ids = MessageIds()
+        self.storage = self.open()
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+
+    def open(self, **options):
+        return SQLiteStorage(self.path, self.ids, **options)
+
+    def seed(self, messages=10, read=8):
+        for name in ("alice", "bob"):
+            self.assertEqual(self.storage.create_account(name, "hash"), (True, 0))
+        self.storage.append_batch("alice", [("bob", f"m{i}") for i in range(messages)], T0)
+        self.storage.take_unread("bob", read)
+
+    #a group message is one row; members' cursors move past it, history is capped, and both survive a reopen
+    def test_groups(self):
+        self.storage.close()
+        self.storage = self.open(group_history=3)
+        self.seed(messages=0, read=0)
+        self.assertEqual(self.storage.create_group("team", "alice"), (True, 0))
+        self.assertEqual(self.storage.join_group("team", "bob"), (True, 0))
+        ids = [self.storage.append_group("team", "alice", f"g{i}", T0)[0] for i in range(5)]
+        self.assertEqual(self.storage.reader().execute("SELECT COUNT(*) FROM group_messages").fetchone()[0], 3)
+        taken, _ = self.storage.take_group_unread("bob", 2)
+        self.assertEqual([(name, m.content) for name, m in taken], [("team", "g2"), ("team", "g3")])
+        self.storage.close()
+        self.storage = self.open()
+        self.assertEqual(self.storage.groups_of("bob"), ["team"])
+        self.assertEqual(self.storage.group_unread_count("bob"), 1)
+        self.assertEqual(self.storage.group_unread_count("alice"), 3)
+        self.assertEqual(self.storage.last_message_id(), ids[-1])
+
+    #everything is on disk: a reopened database has the same users, and ids resume after the last one
+    def test_reopen(self):
+        self.seed()
+        expected = self.storage.export_user("bob")
+        self.storage.close()
+        self.storage = self.open()
+        self.assertEqual(self.storage.export_user("bob"), expected)
+        self.assertEqual(self.storage.search("", 0, ""), (["alice", "bob"], ""))
+        self.assertEqual(self.storage.last_message_id(), 10)
+        self.assertEqual(self.storage.unread_count("bob"), 2)
+
+    def test_unknown_users(self):
+        self.seed()
+        with self.assertRaises(UnknownSender):
+            self.storage.append("ghost", "bob", "hi", T0, check_sender=True)
+        with self.assertRaises(UnknownRecipient):
+            self.storage.append("alice", "ghost", "hi", T0)
+        self.assertEqual(self.storage.append_batch("alice", [("ghost", "x"), ("bob", "y")], T0)[0], [None, 11])
+        self.assertEqual(self.storage.take_unread("ghost", 0), (None, 0))
+        self.assertIsNone(self.storage.read_page("ghost", 0, 0))
+        self.assertEqual(self.storage.stats(), (2, 11, 11))
+
+    #the sweeper pages through a lazy cursor and deletes in one transaction
+    def test_retention_sweep(self):
+        self.seed()
+        sweeper = RetentionSweeper(self.storage, RetentionPolicy(max_messages=4), None, lambda seq: None, pause_s=0)
+        # bob's 7 oldest read messages, and 7 of alice's 10 sent copies
+        self.assertEqual(sweeper.sweep(), 14)
+        self.assertEqual([m.content for m in self.storage.read_page("bob", 0, 0)[0]], ["m7"])
+        self.assertEqual([m.content for m in self.storage.conversation("alice", "bob", 0, 0, 0)[0]], ["m7", "m8", "m9"])
+        self.assertEqual(self.storage.unread_count("bob"), 2)
+
+    #a user taken for another node comes back whole, and their stream watch is closed
+    def test_take_and_restore_user(self):
+        self.seed()
+        watch = self.storage.watch("bob")
+        data, _ = self.storage.take_user("bob")
+        self.assertTrue(watch.closed)
+        self.assertFalse(self.storage.exists("bob"))
+        self.assertIsNone(self.storage.watch("bob"))
+        self.storage.restore_user("bob", data)
+        self.assertEqual(self.storage.export_user("bob"), data)
+        self.assertEqual(self.storage.search("b", 0, ""), (["bob"], ""))
+
+    #sent copies are rows of their own: they outlive the recipient's copy, move with the sender and keep their ids in use
+    def test_conversation(self):
+        self.seed(messages=3, read=1)
+        self.storage.append("bob", "alice", "reply", T0)
+        # the sender's copy of a message another worker delivered
+        self.storage.append_sent("alice", "carol", 50, "far", T0)
+        contents = lambda page: ([m.content for m in page[0]],) + page[1:]
+        self.assertEqual(contents(self.storage.conversation("alice", "bob", 0, 0, 3)), (["m1", "m2", "reply"], True, False))
+        self.assertEqual(contents(self.storage.conversation("bob", "alice", 4, 1, 0)), (["m1", "m2"], True, True))
+        self.storage.delete_all("bob")
+        self.assertEqual(contents(self.storage.conversation("bob", "alice", 0, 0, 0)), ([], False, False))
+        self.assertEqual(contents(self.storage.conversation("alice", "bob", 0, 0, 0)), (["m0", "m1", "m2", "reply"], False, False))
+        self.assertEqual(self.storage.last_message_id(), 50)
+        data, _ = self.storage.take_user("alice")
+        self.assertEqual(self.storage.reader().execute("SELECT COUNT(*) FROM sent_messages").fetchone()[0], 0)
+        self.storage.restore_user("alice", data)
+        self.assertEqual(contents(self.storage.conversation("alice", "carol", 0, 0, 0)), (["far"], False, False))
+        self.assertIsNone(self.storage.conversation("ghost", "bob", 0, 0, 0))
+
+    #a database written before search existed is indexed when it is opened
+    def test_search_index_built_for_old_database(self):
+        self.storage.close()
+        os.remove(self.path)
+        db = sqlite3.connect(self.path)
+        db.executescript("""
+            CREATE TABLE accounts (username TEXT PRIMARY KEY, password TEXT NOT NULL) WITHOUT ROWID;
+            CREATE TABLE messages (id INTEGER PRIMARY KEY, recipient TEXT NOT NULL, sender TEXT NOT NULL,
+                                   content TEXT NOT NULL, timestamp INTEGER NOT NULL, read INTEGER NOT NULL DEFAULT 0);
+            INSERT INTO accounts VALUES ('bob', 'hash'), ('bob.smith', 'hash');
+            INSERT INTO messages VALUES (1, 'bob', 'alice', 'Lunch?', 0, 1), (2, 'bob.smith', 'alice', 'lunch', 0, 1);
+        """)
+        db.close()
+        self.storage = self.open()
+        self.assertEqual([m.id for m in self.storage.search_messages("bob", {"lunch"}, "", 0, 0, 0, 10)[0]], [1])
+        self.assertEqual([m.id for m in self.storage.search_messages("bob.smith", {"lunch"}, "", 0, 0, 0, 10)[0]], [2])
+        self.assertIsNone(self.storage.search_messages("ghost", {"lunch"}, "", 0, 0, 0, 10))
+
+if __name__ == "__main__":
+    unittest.main()
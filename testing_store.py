@@ -0,0 +1,126 @@
+import random
+import re
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+import chat_pb2
+
+from auth import check_password
+from server import ChatService, users_db
+from store import UserStore
+
+THREADS = 8
+OPS_PER_THREAD = 400
+USERS = [f"user{i}" for i in range(12)]
+
+
+class TestUserStore(unittest.TestCase):
+
+    #locking several users acquires each shard once, in ascending order
+    def test_locked_acquires_in_shard_order(self):
+        store = UserStore(shards=4)
+        with store.locked("a", "b", "c", "a"):
+            for name in ("a", "b", "c"):
+                self.assertTrue(store.shard_lock(name)._is_owned())
+
+    def test_dict_interface(self):
+        store = UserStore(shards=4)
+        self.assertTrue(store.add("alice", {"password": "pw"}))
+        self.assertFalse(store.add("alice", {"password": "other"}))
+        store["bob"] = {"password": "pw"}
+        self.assertEqual(sorted(store.keys()), ["alice", "bob"])
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.pop("alice")["password"], "pw")
+        self.assertNotIn("alice", store)
+        self.assertIsNone(store.pop("alice", None))
+
+
+class TestConcurrentHandlers(unittest.TestCase):
+
+    def setUp(self):
+        users_db.clear()
+        self.service = ChatService()
+        self.context = MagicMock()
+
+    #run `worker(thread_index)` on THREADS threads at once and re-raise the first failure
+    def run_threads(self, worker):
+        errors = []
+        barrier = threading.Barrier(THREADS)
+        def run(i):
+            barrier.wait()
+            try:
+                worker(i)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+    #racing creates of one name: exactly one wins
+    def test_concurrent_create_same_name(self):
+        wins = []
+        def worker(i):
+            response = self.service.CreateAccount(chat_pb2.CreateAccountRequest(username="dup", password=f"pw{i}"), self.context)
+            if response.success:
+                wins.append(i)
+        self.run_threads(worker)
+        self.assertEqual(len(wins), 1)
+        self.assertTrue(check_password(users_db["dup"]["password"], f"pw{wins[0]}"))
+
+    #sends, reads and deletes under contention never lose or duplicate messages
+    def test_send_read_delete_invariants(self):
+        for name in USERS:
+            self.service.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), self.context)
+        received = {name: [0] * THREADS for name in USERS}
+        deleted = {name: [0] * THREADS for name in USERS}
+
+        def worker(i):
+            rng = random.Random(i)
+            for n in range(OPS_PER_THREAD):
+                user = rng.choice(USERS)
+                op = rng.random()
+                if op < 0.6:
+                    to = rng.choice(USERS)
+                    response = self.service.SendMessage(chat_pb2.SendMessageRequest(sender=user, to=to, content=f"{i}:{n}"), self.context)
+                    self.assertTrue(response.success)
+                    received[to][i] += 1
+                elif op < 0.85:
+                    self.service.ReadNewMessages(chat_pb2.ReadNewMessagesRequest(username=user, count=rng.randint(0, 3)), self.context)
+                else:
+                    listed = self.service.ListMessages(chat_pb2.ListMessagesRequest(username=user), self.context).messages
+                    ids = [m.id for m in listed[:4]]
+                    rng.shuffle(ids)
+                    response = self.service.DeleteMessages(chat_pb2.DeleteMessagesRequest(username=user, message_ids=ids[:2] + [0]), self.context)
+                    deleted[user][i] += int(re.search(r"Deleted (\d+)", response.message).group(1))
+
+        self.run_threads(worker)
+        for name in USERS:
+            inbox = users_db[name]["inbox"]
+            self.assertEqual(len(inbox), sum(received[name]) - sum(deleted[name]))
+            self.assertEqual(inbox.unread_count, len(inbox.unread_messages()))
+            self.assertEqual(len(inbox), len(inbox.read) + inbox.unread_count)
+            contents = [m.content for m in inbox]
+            self.assertEqual(len(contents), len(set(contents)))
+
+    #deleting an account while others send to it leaves no half-deleted state behind
+    def test_delete_account_while_sending(self):
+        for name in ("target", "sender"):
+            self.service.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), self.context)
+        def worker(i):
+            for n in range(OPS_PER_THREAD):
+                if i == 0 and n == OPS_PER_THREAD // 2:
+                    self.assertTrue(self.service.DeleteAccount(chat_pb2.DeleteAccountRequest(username="target"), self.context).success)
+                self.service.SendMessage(chat_pb2.SendMessageRequest(sender="sender", to="target", content="x"), self.context)
+        self.run_threads(worker)
+        self.assertNotIn("target", users_db)
+        response = self.service.SendMessage(chat_pb2.SendMessageRequest(sender="sender", to="target", content="x"), self.context)
+        self.assertFalse(response.success)
+
+
+if __name__ == '__main__':
+    unittest.main()